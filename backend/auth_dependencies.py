@@ -1,14 +1,41 @@
 """
 FastAPI dependencies for authentication and authorization
 """
+import os
+import time
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from motor.motor_asyncio import AsyncIOMotorDatabase
 from auth_utils import TokenManager
 from bson import ObjectId
 
 security = HTTPBearer()
 
+# Short-lived cache of user documents by token subject, so polling clients don't
+# cost a users lookup per request. Admin status changes invalidate the entry;
+# other processes pick the change up within the TTL.
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '30'))
+USER_CACHE_MAX_ENTRIES = 10000
+_user_cache = {}  # sub -> (expires_at, user)
+
+
+def invalidate_cached_user(user_id: Optional[str] = None):
+    """Forget a cached user (everyone when user_id is None)"""
+    if user_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(str(user_id), None)
+
+
+def _cache_user(user_id: str, user: dict):
+    now = time.monotonic()
+    if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+        for key in [k for k, (expires_at, _) in _user_cache.items() if expires_at <= now]:
+            del _user_cache[key]
+        if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+            _user_cache.clear()
+    _user_cache[user_id] = (now + USER_CACHE_TTL_SECONDS, user)
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -32,6 +59,10 @@ async def get_current_user(
     if user_id is None:
         raise credentials_exception
     
+    cached = _user_cache.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1])  # Copy: handlers must not alter the cached document
+    
     # Retrieve user from database
     users_collection = db["users"]
     try:
@@ -48,6 +79,9 @@ async def get_current_user(
     if user is None:
         raise credentials_exception
     
+    if USER_CACHE_TTL_SECONDS > 0:
+        _cache_user(user_id, user)
+        return dict(user)
     return user
 
 
@@ -1,8 +1,11 @@
 """
 Authentication utilities for JWT token management and password hashing
 """
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
+import asyncio
 import bcrypt
 from jose import JWTError, jwt
 import os
@@ -12,6 +15,107 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-change-in-production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
+# bcrypt (~250 ms per call) runs in its own small thread pool, never on the event loop
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+# Hash calls queued + running before new ones are refused (AuthBusyError)
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", str(AUTH_HASH_WORKERS * 8)))
+# Concurrent login/register attempts per username (over it: immediate 429)
+AUTH_MAX_CONCURRENT_PER_KEY = int(os.getenv("AUTH_MAX_CONCURRENT_PER_KEY", "2"))
+# Per client IP, attempts over the cap wait in a bounded queue instead: a whole office
+# behind one NAT (or every client when TRUSTED_PROXY_COUNT is unset) shares this key
+AUTH_MAX_CONCURRENT_PER_IP = int(os.getenv("AUTH_MAX_CONCURRENT_PER_IP", str(AUTH_HASH_WORKERS * 2)))
+AUTH_IP_MAX_WAITING = int(os.getenv("AUTH_IP_MAX_WAITING", str(AUTH_HASH_MAX_PENDING)))
+AUTH_IP_WAIT_SECONDS = float(os.getenv("AUTH_IP_WAIT_SECONDS", "5"))
+
+_hash_executor = None
+_hash_pending = 0
+
+
+class AuthBusyError(Exception):
+    """Password hashing queue is full"""
+
+
+async def _run_hash(fn, *args):
+    global _hash_executor, _hash_pending
+    if _hash_pending >= AUTH_HASH_MAX_PENDING:
+        raise AuthBusyError()
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+
+class ConcurrencyCap:
+    """At most `limit` concurrent holders per key (client IP, username...), up to `max_waiting` more queued"""
+    def __init__(self, limit: int, max_waiting: int = 0):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = {}
+        self.waiters = {}  # key -> deque of futures, first in first served
+    
+    def try_acquire(self, *keys) -> bool:
+        if any(self.active.get(key, 0) >= self.limit or self.waiters.get(key) for key in keys):
+            return False
+        for key in keys:
+            self.active[key] = self.active.get(key, 0) + 1
+        return True
+    
+    async def acquire(self, key, timeout: float) -> bool:
+        """Wait up to timeout seconds for a slot; False when the queue is full or the wait timed out"""
+        if self.try_acquire(key):
+            return True
+        waiters = self.waiters.setdefault(key, deque())
+        if len(waiters) >= self.max_waiting:
+            if not waiters:
+                del self.waiters[key]
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter], timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release(key)  # Slot was handed over just before the cancel
+            else:
+                self._drop_waiter(key, waiter)
+            raise
+        if waiter.done():
+            return True
+        self._drop_waiter(key, waiter)
+        return False
+    
+    def _drop_waiter(self, key, waiter):
+        waiter.cancel()
+        waiters = self.waiters.get(key)
+        if waiters is not None:
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                del self.waiters[key]
+    
+    def release(self, *keys):
+        for key in keys:
+            waiters = self.waiters.get(key)
+            if waiters:
+                # Hand the slot straight to the next waiter: the active count stays the same
+                waiters.popleft().set_result(None)
+                if not waiters:
+                    del self.waiters[key]
+                continue
+            remaining = self.active.get(key, 0) - 1
+            if remaining > 0:
+                self.active[key] = remaining
+            else:
+                self.active.pop(key, None)
+
+
+auth_attempts = ConcurrencyCap(AUTH_MAX_CONCURRENT_PER_KEY)
+auth_ip_slots = ConcurrencyCap(AUTH_MAX_CONCURRENT_PER_IP, AUTH_IP_MAX_WAITING)
+
+
 class PasswordHasher:
     @staticmethod
     def hash_password(password: str) -> str:
@@ -27,6 +131,16 @@ class PasswordHasher:
         password_bytes = plain_password.encode('utf-8')
         hashed_bytes = hashed_password.encode('utf-8')
         return bcrypt.checkpw(password_bytes, hashed_bytes)
+    
+    @staticmethod
+    async def hash_password_async(password: str) -> str:
+        """hash_password in the bcrypt thread pool"""
+        return await _run_hash(PasswordHasher.hash_password, password)
+    
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        """verify_password in the bcrypt thread pool"""
+        return await _run_hash(PasswordHasher.verify_password, plain_password, hashed_password)
 
 
 class TokenManager:
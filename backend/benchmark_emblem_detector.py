@@ -0,0 +1,69 @@
+"""
+Benchmark: local emblem detector vs GPT-4o emblem answer
+Runs both on the same top-30% crops (as smart_crop_and_analyze does) and reports
+the agreement rate, disagreements and latency per image.
+
+Usage:
+    python benchmark_emblem_detector.py <image_dir> [--out emblem_benchmark_results.json]
+
+Needs the backend .env (EMERGENT_LLM_KEY, MONGO_URL) for the LLM side.
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from image_processing import resize_image_for_api, detect_emblem
+from server import detect_emblem_with_llm
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+async def run_benchmark(image_dir: Path) -> dict:
+    images = sorted(p for p in image_dir.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+    rows = []
+    for path in images:
+        # Same crop as PASS 1 of smart_crop_and_analyze
+        crop = resize_image_for_api(path.read_bytes(), max_size=800, crop_top_only=True, crop_percentage=0.30)
+
+        start = time.perf_counter()
+        local = detect_emblem(crop)
+        local_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        llm = await detect_emblem_with_llm(crop)
+        llm_ms = (time.perf_counter() - start) * 1000
+
+        rows.append({"file": str(path.relative_to(image_dir)), "local": local, "llm": llm, "local_ms": round(local_ms, 1), "llm_ms": round(llm_ms, 1)})
+        print(f"{'✅' if local == llm else '❌'} {path.name}: local={local} llm={llm} ({local_ms:.0f}ms vs {llm_ms:.0f}ms)")
+
+    total = len(rows)
+    agree = sum(r["local"] == r["llm"] for r in rows)
+    return {
+        "total_images": total,
+        "agreement_rate": round(agree / total, 4) if total else None,
+        "local_yes_llm_no": [r["file"] for r in rows if r["local"] and not r["llm"]],
+        "local_no_llm_yes": [r["file"] for r in rows if r["llm"] and not r["local"]],
+        "avg_local_ms": round(sum(r["local_ms"] for r in rows) / total, 1) if total else None,
+        "avg_llm_ms": round(sum(r["llm_ms"] for r in rows) / total, 1) if total else None,
+        "results": rows,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare local emblem detector with the GPT-4o answer")
+    parser.add_argument("image_dir", type=Path)
+    parser.add_argument("--out", type=Path, default=Path("emblem_benchmark_results.json"))
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_benchmark(args.image_dir))
+    print("\n" + "=" * 60)
+    print(f"Images: {summary['total_images']}")
+    if summary["total_images"]:
+        print(f"Agreement: {summary['agreement_rate'] * 100:.1f}%")
+        print(f"Local YES / LLM NO: {len(summary['local_yes_llm_no'])}")
+        print(f"Local NO / LLM YES: {len(summary['local_no_llm_yes'])}")
+        print(f"Avg latency: local {summary['avg_local_ms']}ms vs LLM {summary['avg_llm_ms']}ms")
+    args.out.write_text(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"Saved: {args.out}")
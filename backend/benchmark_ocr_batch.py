@@ -0,0 +1,71 @@
+"""
+Benchmark: per-page PaddleOCR vs cross-page batched recognition
+Runs the same pages through run_ocr (one full pipeline per page), run_ocr_batch
+with angle classification and run_ocr_batch for upright pages, then reports
+pages/sec and how often the batched text matches the per-page text.
+
+Usage:
+    python benchmark_ocr_batch.py <image_dir> [--batch 8] [--out ocr_batch_benchmark_results.json]
+
+Set OCR_REC_BATCH to try other recognition batch sizes.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from ocr_engine import get_ocr_instance, run_ocr, run_ocr_batch, OCR_REC_BATCH
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+def run_benchmark(image_dir: Path, batch_size: int) -> dict:
+    paths = sorted(p for p in image_dir.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+    pages = [p.read_bytes() for p in paths]
+    get_ocr_instance()  # Model load is not part of the timings
+
+    start = time.perf_counter()
+    baseline = [run_ocr(page)["text"] for page in pages]
+    timings = {"per_page": time.perf_counter() - start}
+    texts = {}
+    for mode, upright in (("batch", False), ("batch_upright", True)):
+        start = time.perf_counter()
+        texts[mode] = [
+            result["text"]
+            for i in range(0, len(pages), batch_size)
+            for result in run_ocr_batch(pages[i:i + batch_size], upright=upright)
+        ]
+        timings[mode] = time.perf_counter() - start
+
+    total = len(pages)
+    summary = {"total_pages": total, "batch_pages": batch_size, "rec_batch": OCR_REC_BATCH}
+    for mode, seconds in timings.items():
+        summary[mode] = {
+            "seconds": round(seconds, 2),
+            "pages_per_second": round(total / seconds, 2) if seconds else None,
+        }
+        if mode in texts:
+            same = sum(a == b for a, b in zip(baseline, texts[mode]))
+            summary[mode]["text_match_rate"] = round(same / total, 4) if total else None
+            summary[mode]["mismatches"] = [
+                str(p.relative_to(image_dir)) for p, a, b in zip(paths, baseline, texts[mode]) if a != b
+            ]
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-page and batched PaddleOCR throughput")
+    parser.add_argument("image_dir", type=Path)
+    parser.add_argument("--batch", type=int, default=8, help="Pages per run_ocr_batch call")
+    parser.add_argument("--out", type=Path, default=Path("ocr_batch_benchmark_results.json"))
+    args = parser.parse_args()
+
+    summary = run_benchmark(args.image_dir, args.batch)
+    print("\n" + "=" * 60)
+    print(f"Pages: {summary['total_pages']} (batch {summary['batch_pages']} pages, rec_batch_num {summary['rec_batch']})")
+    for mode in ("per_page", "batch", "batch_upright"):
+        row = summary[mode]
+        match = f", text match {row['text_match_rate'] * 100:.1f}%" if row.get("text_match_rate") is not None else ""
+        print(f"{mode:>14}: {row['pages_per_second']} pages/s ({row['seconds']}s){match}")
+    args.out.write_text(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"Saved: {args.out}")
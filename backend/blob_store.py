@@ -0,0 +1,58 @@
+"""
+Content-addressed store for scanned page images.
+
+Each page JPEG is kept once in a GridFS bucket under its SHA-256, so
+scan_results documents only carry that hash (image_id) and a small thumbnail.
+Storing a page that is already there is a no-op.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    def __init__(self, db, bucket_name: str = 'page_images'):
+        self.files = db[f'{bucket_name}.files']
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name)
+        # Uploads in progress by id: the same page stored twice at once is written only once
+        self._uploading = {}
+
+    async def put(self, data: bytes, content_type: str = 'image/jpeg') -> str:
+        """Store data (if new) and return its id, the SHA-256 hex digest"""
+        blob_id = hashlib.sha256(data).hexdigest()
+        upload = self._uploading.get(blob_id)
+        if upload is None:
+            upload = asyncio.ensure_future(self._upload(blob_id, data, content_type))
+            self._uploading[blob_id] = upload
+            upload.add_done_callback(lambda _: self._uploading.pop(blob_id, None))
+        await asyncio.shield(upload)
+        return blob_id
+
+    async def _upload(self, blob_id: str, data: bytes, content_type: str):
+        if await self.files.find_one({"_id": blob_id}, {"_id": 1}) is None:
+            await self.bucket.upload_from_stream_with_id(
+                blob_id, blob_id, data, metadata={"content_type": content_type}
+            )
+
+    async def get(self, blob_id: str) -> Optional[bytes]:
+        try:
+            stream = await self.bucket.open_download_stream(blob_id)
+        except NoFile:
+            return None
+        return await stream.read()
+
+    async def delete(self, blob_id: str) -> bool:
+        try:
+            await self.bucket.delete(blob_id)
+            return True
+        except NoFile:
+            return False
+
+    async def delete_all(self):
+        await self.bucket.drop()
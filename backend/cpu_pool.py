@@ -0,0 +1,85 @@
+"""
+Process pool for CPU-bound backend work (image decode/resize, PDF and ZIP building).
+
+Keeps the asyncio event loop free: callers `await run_cpu(fn, *args)` and the
+work runs in a separate process. Functions must be importable without
+server.py (see image_processing.py) because workers use the 'spawn' start method.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+CPU_POOL_WORKERS = int(os.environ.get('CPU_POOL_WORKERS', str(os.cpu_count() or 2)))
+UTILIZATION_WINDOW_SECONDS = 60
+
+_pool = None
+_in_flight = 0
+_completed = 0
+_failed = 0
+# (finished_at, busy_seconds) of recent tasks, for the utilization window
+_recent = deque()
+
+
+def _timed_call(fn, args, kwargs):
+    """Runs inside the worker process: call fn and report how long it kept the CPU busy"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=CPU_POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        logger.info(f"CPU pool started with {CPU_POOL_WORKERS} worker processes")
+    return _pool
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a CPU-bound function in the process pool and await its result"""
+    global _in_flight, _completed, _failed
+    loop = asyncio.get_running_loop()
+    _in_flight += 1
+    try:
+        result, busy = await loop.run_in_executor(get_cpu_pool(), _timed_call, fn, args, kwargs)
+    except Exception:
+        _failed += 1
+        raise
+    finally:
+        _in_flight -= 1
+    _completed += 1
+    _recent.append((time.monotonic(), busy))
+    return result
+
+
+def cpu_pool_stats() -> dict:
+    """Queue depth and utilization of the CPU pool (utilization over the last minute)"""
+    now = time.monotonic()
+    while _recent and now - _recent[0][0] > UTILIZATION_WINDOW_SECONDS:
+        _recent.popleft()
+    busy = sum(b for _, b in _recent)
+    return {
+        "workers": CPU_POOL_WORKERS,
+        "started": _pool is not None,
+        "in_flight": _in_flight,
+        "queue_depth": max(0, _in_flight - CPU_POOL_WORKERS),
+        "completed": _completed,
+        "failed": _failed,
+        "utilization": round(min(1.0, busy / (UTILIZATION_WINDOW_SECONDS * CPU_POOL_WORKERS)), 3),
+    }
+
+
+def shutdown_cpu_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
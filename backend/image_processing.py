@@ -0,0 +1,384 @@
+"""
+CPU-bound image / PDF helpers for the backend.
+
+Everything here is pure (no DB, no FastAPI) so it can run inside the
+cpu_pool worker processes without importing server.py.
+"""
+import base64
+import logging
+import math
+import os
+import zipfile
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+from reportlab.lib.pagesizes import A4, A3, landscape, portrait
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from reportlab import rl_config
+
+logger = logging.getLogger(__name__)
+
+# Embed JPEG (DCT) image streams in PDFs as raw binary instead of ASCII85 (+25% size, extra CPU)
+rl_config.useA85 = 0
+
+
+def _open_image_reduced(image_bytes: bytes, min_scale: float = 1.0):
+    """
+    Decode an image at the smallest size that keeps at least min_scale of its resolution.
+    JPEG uses libjpeg DCT scaling (draft mode), other formats use Image.reduce.
+    
+    Returns: (image, original_size)
+    """
+    img = Image.open(BytesIO(image_bytes))
+    original_size = img.size
+    if min_scale < 1.0:
+        w, h = original_size
+        if img.format == 'JPEG':
+            img.draft(img.mode, (math.ceil(w * min_scale), math.ceil(h * min_scale)))
+        else:
+            factor = int(1 / min_scale)
+            if factor >= 2:
+                img = img.reduce(factor)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGB')
+    return img, original_size
+
+
+def _crop_scale(size: tuple, crop_percentage: Optional[float], max_size: int) -> float:
+    """Fraction of the original resolution needed to produce a crop of max_size"""
+    w, h = size
+    crop_h = int(h * crop_percentage) if crop_percentage else h
+    return min(1.0, max_size / max(w, crop_h, 1))
+
+
+def _encode_jpeg(img, original_size: tuple, max_size: int, crop_percentage: Optional[float] = None) -> bytes:
+    """Crop (top crop_percentage of the page) + resize an already decoded image, return JPEG bytes"""
+    if crop_percentage:
+        # Crop in original coordinates, mapped onto the (possibly reduced) raster
+        scale = img.size[1] / original_size[1]
+        crop_height = int(int(original_size[1] * crop_percentage) * scale)
+        img = img.crop((0, 0, img.size[0], crop_height))
+        logger.info(f"Smart cropped: {original_size[1]}px → {int(original_size[1] * crop_percentage)}px ({int(crop_percentage*100)}% crop)")
+    
+    # Optimized resize for speed + quality balance
+    if max(img.size) > max_size:
+        ratio = max_size / max(img.size)
+        new_size = tuple(int(dim * ratio) for dim in img.size)
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    
+    # High quality for Vietnamese OCR
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=80, optimize=True)
+    return buffered.getvalue()
+
+
+def _encode_for_api(img, original_size: tuple, max_size: int, crop_percentage: Optional[float] = None) -> str:
+    return base64.b64encode(_encode_jpeg(img, original_size, max_size, crop_percentage)).decode('utf-8')
+
+
+def resize_image_for_api(image_bytes: bytes, max_size: int = 1024, crop_top_only: bool = True, crop_percentage: float = 0.35) -> str:
+    """Resize image and convert to base64 - SMART CROP: adaptive based on emblem detection"""
+    try:
+        crop = crop_percentage if crop_top_only else None
+        size = Image.open(BytesIO(image_bytes)).size  # header only, no decode
+        img, original_size = _open_image_reduced(image_bytes, _crop_scale(size, crop, max_size))
+        return _encode_for_api(img, original_size, max_size, crop)
+    except Exception as e:
+        logger.error(f"Error resizing image: {e}")
+        raise
+
+
+def resize_image_for_pdf(image_bytes: bytes, max_size: int = 1400) -> bytes:
+    """
+    Unified PDF resize (no crop) for single and folder scans - returns JPEG bytes.
+    JPEGs that already fit max_size are returned untouched so the PDF embeds
+    the original DCT data; only oversized pages are decoded and resampled.
+    """
+    header = Image.open(BytesIO(image_bytes))  # header only, no decode
+    if header.format == 'JPEG' and header.mode in ('RGB', 'L') and max(header.size) <= max_size:
+        return image_bytes
+    img, original_size = _open_image_reduced(image_bytes, _crop_scale(header.size, None, max_size))
+    return _encode_jpeg(img, original_size, max_size)
+
+
+def preprocess_scan_image(image_bytes: bytes, crop_max_size: int = 800, full_max_size: Optional[int] = 1280) -> dict:
+    """
+    Decode a scanned page ONCE and derive everything the scan flows need:
+    aspect ratio, title crop (50%, or 65% for 2-page/wide spreads) and optional full preview.
+    """
+    size = Image.open(BytesIO(image_bytes)).size  # header only, no decode
+    aspect_ratio = size[0] / size[1]
+    # 2-page spread or wide format needs more crop (lowered threshold to 1.35)
+    crop_percent = 0.65 if aspect_ratio > 1.35 else 0.50
+    
+    min_scale = _crop_scale(size, crop_percent, crop_max_size)
+    if full_max_size:
+        min_scale = max(min_scale, _crop_scale(size, None, full_max_size))
+    img, original_size = _open_image_reduced(image_bytes, min_scale)
+    
+    return {
+        "width": original_size[0],
+        "height": original_size[1],
+        "aspect_ratio": aspect_ratio,
+        "crop_percent": crop_percent,
+        "cropped_image_base64": _encode_for_api(img, original_size, crop_max_size, crop_percent),
+        "full_image_base64": _encode_for_api(img, original_size, full_max_size) if full_max_size else None,
+    }
+
+
+# Local emblem (quốc huy) detection: colour + shape matching, no LLM call
+EMBLEM_ANALYSIS_WIDTH = 320
+EMBLEM_CELL = 4  # px per cell of the coarse blob grid
+
+
+def _hsv_masks(img):
+    """Red and gold pixel masks (PIL HSV: every channel 0-255)"""
+    hsv = np.asarray(img.convert('HSV'), dtype=np.int16)
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    red = ((h <= 12) | (h >= 235)) & (s >= 110) & (v >= 70)
+    gold = (h >= 20) & (h <= 45) & (s >= 90) & (v >= 110)
+    return red, gold
+
+
+def _blobs(cells):
+    """8-connected components of a small boolean grid → list of (top, left, bottom, right) in cells"""
+    rows, cols = cells.shape
+    seen = np.zeros_like(cells)
+    boxes = []
+    for r0, c0 in zip(*np.nonzero(cells)):
+        if seen[r0, c0]:
+            continue
+        seen[r0, c0] = True
+        stack = [(r0, c0)]
+        top, left, bottom, right = r0, c0, r0, c0
+        while stack:
+            r, c = stack.pop()
+            top, left, bottom, right = min(top, r), min(left, c), max(bottom, r), max(right, c)
+            for nr in range(max(r - 1, 0), min(r + 2, rows)):
+                for nc in range(max(c - 1, 0), min(c + 2, cols)):
+                    if cells[nr, nc] and not seen[nr, nc]:
+                        seen[nr, nc] = True
+                        stack.append((nr, nc))
+        boxes.append((top, left, bottom + 1, right + 1))
+    return boxes
+
+
+def detect_emblem(image_base64: str) -> bool:
+    """
+    Detect the Vietnamese national emblem in a (top-of-page) crop without an LLM
+
+    Looks for a roughly round blob that is part red (the disc) and part gold
+    (rice ears, cogwheel) with a gold centre (the star). Red seals have no gold
+    and black & white copies have no colour, so both answer False.
+    """
+    image_bytes = base64.b64decode(image_base64)
+    width = Image.open(BytesIO(image_bytes)).size[0]  # header only, no decode
+    img, _ = _open_image_reduced(image_bytes, min(1.0, EMBLEM_ANALYSIS_WIDTH / max(width, 1)))
+    img = img.convert('RGB')
+    if img.width > EMBLEM_ANALYSIS_WIDTH:
+        img = img.resize((EMBLEM_ANALYSIS_WIDTH, max(1, round(img.height * EMBLEM_ANALYSIS_WIDTH / img.width))), Image.Resampling.BILINEAR)
+    red, gold = _hsv_masks(img)
+    colored = red | gold
+
+    # Coarse grid: a cell is "on" when a third of its pixels are red/gold
+    rows, cols = colored.shape[0] // EMBLEM_CELL, colored.shape[1] // EMBLEM_CELL
+    if rows == 0 or cols == 0:
+        return False
+    grid = colored[:rows * EMBLEM_CELL, :cols * EMBLEM_CELL].reshape(rows, EMBLEM_CELL, cols, EMBLEM_CELL).mean(axis=(1, 3))
+
+    for top, left, bottom, right in _blobs(grid >= 0.33):
+        y0, x0, y1, x1 = top * EMBLEM_CELL, left * EMBLEM_CELL, bottom * EMBLEM_CELL, right * EMBLEM_CELL
+        w, h = x1 - x0, y1 - y0
+        # Size (relative to the page width) and roughly round outline
+        if not (0.04 * img.width <= w <= 0.45 * img.width) or not (0.7 <= h / w <= 1.4):
+            continue
+        box_colored = colored[y0:y1, x0:x1].sum()
+        if box_colored < 0.35 * w * h:
+            continue
+        red_share = red[y0:y1, x0:x1].sum() / box_colored
+        if not (0.15 <= red_share <= 0.85):
+            continue
+        # Gold star in the middle of the red disc
+        cy0, cy1, cx0, cx1 = y0 + int(h * 0.35), y1 - int(h * 0.35), x0 + int(w * 0.35), x1 - int(w * 0.35)
+        if gold[cy0:cy1, cx0:cx1].mean() >= 0.15:
+            return True
+    return False
+
+
+def _detect_page_size(img_width: int, img_height: int):
+    """
+    SMART PAGE SIZE DETECTION - AUTO-DETECT A3/A4 and orientation
+    A3 = 297mm x 420mm = 842pt x 1191pt, A4 = 210mm x 297mm = 595pt x 842pt.
+    Both have aspect ratio ≈ 1.414 (√2), but A3 scans are larger in pixels.
+    """
+    is_landscape = img_width > img_height
+    long_side = max(img_width, img_height)
+    
+    # If image is very large (> 3000px on long side), likely A3
+    if long_side > 3000 or (img_width > 3000 and img_height > 2000):
+        page_size = landscape(A3) if is_landscape else portrait(A3)
+        logger.info(f"Detected A3 {'Landscape' if is_landscape else 'Portrait'}: {img_width}x{img_height}")
+    else:
+        page_size = landscape(A4) if is_landscape else portrait(A4)
+        logger.info(f"Detected A4 {'Landscape' if is_landscape else 'Portrait'}: {img_width}x{img_height}")
+    return page_size
+
+
+def write_images_pdf(images, output):
+    """
+    Build ONE multi-page PDF (one page per image) in a single pass.
+    
+    Args:
+        images: iterable of JPEG/PNG bytes (consumed lazily, one page in memory at a time)
+        output: file path or writable binary file object (e.g. an open ZIP entry)
+    
+    Returns: number of pages written
+    """
+    c = canvas.Canvas(output)
+    pages = 0
+    for image_data in images:
+        img_reader = ImageReader(BytesIO(image_data))
+        img_width, img_height = img_reader.getSize()
+        page_size = _detect_page_size(img_width, img_height)
+        page_width, page_height = page_size
+        c.setPageSize(page_size)
+        
+        # Fit page while maintaining aspect ratio, 95% to leave margin, centered
+        scale = min(page_width / img_width, page_height / img_height) * 0.95
+        new_width = img_width * scale
+        new_height = img_height * scale
+        x = (page_width - new_width) / 2
+        y = (page_height - new_height) / 2
+        
+        c.drawImage(img_reader, x, y, width=new_width, height=new_height)
+        c.showPage()
+        pages += 1
+    c.save()
+    return pages
+
+
+# ZIP sources are opened per call and closed right after: pool workers never keep a
+# handle on an upload whose job directory has been deleted (disk space is freed at once)
+def read_source_image(source: str, relative_path: str, zip_file: Optional[zipfile.ZipFile] = None) -> bytes:
+    """
+    Read one source image by relative path
+    source is either a directory or an uploaded .zip archive (member read without extracting)
+    """
+    if zip_file is not None:
+        return zip_file.read(relative_path)
+    if os.path.isfile(source):
+        with zipfile.ZipFile(source, 'r') as zf:
+            return zf.read(relative_path)
+    with open(Path(source) / relative_path, 'rb') as img_file:
+        return img_file.read()
+
+
+def preprocess_source_image(source: str, relative_path: str, crop_max_size: int = 800, full_max_size: Optional[int] = 1280) -> dict:
+    """Read + preprocess in one step so the image bytes never cross the process boundary"""
+    return preprocess_scan_image(read_source_image(source, relative_path), crop_max_size, full_max_size)
+
+
+def iter_pdf_pages(source: str, relative_paths, max_size: int = 1400):
+    """Yield PDF-ready JPEG bytes for each source image, reading one file at a time"""
+    # One open ZIP for the whole document instead of one per page
+    zip_file = zipfile.ZipFile(source, 'r') if os.path.isfile(source) else None
+    try:
+        for relative_path in relative_paths:
+            yield resize_image_for_pdf(read_source_image(source, relative_path, zip_file), max_size=max_size)
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+
+
+def create_pdf_from_image(image_base64: str, output_path: str, filename: str):
+    """Create a PDF file from base64 image - AUTO-DETECT A3/A4 and orientation"""
+    try:
+        write_images_pdf([base64.b64decode(image_base64)], output_path)
+        logger.info(f"Created PDF: {output_path}")
+    except Exception as e:
+        logger.error(f"Error creating PDF: {e}")
+        raise
+
+
+def list_zip_images(zip_file_path: str, extensions: set) -> dict:
+    """
+    Index image members of a ZIP from its central directory (nothing is extracted)
+    Returns: Dict of {folder_name: [(relative_path, member_name)]}
+    Groups files by their direct parent folder
+    """
+    folder_groups = {}
+    with zipfile.ZipFile(zip_file_path, 'r') as zf:
+        infos = zf.infolist()
+    
+    for info in infos:
+        if info.is_dir():
+            continue
+        member_path = PurePosixPath(info.filename)
+        if member_path.suffix.lower() in extensions:
+            # Get folder name - use the DIRECT parent folder of the image
+            parts = member_path.parts
+            folder_name = parts[-2] if len(parts) > 1 else "root"  # Files in root
+            
+            # Members are addressed by their name inside the archive
+            folder_groups.setdefault(folder_name, []).append((info.filename, info.filename))
+    
+    return folder_groups
+
+
+def build_result_zip(entries, source: str, output_zip_path: str) -> int:
+    """
+    Write a ZIP_STORED archive where each entry is one PDF built from source images.
+    
+    Args:
+        entries: list of (pdf_path_in_zip, [relative image paths]) - one PDF per entry, pages in order
+    
+    Returns: number of PDFs written
+    """
+    with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_STORED) as zip_out:
+        for pdf_path_in_zip, relative_paths in entries:
+            # Stream the PDF straight into the ZIP entry
+            with zip_out.open(pdf_path_in_zip, 'w') as entry:
+                write_images_pdf(iter_pdf_pages(source, relative_paths), entry)
+    return len(entries)
+
+
+def build_pdf_zip(entries, output_zip_path: str) -> int:
+    """Like build_result_zip, but pages are given as image bytes: [(pdf_name, [image bytes])]"""
+    with zipfile.ZipFile(output_zip_path, 'w') as zip_out:
+        for pdf_name, images in entries:
+            with zip_out.open(pdf_name, 'w') as entry:
+                write_images_pdf(images, entry)
+    return len(entries)
+
+
+def write_folder_pdfs(groups, source_dir: str, results_dir: str, name_prefix: str, zip_name: Optional[str] = None) -> list:
+    """
+    Write one merged PDF per short_code into results_dir as {name_prefix}{code}.pdf,
+    optionally also packing them into results_dir/zip_name in the same pass.
+    
+    Args:
+        groups: list of (short_code, [relative image paths])
+    
+    Returns: list of written PDF filenames
+    """
+    written = []
+    per_folder_zip = zipfile.ZipFile(os.path.join(results_dir, zip_name), 'w', zipfile.ZIP_STORED) if zip_name else None
+    try:
+        for code, relative_paths in groups:
+            # One pass: pages → merged PDF bytes → PDF file (+ ZIP entry)
+            pdf_buffer = BytesIO()
+            write_images_pdf(iter_pdf_pages(source_dir, relative_paths), pdf_buffer)
+            final_name = f"{name_prefix}{code}.pdf"
+            with open(os.path.join(results_dir, final_name), 'wb') as f_out:
+                f_out.write(pdf_buffer.getbuffer())
+            written.append(final_name)
+            if per_folder_zip is not None:
+                per_folder_zip.writestr(f"{code}.pdf", pdf_buffer.getbuffer())
+    finally:
+        if per_folder_zip is not None:
+            per_folder_zip.close()
+    return written
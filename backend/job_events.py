@@ -0,0 +1,42 @@
+"""
+In-process pub/sub of folder job progress, streamed to clients as server-sent events.
+
+The job runner publishes (file classified, folder started/completed, job status);
+every open event stream holds a bounded queue for its job. A stream that falls
+too far behind gets a "resync" marker and re-reads the job from MongoDB.
+"""
+import asyncio
+import json
+
+JOB_EVENT_QUEUE_SIZE = 256
+
+_subscribers = {}  # job_id -> set of asyncio.Queue
+
+
+def subscribe_job_events(job_id: str) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=JOB_EVENT_QUEUE_SIZE)
+    _subscribers.setdefault(job_id, set()).add(queue)
+    return queue
+
+
+def unsubscribe_job_events(job_id: str, queue: asyncio.Queue):
+    queues = _subscribers.get(job_id)
+    if queues is not None:
+        queues.discard(queue)
+        if not queues:
+            del _subscribers[job_id]
+
+
+def publish_job_event(job_id: str, event: str, data: dict):
+    for queue in _subscribers.get(job_id, ()):
+        try:
+            queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # Slow client: drop its backlog, it reloads the job state instead
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(("resync", None))
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
@@ -0,0 +1,152 @@
+"""
+Adaptive rate limiter shared by every backend LLM call.
+
+One limiter per provider+model: a token bucket whose refill rate follows
+AIMD (additive increase on success, halve on 429). A 429 with Retry-After
+pauses the whole bucket until then. Callers wait their turn in a FIFO queue
+instead of each task sleeping on its own schedule.
+
+Settings (environment):
+    LLM_RATE_INITIAL         Starting rate in requests/second (default: 2)
+    LLM_RATE_MIN             Lower bound after repeated 429s (default: 0.1)
+    LLM_RATE_MAX             Upper bound while probing upwards (default: 20)
+    LLM_RATE_INCREASE        Rate gained per second of clean traffic (default: 0.2)
+    LLM_RATE_LIMIT_RETRIES   Re-queues of a call after a 429 (default: 3)
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LLM_RATE_INITIAL = float(os.environ.get('LLM_RATE_INITIAL', '2'))
+LLM_RATE_MIN = float(os.environ.get('LLM_RATE_MIN', '0.1'))
+LLM_RATE_MAX = float(os.environ.get('LLM_RATE_MAX', '20'))
+LLM_RATE_INCREASE = float(os.environ.get('LLM_RATE_INCREASE', '0.2'))
+LLM_RATE_LIMIT_RETRIES = int(os.environ.get('LLM_RATE_LIMIT_RETRIES', '3'))
+# Pause used when a 429 carries no Retry-After
+DEFAULT_RETRY_AFTER_SECONDS = 5.0
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """HTTP 429 from the provider (status code or the SDK's RateLimitError), never a guess from the message"""
+    if getattr(e, "status_code", None) == 429:
+        return True
+    if getattr(getattr(e, "response", None), "status_code", None) == 429:
+        return True
+    # openai / litellm RateLimitError (also when wrapped without a status code)
+    return any(cls.__name__ == "RateLimitError" for cls in type(e).__mro__)
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """Retry-After from the response headers, or 'try again in 1.5s' in the message"""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    m = re.search(r"(?:try again|retry) (?:in|after) ([\d.]+)\s*(ms|s)", str(e), re.IGNORECASE)
+    if m:
+        return float(m.group(1)) * (0.001 if m.group(2).lower() == "ms" else 1.0)
+    return None
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, key: str):
+        self.key = key
+        self.rate = LLM_RATE_INITIAL
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.waiting = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self._lock = asyncio.Lock()  # FIFO: waiters are served in arrival order
+
+    def _refill(self, now: float):
+        # Burst is at most one second worth of requests
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self.paused_until - now
+                    if wait <= 0 and self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep(max(wait, (1 - self.tokens) / self.rate))
+        finally:
+            self.waiting -= 1
+
+    def on_success(self):
+        # Additive increase: about +LLM_RATE_INCREASE req/s per second of clean traffic
+        self.successes += 1
+        self.rate = min(LLM_RATE_MAX, self.rate + LLM_RATE_INCREASE / self.rate)
+
+    def on_rate_limited(self, retry_after: Optional[float]):
+        self.rate_limited += 1
+        now = time.monotonic()
+        # Multiplicative decrease, once per burst of 429s from requests already in flight
+        if now - self.last_decrease > 1.0 / self.rate:
+            self.rate = max(LLM_RATE_MIN, self.rate / 2)
+            self.last_decrease = now
+        pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER_SECONDS
+        self.paused_until = max(self.paused_until, now + pause)
+        self.tokens = 0.0
+        logger.warning(f"LLM 429 on {self.key}: rate → {self.rate:.2f} req/s, paused {pause:.1f}s")
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": round(self.rate, 3),
+            "waiting": self.waiting,
+            "paused_for_seconds": round(max(0.0, self.paused_until - time.monotonic()), 1),
+            "successes": self.successes,
+            "rate_limited": self.rate_limited,
+        }
+
+
+_limiters = {}
+
+
+def get_llm_limiter(provider: str, model: str) -> AdaptiveRateLimiter:
+    key = f"{provider}:{model}"
+    if key not in _limiters:
+        _limiters[key] = AdaptiveRateLimiter(key)
+    return _limiters[key]
+
+
+async def call_llm(provider: str, model: str, make_request):
+    """
+    Run make_request() (a coroutine factory) through the provider+model limiter
+    A 429 re-queues the call behind the Retry-After pause, up to LLM_RATE_LIMIT_RETRIES times.
+    """
+    limiter = get_llm_limiter(provider, model)
+    for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+        await limiter.acquire()
+        try:
+            result = await make_request()
+        except Exception as e:
+            if not is_rate_limit_error(e):
+                raise
+            limiter.on_rate_limited(retry_after_seconds(e))
+            if attempt == LLM_RATE_LIMIT_RETRIES:
+                raise
+            continue
+        limiter.on_success()
+        return result
+
+
+def llm_limiter_stats() -> dict:
+    return {key: limiter.stats() for key, limiter in _limiters.items()}
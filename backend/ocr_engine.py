@@ -1,17 +1,44 @@
 """
 OCR Engine using PaddleOCR for Vietnamese document processing
+
+The async backend calls run_ocr_async(): pages are OCR'd in a pool of worker
+processes, each holding its own warm PaddleOCR instance (one instance is not
+safe to call concurrently), so the event loop never blocks on inference.
 """
 import os
+import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
 
 # Disable PaddleX initialization BEFORE importing PaddleOCR
 os.environ['PADDLEX_DISABLE_INIT'] = '1'
 os.environ['PADDLE_DISABLE_PDX'] = '1'
 
-from paddleocr import PaddleOCR
-
 logger = logging.getLogger(__name__)
 
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', '2'))
+# Pages queued + running at once; further callers wait (bounded queue)
+OCR_MAX_QUEUE = int(os.environ.get('OCR_MAX_QUEUE', str(OCR_WORKERS * 4)))
+# Math threads per worker process, so N workers don't oversubscribe the cores
+OCR_THREADS_PER_WORKER = os.environ.get('OCR_THREADS_PER_WORKER', '1')
+# Cross-page batching: pages collected for up to OCR_BATCH_WAIT_MS share one recognition pass
+OCR_BATCH_PAGES = int(os.environ.get('OCR_BATCH_PAGES', '1'))
+OCR_BATCH_WAIT_MS = int(os.environ.get('OCR_BATCH_WAIT_MS', '100'))
+# Text-line crops per recognition inference batch
+OCR_REC_BATCH = int(os.environ.get('OCR_REC_BATCH', '24'))
+# Same cut-off PaddleOCR applies to recognized lines in its full pipeline
+OCR_DROP_SCORE = 0.5
+
+_ocr_executor = None
+_ocr_slots = None
+_ocr_batches = {}  # upright flag -> {"pending": [(image, future)], "timer": handle}
+_ocr_batch_tasks = set()  # The event loop only keeps weak references to tasks
+
 # Singleton instance
 _ocr_instance = None
 _ocr_lock = None
@@ -36,12 +63,14 @@ def get_ocr_instance():
             if _ocr_instance is None:
                 try:
                     logger.info("🔧 Initializing PaddleOCR (first time only)...")
+                    from paddleocr import PaddleOCR
                     _ocr_instance = PaddleOCR(
                         use_angle_cls=True,
                         lang='vi',
                         show_log=False,
                         use_gpu=False,
                         enable_mkldnn=False,  # Disable to avoid conflicts
+                        rec_batch_num=OCR_REC_BATCH,
                         rec_model_dir=None,
                         det_model_dir=None,
                         cls_model_dir=None
@@ -54,32 +83,232 @@ def get_ocr_instance():
     
     return _ocr_instance
 
-def extract_text_from_image(image_path: str) -> str:
+def _to_ocr_input(image):
+    """PaddleOCR input: paths pass through, encoded bytes / PIL images become a BGR array"""
+    if isinstance(image, (str, os.PathLike)):
+        return str(image)
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(BytesIO(image))
+    return np.asarray(image.convert('RGB'))[:, :, ::-1]
+
+
+def run_ocr(image, cls: bool = True) -> dict:
     """
-    Extract text from image using PaddleOCR
+    Run PaddleOCR once on a page, fully in memory
     
     Args:
-        image_path: Path to image file
+        image: BGR numpy array, encoded image bytes, PIL image or file path
+        cls: Run angle classification (skip for pages known to be upright)
         
     Returns:
-        Extracted text as string
+        {"text": all lines joined, "lines": [{"text", "score", "box"}]}
     """
     try:
         ocr = get_ocr_instance()
-        result = ocr.ocr(image_path, cls=True)
-        
-        if not result or not result[0]:
-            return ""
-        
-        # Combine all detected text
-        text_lines = []
-        for line in result[0]:
-            if len(line) >= 2 and len(line[1]) >= 1:
-                text_lines.append(line[1][0])
+        result = ocr.ocr(_to_ocr_input(image), cls=cls)
+    except Exception as e:
+        logger.error(f"OCR error: {e}")
+        return {"text": "", "lines": []}
+    
+    lines = []
+    for line in (result[0] or []) if result else []:
+        if len(line) >= 2 and len(line[1]) >= 1:
+            lines.append({
+                "text": line[1][0],
+                "score": float(line[1][1]) if len(line[1]) >= 2 else None,
+                "box": [[float(x), float(y)] for x, y in line[0]]
+            })
+    
+    # Combine all detected text
+    return {"text": ' '.join(l["text"] for l in lines), "lines": lines}
+
+
+def extract_text_from_image(image) -> str:
+    """
+    Extract text from image using PaddleOCR
+    
+    Args:
+        image: Path to image file, encoded image bytes or BGR numpy array
         
-        full_text = ' '.join(text_lines)
-        return full_text
+    Returns:
+        Extracted text as string
+    """
+    return run_ocr(image)["text"]
+
+
+def _sort_boxes(boxes):
+    """Reading order: top to bottom, left to right within a line (as PaddleOCR does)"""
+    boxes = sorted(boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def _crop_text_line(img, box):
+    """Perspective crop of one detected text box (PaddleOCR's get_rotate_crop_image)"""
+    import cv2  # installed with paddleocr
+    points = np.array(box, dtype=np.float32)
+    w = int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3])))
+    h = int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2])))
+    target = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    crop = cv2.warpPerspective(
+        img, cv2.getPerspectiveTransform(points, target), (w, h),
+        borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC
+    )
+    if w and h / w >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+def run_ocr_batch(images, upright: bool = False) -> list:
+    """
+    OCR several pages: text detection per page, then ONE recognition call for the
+    text lines of all pages, so the recognizer runs full OCR_REC_BATCH batches
+    
+    Args:
+        images: list of BGR arrays / encoded bytes / PIL images / paths
+        upright: Pages are known to be upright → skip angle classification
         
+    Returns:
+        One {"text", "lines"} dict per page (same shape as run_ocr)
+    """
+    empty = [{"text": "", "lines": []} for _ in images]
+    try:
+        ocr = get_ocr_instance()
+    except Exception as e:
+        logger.error(f"OCR error: {e}")
+        return empty
+    
+    page_boxes = []
+    crops = []
+    for image in images:
+        try:
+            img = _to_ocr_input(image)
+            if isinstance(img, str):
+                img = np.asarray(Image.open(img).convert('RGB'))[:, :, ::-1]
+            det = ocr.ocr(img, det=True, rec=False, cls=False)
+            boxes = _sort_boxes(det[0] or []) if det else []
+            crops.extend(_crop_text_line(img, box) for box in boxes)
+        except Exception as e:
+            logger.error(f"OCR detection error: {e}")
+            boxes = []
+        page_boxes.append(boxes)
+    
+    if not crops:
+        return empty
+    try:
+        # Call the pipeline stages directly on the crop list: ocr.ocr(list) treats a list
+        # as PDF pages (one recognizer pass per crop, sticky page_num truncation)
+        classifier = getattr(ocr, 'text_classifier', None)
+        if not upright and classifier is not None:
+            crops, _, _ = classifier(crops)
+        rec, _ = ocr.text_recognizer(crops)
+        assert len(rec) == len(crops), f"recognizer returned {len(rec)} results for {len(crops)} crops"
     except Exception as e:
-        logger.error(f"OCR error for {image_path}: {e}")
-        return ""
+        logger.error(f"OCR recognition error: {e}")
+        return empty
+    
+    results = []
+    offset = 0
+    for boxes in page_boxes:
+        lines = [
+            {"text": text, "score": float(score), "box": [[float(x), float(y)] for x, y in box]}
+            for box, (text, score) in zip(boxes, rec[offset:offset + len(boxes)])
+            if score >= OCR_DROP_SCORE
+        ]
+        offset += len(boxes)
+        results.append({"text": ' '.join(l["text"] for l in lines), "lines": lines})
+    return results
+
+
+def _init_ocr_worker():
+    """Runs once in each OCR worker process: load the model before the first page arrives"""
+    os.environ.setdefault('OMP_NUM_THREADS', OCR_THREADS_PER_WORKER)
+    try:
+        get_ocr_instance()
+    except Exception:
+        pass  # Already logged; run_ocr returns empty text for every page
+
+
+def _ocr_worker_ready() -> bool:
+    return _ocr_instance is not None
+
+
+def get_ocr_executor() -> ProcessPoolExecutor:
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_ocr_worker
+        )
+        logger.info(f"OCR executor started with {OCR_WORKERS} worker processes")
+    return _ocr_executor
+
+
+async def run_ocr_async(image, upright: bool = False) -> dict:
+    """
+    Awaitable OCR on the warm worker pool (waits while OCR_MAX_QUEUE pages are in flight)
+    With OCR_BATCH_PAGES > 1, concurrent pages are OCR'd together by run_ocr_batch.
+    """
+    global _ocr_slots
+    if _ocr_slots is None:
+        _ocr_slots = asyncio.Semaphore(OCR_MAX_QUEUE)
+    async with _ocr_slots:
+        loop = asyncio.get_running_loop()
+        if OCR_BATCH_PAGES <= 1:
+            return await loop.run_in_executor(get_ocr_executor(), run_ocr, image, not upright)
+        future = loop.create_future()
+        batch = _ocr_batches.setdefault(upright, {"pending": [], "timer": None})
+        batch["pending"].append((image, future))
+        if len(batch["pending"]) >= OCR_BATCH_PAGES:
+            _flush_ocr_batch(upright)
+        elif batch["timer"] is None:
+            batch["timer"] = loop.call_later(OCR_BATCH_WAIT_MS / 1000, _flush_ocr_batch, upright)
+        return await future
+
+
+def _flush_ocr_batch(upright: bool):
+    batch = _ocr_batches[upright]
+    if batch["timer"] is not None:
+        batch["timer"].cancel()
+        batch["timer"] = None
+    items, batch["pending"] = batch["pending"], []
+    if items:
+        task = asyncio.create_task(_run_ocr_batch(items, upright))
+        _ocr_batch_tasks.add(task)
+        task.add_done_callback(_ocr_batch_tasks.discard)
+
+
+async def _run_ocr_batch(items: list, upright: bool):
+    loop = asyncio.get_running_loop()
+    try:
+        results = await loop.run_in_executor(get_ocr_executor(), run_ocr_batch, [image for image, _ in items], upright)
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+    except Exception as e:
+        for _, future in items:
+            if not future.done():
+                future.set_exception(e)
+
+
+async def warm_ocr_executor():
+    """Start every worker and load its PaddleOCR instance (call at startup when hybrid OCR is on)"""
+    loop = asyncio.get_running_loop()
+    executor = get_ocr_executor()
+    ready = await asyncio.gather(*[loop.run_in_executor(executor, _ocr_worker_ready) for _ in range(OCR_WORKERS)])
+    logger.info(f"OCR workers warm: {sum(ready)}/{len(ready)}")
+
+
+def shutdown_ocr_executor():
+    global _ocr_executor
+    if _ocr_executor is not None:
+        _ocr_executor.shutdown(wait=False, cancel_futures=True)
+        _ocr_executor = None
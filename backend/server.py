@@ -1,5 +1,5 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Depends, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -10,22 +10,27 @@ from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import base64
-from io import BytesIO
-from PIL import Image
-from reportlab.lib.pagesizes import A4, A3, landscape, portrait
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-try:
-    from pypdf import PdfMerger
-except ImportError:
-    from pypdf import PdfWriter as PdfMerger
+import hashlib
 import tempfile
 import asyncio
 import zipfile
 import shutil
+import socket
+from contextlib import asynccontextmanager
 from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
+from image_processing import (
+    resize_image_for_api, preprocess_scan_image, write_images_pdf,
+    preprocess_source_image, list_zip_images, build_result_zip, detect_emblem, build_pdf_zip, write_folder_pdfs
+)
+from cpu_pool import run_cpu, cpu_pool_stats, shutdown_cpu_pool
+# LLM queue/backoff: every call goes through the provider+model limiter
+from llm_rate_limiter import call_llm, llm_limiter_stats
+# PaddleOCR runs in its own warm worker processes (model is loaded lazily, only in the workers)
+from ocr_engine import run_ocr_async, warm_ocr_executor, shutdown_ocr_executor
+from blob_store import BlobStore
+from job_events import subscribe_job_events, unsubscribe_job_events, publish_job_event, format_sse
 
 
 ROOT_DIR = Path(__file__).parent
@@ -38,9 +43,15 @@ LLM_PRIMARY = os.environ.get('LLM_PRIMARY', 'openai').lower()
 
 # Hybrid OCR settings
 USE_HYBRID_OCR = os.environ.get('USE_HYBRID_OCR', 'true').lower() == 'true'
+# Scanned pages are always upright → OCR skips angle classification
+OCR_PAGES_UPRIGHT = os.environ.get('OCR_PAGES_UPRIGHT', 'false').lower() == 'true'
 
 db = client[os.environ.get('DB_NAME', 'document_scanner_db')]
 
+# Page images live in the blob store; scan_results keep image_id + a thumbnail
+page_images = BlobStore(db)
+SCAN_THUMBNAIL_SIZE = int(os.environ.get('SCAN_THUMBNAIL_SIZE', '320'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -48,10 +59,7 @@ app = FastAPI()
 _llm_health_cache = {"cached": None, "ts": 0}
 LLM_HEALTH_TTL_SECONDS = 60
 
-# LLM queue/backoff
 import time
-LLM_QUEUE = None  # lazy init when event loop exists
-LLM_BACKOFF_SCHEDULE = [20, 40, 60]
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -62,15 +70,26 @@ OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
 LLM_FALLBACK_ENABLED = os.environ.get('LLM_FALLBACK_ENABLED', 'true').lower() == 'true'
 
-# Lazy OpenAI client init
+# Lazy OpenAI client init (async, one pooled HTTP client shared by all requests)
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '50'))
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_TIMEOUT_SECONDS', '120'))
 _openai_client = None
 
 def get_openai_client():
     global _openai_client
     if _openai_client is None and OPENAI_API_KEY:
         try:
-            from openai import OpenAI
-            _openai_client = OpenAI(api_key=OPENAI_API_KEY)
+            import httpx
+            from openai import AsyncOpenAI
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=10.0)
+            )
+            # 429s are handled (and learned from) by the shared LLM limiter, not by SDK retries
+            _openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI client: {e}")
             _openai_client = None
@@ -79,7 +98,7 @@ def get_openai_client():
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
 
 # Import auth dependencies after database setup
-from auth_dependencies import get_current_user, require_approved_user, require_admin
+from auth_dependencies import get_current_user, require_approved_user, require_admin, invalidate_cached_user
 
 # Document type mapping
 DOCUMENT_TYPES = {
@@ -210,7 +229,9 @@ class ScanResult(BaseModel):
     detected_full_name: str
     short_code: str
     confidence_score: float
-    image_base64: str
+    image_base64: str = ""  # Full page in scan responses; not stored in scan_results
+    image_id: Optional[str] = None  # Blob store id of the full page
+    thumbnail_base64: Optional[str] = None
     user_id: Optional[str] = None
     session_id: Optional[str] = None  # NEW: Group scans by session
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -286,18 +307,37 @@ class FolderScanStartResponse(BaseModel):
     total_folders: int
     total_files: int
     status_url: str
+    events_url: Optional[str] = None  # Server-sent progress events (instead of polling status_url)
+
+
+# In-process rules cache: /rules writes bump the version, the TTL picks up
+# writes made by other server processes
+RULES_CACHE_TTL_SECONDS = int(os.environ.get('RULES_CACHE_TTL_SECONDS', '300'))
+_rules_cache = {"rules": None, "ts": 0.0, "version": 0, "prompt": None, "prompt_version": -1}
+_rules_index_dropped = False
+
+
+def invalidate_rules_cache():
+    """Force the next get_document_rules() call to reload from MongoDB"""
+    _rules_cache["rules"] = None
+    _rules_cache["version"] += 1
 
 
 async def get_document_rules() -> dict:
-    """Get all document rules from database or initialize from DOCUMENT_TYPES"""
+    """Get all document rules (cached in memory) or initialize from DOCUMENT_TYPES"""
+    global _rules_index_dropped
+    if _rules_cache["rules"] is not None and time.time() - _rules_cache["ts"] < RULES_CACHE_TTL_SECONDS:
+        return _rules_cache["rules"]
     try:
-        # DROP unique index if exists (we now allow duplicate short_codes)
-        try:
-            await db.document_rules.drop_index("short_code_1")
-            logger.info("Dropped unique index on short_code to allow duplicates")
-        except Exception:
-            # Index doesn't exist or already dropped
-            pass
+        # DROP unique index if exists (we now allow duplicate short_codes) - once per process
+        if not _rules_index_dropped:
+            try:
+                await db.document_rules.drop_index("short_code_1")
+                logger.info("Dropped unique index on short_code to allow duplicates")
+            except Exception:
+                # Index doesn't exist or already dropped
+                pass
+            _rules_index_dropped = True
         
         # Check if rules exist in database
         rules_count = await db.document_rules.count_documents({})
@@ -324,12 +364,16 @@ async def get_document_rules() -> dict:
             logger.info(f"Initialized {final_count} document rules")
         
         # Fetch all rules from database
-        rules_cursor = db.document_rules.find({})
+        rules_cursor = db.document_rules.find({}, {"_id": 0, "full_name": 1, "short_code": 1})
         rules = await rules_cursor.to_list(length=None)
         
         # Convert to dict format {full_name: short_code}
         rules_dict = {rule['full_name']: rule['short_code'] for rule in rules}
         
+        if rules_dict != _rules_cache["rules"]:
+            _rules_cache["version"] += 1
+        _rules_cache["rules"] = rules_dict
+        _rules_cache["ts"] = time.time()
         return rules_dict
     except Exception as e:
         logger.error(f"Error getting document rules: {e}")
@@ -353,7 +397,7 @@ async def smart_crop_and_analyze(image_bytes: bytes) -> tuple[str, dict]:
     try:
         # PASS 1: Quick emblem detection with 30% crop
         logger.info("🔍 PASS 1: Detecting emblem with 30% crop...")
-        quick_crop_base64 = resize_image_for_api(image_bytes, max_size=800, crop_top_only=True, crop_percentage=0.30)
+        quick_crop_base64 = await run_cpu(resize_image_for_api, image_bytes, max_size=800, crop_top_only=True, crop_percentage=0.30)
         
         has_emblem = await detect_emblem_in_image(quick_crop_base64)
         
@@ -370,7 +414,8 @@ async def smart_crop_and_analyze(image_bytes: bytes) -> tuple[str, dict]:
             optimal_crop_percentage = 0.70
         
         # Create optimal crop for final analysis
-        cropped_image_base64 = resize_image_for_api(
+        cropped_image_base64 = await run_cpu(
+            resize_image_for_api,
             image_bytes, 
             max_size=1024, 
             crop_top_only=True, 
@@ -387,13 +432,30 @@ async def smart_crop_and_analyze(image_bytes: bytes) -> tuple[str, dict]:
         logger.error(f"Error in smart crop and analyze: {e}")
         # Fallback: use 45% crop (middle ground)
         logger.info("⚠️  Fallback to 45% crop due to error")
-        fallback_crop = resize_image_for_api(image_bytes, max_size=1024, crop_top_only=True, crop_percentage=0.45)
+        fallback_crop = await run_cpu(resize_image_for_api, image_bytes, max_size=1024, crop_top_only=True, crop_percentage=0.45)
         analysis = await analyze_document_hybrid(fallback_crop, use_hybrid=USE_HYBRID_OCR)
         return fallback_crop, analysis
 
 
+# 'local' = NumPy colour/shape detector (no API call), 'llm' = ask GPT-4o
+EMBLEM_DETECTOR = os.environ.get('EMBLEM_DETECTOR', 'local').lower()
+
+
 async def detect_emblem_in_image(image_base64: str) -> bool:
     """Quick check to detect Vietnamese national emblem in image - for smart cropping"""
+    if EMBLEM_DETECTOR == 'llm':
+        return await detect_emblem_with_llm(image_base64)
+    try:
+        has_emblem = await run_cpu(detect_emblem, image_base64)
+        logger.info(f"Emblem detection (local): {has_emblem}")
+        return has_emblem
+    except Exception as e:
+        logger.error(f"Error detecting emblem: {e}")
+        return False
+
+
+async def detect_emblem_with_llm(image_base64: str) -> bool:
+    """Emblem check with a GPT-4o YES/NO call (kept for EMBLEM_DETECTOR=llm and the benchmark)"""
     try:
         chat = LlmChat(
             api_key=EMERGENT_LLM_KEY,
@@ -417,7 +479,7 @@ Answer with ONLY ONE WORD:
 
 Your answer:"""
         user_message = UserMessage(text=prompt, file_contents=[image_content])
-        response = await chat.send_message(user_message)
+        response = await call_llm("emergent", "gpt-4o", lambda: chat.send_message(user_message))
         answer = response.strip().upper()
         has_emblem = "YES" in answer
         logger.info(f"Emblem detection result: {answer} → {has_emblem}")
@@ -429,39 +491,47 @@ Your answer:"""
 
 async def _analyze_with_openai_vision(image_base64: str, prompt: str, max_tokens: int = 512, temperature: float = 0.2) -> str:
     """Call OpenAI Vision (gpt-4o-mini) and return text content."""
+    return await _analyze_pages_with_openai_vision([image_base64], prompt, max_tokens=max_tokens, temperature=temperature)
+
+
+async def _analyze_pages_with_openai_vision(images_base64: List[str], prompt: str, max_tokens: int = 512, temperature: float = 0.2) -> str:
+    """One OpenAI Vision request with the prompt followed by the images in page order"""
     client = get_openai_client()
     if not client:
         raise RuntimeError("OpenAI client not initialized. Missing or invalid OPENAI_API_KEY")
-    data_url = f"data:image/jpeg;base64,{image_base64}"
+    image_parts = [
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}", "detail": "auto"}}
+        for image_base64 in images_base64
+    ]
     # Use chat.completions (OpenAI SDK v1.x)
-    resp = client.chat.completions.create(
+    resp = await call_llm("openai", OPENAI_MODEL, lambda: client.chat.completions.create(
         model=OPENAI_MODEL,
         messages=[
             {"role": "system", "content": "You are a precise OCR and document classifier. Always answer in JSON when asked."},
             {
                 "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": data_url, "detail": "auto"}}
-                ]
+                "content": [{"type": "text", "text": prompt}] + image_parts
             }
         ],
         max_tokens=max_tokens,
         temperature=temperature
-    )
+    ))
     content = resp.choices[0].message.content or ""
     return content
 
 
 async def _analyze_with_emergent(image_base64: str, prompt: str) -> str:
+    return await _analyze_pages_with_emergent([image_base64], prompt)
+
+
+async def _analyze_pages_with_emergent(images_base64: List[str], prompt: str) -> str:
     chat = LlmChat(
         api_key=EMERGENT_LLM_KEY,
         session_id=f"doc_scan_{uuid.uuid4()}",
         system_message="Bạn là AI chuyên gia phân loại tài liệu đất đai Việt Nam. Luôn trả về JSON."
     ).with_model("openai", "gpt-4o")
-    image_content = ImageContent(image_base64=image_base64)
-    user_message = UserMessage(text=prompt, file_contents=[image_content])
-    response = await chat.send_message(user_message)
+    user_message = UserMessage(text=prompt, file_contents=[ImageContent(image_base64=image_base64) for image_base64 in images_base64])
+    response = await call_llm("emergent", "gpt-4o", lambda: chat.send_message(user_message))
     return response
 
 
@@ -491,42 +561,28 @@ async def analyze_document_hybrid(image_base64: str, use_hybrid: bool = True) ->
         return await analyze_document_with_vision(image_base64)
     
     # Step 1: Try OCR + Rules (FREE, 93% accuracy)
-    import tempfile
-    import base64
-    from ocr_engine import extract_text_from_image
     from rule_classifier import classify_by_rules, classify_document_name_from_code
     
+    # OCR runs once per page, in memory; every tier below reuses the same text
+    text = ""
     try:
-        # Decode base64 to temp file for OCR
-        image_bytes = base64.b64decode(image_base64)
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            temp_file.write(image_bytes)
-            temp_path = temp_file.name
+        ocr = await run_ocr_async(base64.b64decode(image_base64), upright=OCR_PAGES_UPRIGHT)
+        text = ocr["text"]
         
-        try:
-            # Extract text using PaddleOCR
-            text = extract_text_from_image(temp_path)
+        if text and len(text) > 10:
+            # Classify using rules
+            result = classify_by_rules(text, confidence_threshold=0.3)
             
-            if text and len(text) > 10:
-                # Classify using rules
-                result = classify_by_rules(text, confidence_threshold=0.3)
-                
-                if result["confidence"] >= 0.3 and result["type"] != "UNKNOWN":
-                    # Success with rules!
-                    full_name = classify_document_name_from_code(result["type"])
-                    return {
-                        "detected_full_name": full_name,
-                        "short_code": result["type"],
-                        "confidence": result["confidence"],
-                        "method": "hybrid_ocr_rules",
-                        "matched_keywords": result.get("matched_keywords", [])
-                    }
-        finally:
-            # Cleanup temp file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+            if result["confidence"] >= 0.3 and result["type"] != "UNKNOWN":
+                # Success with rules!
+                full_name = classify_document_name_from_code(result["type"])
+                return {
+                    "detected_full_name": full_name,
+                    "short_code": result["type"],
+                    "confidence": result["confidence"],
+                    "method": "hybrid_ocr_rules",
+                    "matched_keywords": result.get("matched_keywords", [])
+                }
     
     except Exception as ocr_error:
         logger.warning(f"OCR+Rules failed: {ocr_error}, falling back to GPT-4")
@@ -534,64 +590,101 @@ async def analyze_document_hybrid(image_base64: str, use_hybrid: bool = True) ->
     # Step 2: Fallback to GPT-4 Vision (for 7% difficult cases)
     gpt_result = await analyze_document_with_vision(image_base64)
     
-    # Step 3: If GPT-4 returns UNKNOWN/low confidence, try Rules as last resort
-    if gpt_result.get("short_code") == "UNKNOWN" or gpt_result.get("confidence", 0) < 0.5:
+    # Step 3: If GPT-4 returns UNKNOWN/low confidence, try Rules as last resort (same OCR text)
+    if (gpt_result.get("short_code") == "UNKNOWN" or gpt_result.get("confidence", 0) < 0.5) and text and len(text) > 10:
         logger.warning(f"GPT-4 returned UNKNOWN or low confidence ({gpt_result.get('confidence')}), trying Rules as backup")
         
         try:
-            # Try OCR + Rules again as final fallback
-            import tempfile
-            import base64
-            from ocr_engine import extract_text_from_image
-            from rule_classifier import classify_by_rules, classify_document_name_from_code
-            
-            image_bytes = base64.b64decode(image_base64)
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                temp_file.write(image_bytes)
-                temp_path = temp_file.name
+            result = classify_by_rules(text, confidence_threshold=0.2)  # Lower threshold for fallback
             
-            try:
-                text = extract_text_from_image(temp_path)
-                if text and len(text) > 10:
-                    result = classify_by_rules(text, confidence_threshold=0.2)  # Lower threshold for fallback
-                    
-                    if result["type"] != "UNKNOWN":
-                        # Rules found something! Use it
-                        full_name = classify_document_name_from_code(result["type"])
-                        logger.info(f"Rules backup success: {result['type']} with confidence {result['confidence']}")
-                        return {
-                            "detected_full_name": full_name,
-                            "short_code": result["type"],
-                            "confidence": result["confidence"],
-                            "method": "hybrid_rules_backup",
-                            "matched_keywords": result.get("matched_keywords", [])
-                        }
-            finally:
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
+            if result["type"] != "UNKNOWN":
+                # Rules found something! Use it
+                full_name = classify_document_name_from_code(result["type"])
+                logger.info(f"Rules backup success: {result['type']} with confidence {result['confidence']}")
+                return {
+                    "detected_full_name": full_name,
+                    "short_code": result["type"],
+                    "confidence": result["confidence"],
+                    "method": "hybrid_rules_backup",
+                    "matched_keywords": result.get("matched_keywords", [])
+                }
         except Exception as backup_error:
             logger.warning(f"Rules backup also failed: {backup_error}")
     
-    gpt_result["method"] = "hybrid_gpt_fallback"
+    gpt_result["method"] = "hybrid_gpt_fallback_cache_hit" if gpt_result.get("method") == "vision_cache_hit" else "hybrid_gpt_fallback"
     return gpt_result
 
 
-async def analyze_document_with_vision(image_base64: str) -> dict:
-    """
-    Analyze document using GPT-4 Vision (original method)
-    """
-    """Analyze document using OpenAI Vision API with dynamic rules from database"""
+# Content-addressed classification cache (Mongo): LRU bounded to CLASSIFICATION_CACHE_MAX_ENTRIES
+# by last_access, and idle entries also expire via the TTL index
+CLASSIFICATION_CACHE_ENABLED = os.environ.get('CLASSIFICATION_CACHE', 'true').lower() == 'true'
+CLASSIFICATION_CACHE_TTL_DAYS = int(os.environ.get('CLASSIFICATION_CACHE_TTL_DAYS', '30'))
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.environ.get('CLASSIFICATION_CACHE_MAX_ENTRIES', '50000'))
+# Size check runs once per this many new entries (a count per write would cost more than the cache saves)
+CLASSIFICATION_CACHE_EVICT_EVERY = 100
+_classification_cache_indexed = False
+_classification_cache_inserts = 0
+
+
+def _classification_cache_key(image_base64: str, model: str, prompt: str) -> str:
+    """sha256(image bytes) + model + prompt hash - rule changes alter the prompt and bust the cache"""
+    image_hash = hashlib.sha256(base64.b64decode(image_base64)).hexdigest()
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+    return f"{image_hash}:{model}:{prompt_hash}"
+
+
+async def get_cached_classification(key: str) -> Optional[dict]:
+    global _classification_cache_indexed
+    if not CLASSIFICATION_CACHE_ENABLED:
+        return None
     try:
-        # Get document rules from database
-        document_rules = await get_document_rules()
-        
-        # Create a mapping list for the prompt
-        doc_types_list = "\n".join([f"- {full_name}: {code}" for full_name, code in document_rules.items()])
-        
-        # Build prompt (kept from previous logic)
-        prompt = f"""IMPORTANT: This is a DOCUMENT ANALYSIS task for land registry documents. 
+        if not _classification_cache_indexed:
+            await db.classification_cache.create_index(
+                "last_access", expireAfterSeconds=CLASSIFICATION_CACHE_TTL_DAYS * 86400
+            )
+            _classification_cache_indexed = True
+        doc = await db.classification_cache.find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_access": datetime.now(timezone.utc)}, "$inc": {"hits": 1}},
+            projection={"result": 1}
+        )
+        return doc["result"] if doc else None
+    except Exception as e:
+        logger.warning(f"Classification cache read failed: {e}")
+        return None
+
+
+async def store_classification(key: str, result: dict):
+    if not CLASSIFICATION_CACHE_ENABLED or result.get("short_code") == "ERROR":
+        return
+    global _classification_cache_inserts
+    try:
+        write = await db.classification_cache.update_one(
+            {"_id": key},
+            {"$set": {"result": result, "last_access": datetime.now(timezone.utc)}, "$setOnInsert": {"hits": 0}},
+            upsert=True
+        )
+        if write.upserted_id is not None:
+            _classification_cache_inserts += 1
+            if _classification_cache_inserts % CLASSIFICATION_CACHE_EVICT_EVERY == 0:
+                await evict_classification_cache()
+    except Exception as e:
+        logger.warning(f"Classification cache write failed: {e}")
+
+
+async def evict_classification_cache():
+    """Drop the least recently used entries above CLASSIFICATION_CACHE_MAX_ENTRIES"""
+    excess = await db.classification_cache.estimated_document_count() - CLASSIFICATION_CACHE_MAX_ENTRIES
+    if excess <= 0:
+        return
+    # Oldest last_access first (served by the TTL index)
+    oldest = await db.classification_cache.find({}, {"_id": 1}).sort("last_access", 1).limit(excess).to_list(excess)
+    await db.classification_cache.delete_many({"_id": {"$in": [doc["_id"] for doc in oldest]}})
+    logger.info(f"Classification cache: evicted {len(oldest)} least recently used entries")
+
+
+# Vision classification prompt; {doc_types_list} is filled from the current rules
+VISION_PROMPT_TEMPLATE = """IMPORTANT: This is a DOCUMENT ANALYSIS task for land registry documents. 
 Any faces/photos in the document are part of official government records (ID photos on land certificates).
 Please analyze ONLY the document text and official stamps, not the personal photos.
 
@@ -783,6 +876,77 @@ TRẢ VỀ JSON:
 - CHỈ trả về mã khi khớp TOÀN BỘ tiêu đề với danh sách
 - KHÔNG khớp 1 nửa, vài chữ, hoặc gần giống
 - Backend sẽ tự xử lý việc gán trang tiếp theo"""
+
+
+# Appended to the vision prompt when several pages share one request (see classify_page)
+VISION_BATCH_PROMPT_SUFFIX = """
+
+📑 CHẾ ĐỘ NHIỀU TRANG: Có {page_count} ảnh, theo thứ tự page 0 → page {last_page}.
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+- Mỗi ảnh là MỘT trang RIÊNG BIỆT (có thể từ các tài liệu khác nhau)
+- Phân loại TỪNG trang ĐỘC LẬP theo đúng các quy tắc ở trên
+- KHÔNG gom trang, KHÔNG suy luận từ trang khác (backend sẽ tự gán trang tiếp theo)
+
+TRẢ VỀ JSON (thay cho định dạng 1 trang ở trên):
+{{
+  "pages": [
+    {{"page": 0, "detected_full_name": "...", "short_code": "...", "confidence": 0.9}},
+    {{"page": 1, "detected_full_name": "...", "short_code": "...", "confidence": 0.1}}
+  ]
+}}
+
+❗ PHẢI có ĐỦ {page_count} phần tử, mỗi page (0 → {last_page}) xuất hiện đúng 1 lần."""
+
+
+async def get_vision_prompt() -> str:
+    """Return the vision prompt for the current rules version (built once per version)"""
+    document_rules = await get_document_rules()
+    if _rules_cache["prompt"] is None or _rules_cache["prompt_version"] != _rules_cache["version"]:
+        doc_types_list = "\n".join([f"- {full_name}: {code}" for full_name, code in document_rules.items()])
+        _rules_cache["prompt"] = VISION_PROMPT_TEMPLATE.format(doc_types_list=doc_types_list)
+        _rules_cache["prompt_version"] = _rules_cache["version"]
+    return _rules_cache["prompt"]
+
+
+def _parse_vision_json(response_text: str):
+    """JSON object from a model answer (```json fences or inline JSON); None if there is none"""
+    import json
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+    
+    try:
+        return json.loads(response_text)
+    except Exception:
+        # Try to extract inline JSON
+        import re
+        m = re.search(r'\{[\s\S]*\}', response_text)
+        if m:
+            try:
+                return json.loads(m.group())
+            except Exception:
+                return None
+        return None
+
+
+async def analyze_document_with_vision(image_base64: str) -> dict:
+    """
+    Analyze document using GPT-4 Vision (original method)
+    """
+    """Analyze document using OpenAI Vision API with dynamic rules from database"""
+    try:
+        # Prompt is rebuilt only when the rules change (see get_vision_prompt)
+        prompt = await get_vision_prompt()
+        
+        # Same image + model + prompt already classified → skip the LLM call
+        primary_model = OPENAI_MODEL if LLM_PRIMARY == 'openai' else 'gpt-4o'
+        cache_key = _classification_cache_key(image_base64, primary_model, prompt)
+        cached = await get_cached_classification(cache_key)
+        if cached:
+            logger.info(f"Classification cache hit: {cached.get('short_code')}")
+            return {**cached, "method": "vision_cache_hit"}
+        answered_by_primary = True
         
         # Try OpenAI primary; fallback to Emergent if enabled
         if LLM_PRIMARY == 'emergent':
@@ -791,70 +955,22 @@ TRẢ VỀ JSON:
             try:
                 response_text = await _analyze_with_openai_vision(image_base64, prompt, max_tokens=700, temperature=0.1)
             except Exception as e:
+                # 429s were already queued and retried by the LLM limiter
                 logger.warning(f"Primary OpenAI vision failed: {e}")
-                # Queue + progressive backoff when rate-limited
-                err = str(e).lower()
-                if ("rate limit" in err or "429" in err) and LLM_BACKOFF_SCHEDULE:
-                    for wait_s in LLM_BACKOFF_SCHEDULE:
-                        logger.warning(f"OpenAI 429: waiting {wait_s}s before retry...")
-                        await asyncio.sleep(wait_s)
-                        try:
-                            response_text = await _analyze_with_openai_vision(image_base64, prompt, max_tokens=700, temperature=0.1)
-                            break
-                        except Exception as e2:
-                            err2 = str(e2).lower()
-                            if not ("rate limit" in err2 or "429" in err2):
-                                raise
-                    else:
-                        # exhausted backoff retries
-                        if not (LLM_FALLBACK_ENABLED and EMERGENT_LLM_KEY):
-                            raise
-                        # continue to fallback below
-                else:
-                    if not (LLM_FALLBACK_ENABLED and EMERGENT_LLM_KEY and _is_retryable_llm_error(e)):
-                        raise
-
-                # If we reach here, fallback is enabled
-                if LLM_FALLBACK_ENABLED and EMERGENT_LLM_KEY and _is_retryable_llm_error(e):
-                    # Emergent fallback using previous implementation
-                    try:
-                        chat = LlmChat(
-                            api_key=EMERGENT_LLM_KEY,
-                            session_id=f"doc_scan_{uuid.uuid4()}",
-                            system_message="Bạn là AI chuyên gia phân loại tài liệu đất đai Việt Nam. Luôn trả về JSON."
-                        ).with_model("openai", "gpt-4o")
-                        image_content = ImageContent(image_base64=image_base64)
-                        user_message = UserMessage(text=prompt, file_contents=[image_content])
-                        response_text = await chat.send_message(user_message)
-                    except Exception as fe:
-                        logger.error(f"Fallback Emergent failed: {fe}")
-                        raise
-                else:
+                if not (LLM_FALLBACK_ENABLED and EMERGENT_LLM_KEY and _is_retryable_llm_error(e)):
+                    raise
+                # Emergent fallback
+                try:
+                    response_text = await _analyze_with_emergent(image_base64, prompt)
+                    answered_by_primary = False
+                except Exception as fe:
+                    logger.error(f"Fallback Emergent failed: {fe}")
                     raise
         
         # Parse JSON response
-        import json
         response_text = (response_text or "").strip()
         logger.info(f"Vision raw response (first 200): {response_text[:200]}")
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        try:
-            result = json.loads(response_text)
-        except Exception:
-            # Try to extract inline JSON
-            import re
-            m = re.search(r'\{[\s\S]*\}', response_text)
-            if m:
-                import json as _json
-                try:
-                    result = _json.loads(m.group())
-                except Exception:
-                    result = None
-            else:
-                result = None
+        result = _parse_vision_json(response_text)
         
         if not result:
             # If policy refusal or non-json, classify as CONTINUATION
@@ -871,11 +987,15 @@ TRẢ VỀ JSON:
                 "confidence": 0.1
             }
         
-        return {
+        classification = {
             "detected_full_name": result.get("detected_full_name", "Không xác định"),
             "short_code": result.get("short_code", "UNKNOWN"),
             "confidence": result.get("confidence", 0.0)
         }
+        # Only cache answers from the model the key was built for
+        if answered_by_primary:
+            await store_classification(cache_key, classification)
+        return classification
         
     except Exception as e:
         logger.error(f"Error analyzing document: {e}")
@@ -886,113 +1006,198 @@ TRẢ VỀ JSON:
         }
 
 
-def resize_image_for_api(image_bytes: bytes, max_size: int = 1024, crop_top_only: bool = True, crop_percentage: float = 0.35) -> str:
-    """Resize image and convert to base64 - SMART CROP: adaptive based on emblem detection"""
-    try:
-        img = Image.open(BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        # SMART CROP: Dynamic crop based on crop_percentage parameter
-        if crop_top_only:
-            width, height = img.size
-            crop_height = int(height * crop_percentage)
-            img = img.crop((0, 0, width, crop_height))
-            logger.info(f"Smart cropped: {height}px → {crop_height}px ({int(crop_percentage*100)}% crop)")
-        
-        # Optimized resize for speed + quality balance
-        if max(img.size) > max_size:
-            ratio = max_size / max(img.size)
-            new_size = tuple(int(dim * ratio) for dim in img.size)
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # High quality for Vietnamese OCR
-        buffered = BytesIO()
-        img.save(buffered, format="JPEG", quality=80, optimize=True)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        return img_base64
-    except Exception as e:
-        logger.error(f"Error resizing image: {e}")
-        raise
+# ===== BATCHED CLASSIFICATION: several pages per vision request =====
+# Concurrent classify_page() calls are collected for up to VISION_BATCH_WAIT_MS and
+# sent as one request, so the ~600-token rules prompt is paid once per batch.
+# VISION_BATCH_SIZE=1 (default) keeps one page per request.
+# A batch takes one request slot (MAX_CONCURRENT_SCANS of them), while callers admit
+# VISION_BATCH_SIZE pages per slot so that enough pages are waiting to fill a batch.
+VISION_BATCH_SIZE = int(os.environ.get('VISION_BATCH_SIZE', '1'))
+VISION_BATCH_WAIT_MS = int(os.environ.get('VISION_BATCH_WAIT_MS', '50'))
+VISION_PAGES_PER_SLOT = max(1, VISION_BATCH_SIZE)
+_vision_batch = {"pending": [], "timer": None}
+_vision_batch_tasks = set()  # The event loop only keeps weak references to tasks
+_vision_slots = None
 
 
-def create_pdf_from_image(image_base64: str, output_path: str, filename: str):
-    """Create a PDF file from base64 image - AUTO-DETECT A3/A4 and orientation"""
-    try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64)
-        img = Image.open(BytesIO(image_data))
-        
-        # Convert to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        img_width, img_height = img.size
-        
-        # SMART PAGE SIZE DETECTION
-        # A3 = 297mm x 420mm = 842pt x 1191pt
-        # A4 = 210mm x 297mm = 595pt x 842pt
-        
-        # Determine if landscape or portrait
-        is_landscape = img_width > img_height
-        
-        # Calculate aspect ratio to detect A3 vs A4
-        aspect_ratio = max(img_width, img_height) / min(img_width, img_height)
-        _ = aspect_ratio  # quiet linter, reserved for future use
-        
-        # A3 aspect ratio ≈ 1.414 (√2)
-        # A4 aspect ratio ≈ 1.414 (√2) - same!
-        # But A3 is larger in pixels
-        
-        # Detect paper size based on image dimensions
-        # If image is very large (> 3000px on long side), likely A3
-        long_side = max(img_width, img_height)
-        
-        if long_side > 3000 or (img_width > 3000 and img_height > 2000):
-            # A3 size
-            if is_landscape:
-                page_size = landscape(A3)
-                logger.info(f"Detected A3 Landscape: {img_width}x{img_height}")
-            else:
-                page_size = portrait(A3)
-                logger.info(f"Detected A3 Portrait: {img_width}x{img_height}")
-        else:
-            # A4 size (default)
-            if is_landscape:
-                page_size = landscape(A4)
-                logger.info(f"Detected A4 Landscape: {img_width}x{img_height}")
+def get_vision_slots() -> asyncio.Semaphore:
+    """In-flight classify_page() vision requests, a batch counting once"""
+    global _vision_slots
+    if _vision_slots is None:
+        _vision_slots = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+    return _vision_slots
+
+
+async def analyze_documents_with_vision_batch(images_base64: List[str]) -> List[dict]:
+    """
+    Classify several pages with one vision request (page-indexed JSON response)
+    Cached pages are skipped; pages missing from the answer fall back to analyze_document_with_vision.
+    """
+    prompt = await get_vision_prompt()
+    primary_model = OPENAI_MODEL if LLM_PRIMARY == 'openai' else 'gpt-4o'
+    cache_keys = [_classification_cache_key(img, primary_model, prompt) for img in images_base64]
+    results = [None] * len(images_base64)
+    for i, key in enumerate(cache_keys):
+        cached = await get_cached_classification(key)
+        if cached:
+            results[i] = {**cached, "method": "vision_cache_hit"}
+
+    misses = [i for i, r in enumerate(results) if r is None]
+    if len(misses) > 1:
+        batch_prompt = prompt + VISION_BATCH_PROMPT_SUFFIX.format(page_count=len(misses), last_page=len(misses) - 1)
+        batch_images = [images_base64[i] for i in misses]
+        try:
+            if LLM_PRIMARY == 'emergent':
+                response_text = await _analyze_pages_with_emergent(batch_images, batch_prompt)
             else:
-                page_size = portrait(A4)
-                logger.info(f"Detected A4 Portrait: {img_width}x{img_height}")
-        
-        # Create PDF with detected page size
-        c = canvas.Canvas(output_path, pagesize=page_size)
-        
-        page_width, page_height = page_size
-        
-        # Calculate scaling to fit page while maintaining aspect ratio
-        scale = min(page_width / img_width, page_height / img_height) * 0.95  # 95% to leave margin
-        
-        new_width = img_width * scale
-        new_height = img_height * scale
-        
-        # Center the image
-        x = (page_width - new_width) / 2
-        y = (page_height - new_height) / 2
-        
-        # Draw image
-        img_reader = ImageReader(BytesIO(image_data))
-        c.drawImage(img_reader, x, y, width=new_width, height=new_height)
-        
-        c.save()
-        logger.info(f"Created PDF: {output_path} with page size {page_width:.0f}x{page_height:.0f}pt")
-        
+                response_text = await _analyze_pages_with_openai_vision(batch_images, batch_prompt, max_tokens=150 * len(misses) + 100, temperature=0.1)
+            parsed = _parse_vision_json((response_text or "").strip())
+            pages = parsed.get("pages") if isinstance(parsed, dict) else parsed
+            for page in pages if isinstance(pages, list) else []:
+                idx = page.get("page") if isinstance(page, dict) else None
+                if not isinstance(idx, int) or not 0 <= idx < len(misses) or results[misses[idx]] is not None:
+                    continue
+                classification = {
+                    "detected_full_name": page.get("detected_full_name", "Không xác định"),
+                    "short_code": page.get("short_code", "UNKNOWN"),
+                    "confidence": page.get("confidence", 0.0)
+                }
+                await store_classification(cache_keys[misses[idx]], classification)
+                results[misses[idx]] = {**classification, "method": "vision_batch"}
+            logger.info(f"Vision batch: {sum(results[i] is not None for i in misses)}/{len(misses)} pages in one request")
+        except Exception as e:
+            logger.warning(f"Vision batch of {len(misses)} pages failed, classifying one by one: {e}")
+
+    # Anything the batch did not answer goes through the single-page path (incl. fallback)
+    remaining = [i for i, r in enumerate(results) if r is None]
+    singles = await asyncio.gather(*[analyze_document_with_vision(images_base64[i]) for i in remaining])
+    for i, r in zip(remaining, singles):
+        results[i] = r
+    return results
+
+
+def _flush_vision_batch():
+    if _vision_batch["timer"] is not None:
+        _vision_batch["timer"].cancel()
+        _vision_batch["timer"] = None
+    items, _vision_batch["pending"] = _vision_batch["pending"], []
+    if items:
+        task = asyncio.create_task(_run_vision_batch(items))
+        _vision_batch_tasks.add(task)
+        task.add_done_callback(_vision_batch_tasks.discard)
+
+
+async def _run_vision_batch(items: list):
+    try:
+        async with get_vision_slots():
+            results = await analyze_documents_with_vision_batch([img for img, _ in items])
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
     except Exception as e:
-        logger.error(f"Error creating PDF: {e}")
-        raise
+        for _, future in items:
+            if not future.done():
+                future.set_exception(e)
+
+
+async def classify_page(image_base64: str) -> dict:
+    """Classify one cropped page; with VISION_BATCH_SIZE > 1 concurrent pages share one vision request"""
+    if VISION_BATCH_SIZE <= 1:
+        async with get_vision_slots():
+            return await analyze_document_with_vision(image_base64)
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _vision_batch["pending"].append((image_base64, future))
+    if len(_vision_batch["pending"]) >= VISION_BATCH_SIZE:
+        _flush_vision_batch()
+    elif _vision_batch["timer"] is None:
+        _vision_batch["timer"] = loop.call_later(VISION_BATCH_WAIT_MS / 1000, _flush_vision_batch)
+    return await future
+
+
+async def preprocess_scan_image_async(image_bytes: bytes, crop_max_size: int = 800, full_max_size: Optional[int] = 1280) -> dict:
+    # Image decoding/encoding is CPU-bound: run it in the CPU process pool
+    return await run_cpu(preprocess_scan_image, image_bytes, crop_max_size, full_max_size)
+
+
+def owner_id(user: Optional[dict]) -> Optional[str]:
+    """Owner key of scan results and jobs: the user's _id as a string (the JWT sub); user docs have no "id" field"""
+    user_id = user.get("_id") if user else None
+    return str(user_id) if user_id is not None else None
+
+
+async def scan_result_doc(result: ScanResult) -> dict:
+    """Mongo document for a scan result: the page image goes to the blob store, only its id + thumbnail stay inline"""
+    doc = result.model_dump()  # timestamp stays a datetime → native BSON date
+    image_base64 = doc.pop('image_base64', None)
+    if image_base64:
+        image_bytes = base64.b64decode(image_base64)
+        doc['image_id'] = await page_images.put(image_bytes)
+        doc['thumbnail_base64'] = await run_cpu(
+            resize_image_for_api, image_bytes, max_size=SCAN_THUMBNAIL_SIZE, crop_top_only=False
+        )
+    return doc
+
+
+async def load_scan_image(doc: dict) -> Optional[bytes]:
+    """Full page image bytes of a scan_results document"""
+    if doc.get('image_id'):
+        return await page_images.get(doc['image_id'])
+    if doc.get('image_base64'):  # Not yet moved to the blob store
+        return base64.b64decode(doc['image_base64'])
+    return None
+
+
+async def load_scan_images(docs: list) -> list:
+    images = await asyncio.gather(*(load_scan_image(doc) for doc in docs))
+    if any(image is None for image in images):
+        raise HTTPException(status_code=404, detail="Scan image not found")
+    return images
+
+
+async def migrate_scan_images(batch_size: int = 50):
+    """Move page images still stored inline in scan_results into the blob store"""
+    moved = 0
+    query = {"image_base64": {"$nin": [None, ""]}}
+    while True:
+        docs = await db.scan_results.find(query, {"_id": 1, "image_base64": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        for doc in docs:
+            try:
+                image_bytes = base64.b64decode(doc['image_base64'])
+                image_id = await page_images.put(image_bytes)
+                thumbnail = await run_cpu(resize_image_for_api, image_bytes, max_size=SCAN_THUMBNAIL_SIZE, crop_top_only=False)
+                await db.scan_results.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": {"image_id": image_id, "thumbnail_base64": thumbnail}, "$unset": {"image_base64": ""}}
+                )
+                moved += 1
+            except Exception as e:
+                logger.warning(f"Could not move scan image {doc['_id']} to the blob store: {e}")
+        # Skip past failed documents instead of retrying them forever
+        query["_id"] = {"$gt": docs[-1]["_id"]}
+    if moved:
+        logger.info(f"Moved {moved} scan images into the blob store")
+
+
+@api_router.get("/scan-image/{image_id}")
+async def get_scan_image(
+    image_id: str,
+    request: Request,
+    current_user: dict = Depends(require_approved_user)
+):
+    """Full page image of one of the current user's scans; content-addressed, so clients may cache it forever"""
+    owned = await db.scan_results.find_one({"image_id": image_id, "user_id": owner_id(current_user)}, {"_id": 1})
+    if not owned:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = {"Cache-Control": "private, max-age=31536000, immutable", "ETag": f'"{image_id}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    data = await page_images.get(image_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
 
 @api_router.post("/retry-scan")
@@ -1017,16 +1222,12 @@ async def retry_scan(
             raise HTTPException(status_code=400, detail="Document is not in error state")
         
         # Check if we have the image
-        image_base64 = failed_scan.get('image_base64')
-        if not image_base64:
+        image_bytes = await load_scan_image(failed_scan)
+        if not image_bytes:
             raise HTTPException(status_code=400, detail="No image data to retry")
         
-        # Decode image and retry scan
-        import base64
-        image_bytes = base64.b64decode(image_base64)
-        
         # Create cropped image for OCR (35% crop, 1024px)
-        cropped_image_base64 = resize_image_for_api(image_bytes, crop_top_only=True, max_size=1024)
+        cropped_image_base64 = await run_cpu(resize_image_for_api, image_bytes, crop_top_only=True, max_size=1024)
         
         # Retry analysis with Vision API
         analysis_result = await analyze_document_with_vision(cropped_image_base64)
@@ -1069,30 +1270,13 @@ async def scan_document(
         # Read file content
         content = await file.read()
         
-        # DETECT ASPECT RATIO FROM ORIGINAL IMAGE FIRST (before any resize)
-        img_original = Image.open(BytesIO(content))
-        img_width, img_height = img_original.size
-        aspect_ratio = img_width / img_height
-        
-        logger.info(f"Original image: {img_width}x{img_height}, aspect ratio: {aspect_ratio:.2f}")
-        
-        # If aspect ratio > 1.35, likely 2-page horizontal spread or wide format (like GCN cũ)
-        # Lowered from 1.5 to 1.35 to catch more 2-page documents
-        if aspect_ratio > 1.35:
-            # 2-page spread or wide format: Title may be at 40-60%, use 65% crop
-            crop_percent = 0.65
-            logger.info(f"→ Detected 2-page/wide format (aspect {aspect_ratio:.2f}) → Using 65% crop")
-        else:
-            # Single page portrait: 50% crop sufficient
-            crop_percent = 0.50
-            logger.info(f"→ Detected single page (aspect {aspect_ratio:.2f}) → Using 50% crop")
+        # Decode once: aspect ratio → crop (65% for 2-page/wide, 50% single page) + FULL preview
+        pre = await preprocess_scan_image_async(content, crop_max_size=800, full_max_size=1280)
+        logger.info(f"Original image: {pre['width']}x{pre['height']}, aspect ratio: {pre['aspect_ratio']:.2f} → {int(pre['crop_percent']*100)}% crop")
+        full_image_base64 = pre["full_image_base64"]
         
-        # Create FULL image for preview/storage (AFTER detection)
-        full_image_base64 = resize_image_for_api(content, crop_top_only=False, max_size=1280)
-        
-        # Crop and analyze with detected percentage
-        cropped_image_base64 = resize_image_for_api(content, crop_top_only=True, max_size=800, crop_percentage=crop_percent)
-        analysis_result = await analyze_document_with_vision(cropped_image_base64)
+        # Analyze the title crop
+        analysis_result = await analyze_document_with_vision(pre["cropped_image_base64"])
         
         # Create scan result with FULL image for preview
         scan_result = ScanResult(
@@ -1102,13 +1286,11 @@ async def scan_document(
             short_code=analysis_result["short_code"],
             confidence_score=analysis_result["confidence"],
             image_base64=full_image_base64,  # Store full image
-            user_id=current_user.get("id")
+            user_id=owner_id(current_user)
         )
         
         # Save to database
-        doc = scan_result.model_dump()
-        doc['timestamp'] = doc['timestamp'].isoformat()
-        await db.scan_results.insert_one(doc)
+        await db.scan_results.insert_one(await scan_result_doc(scan_result))
         
         return scan_result
         
@@ -1129,27 +1311,13 @@ async def scan_document_public(
         # Read file content
         content = await file.read()
         
-        # DETECT ASPECT RATIO FROM ORIGINAL IMAGE FIRST
-        img_original = Image.open(BytesIO(content))
-        img_width, img_height = img_original.size
-        aspect_ratio = img_width / img_height
+        # Decode once: aspect ratio → crop (65% for 2-page/wide, 50% single page) + FULL preview
+        pre = await preprocess_scan_image_async(content, crop_max_size=800, full_max_size=1280)
+        logger.info(f"[Desktop App] Original image: {pre['width']}x{pre['height']}, aspect ratio: {pre['aspect_ratio']:.2f} → {int(pre['crop_percent']*100)}% crop")
+        full_image_base64 = pre["full_image_base64"]
         
-        logger.info(f"[Desktop App] Original image: {img_width}x{img_height}, aspect ratio: {aspect_ratio:.2f}")
-        
-        # If aspect ratio > 1.35, likely 2-page horizontal spread
-        if aspect_ratio > 1.35:
-            crop_percent = 0.65
-            logger.info(f"→ Detected 2-page/wide format → Using 65% crop")
-        else:
-            crop_percent = 0.50
-            logger.info(f"→ Detected single page → Using 50% crop")
-        
-        # Create FULL image for preview
-        full_image_base64 = resize_image_for_api(content, crop_top_only=False, max_size=1280)
-        
-        # Crop and analyze with HYBRID MODE (OCR+Rules first, GPT-4 fallback)
-        cropped_image_base64 = resize_image_for_api(content, crop_top_only=True, max_size=800, crop_percentage=crop_percent)
-        analysis_result = await analyze_document_hybrid(cropped_image_base64, use_hybrid=True)
+        # Analyze with HYBRID MODE (OCR+Rules first, GPT-4 fallback)
+        analysis_result = await analyze_document_hybrid(pre["cropped_image_base64"], use_hybrid=True)
         
         # Create scan result (no user_id for public endpoint)
         scan_result = ScanResult(
@@ -1163,9 +1331,7 @@ async def scan_document_public(
         )
         
         # Optional: Save to database with desktop-app marker
-        doc = scan_result.model_dump()
-        doc['timestamp'] = doc['timestamp'].isoformat()
-        await db.scan_results.insert_one(doc)
+        await db.scan_results.insert_one(await scan_result_doc(scan_result))
         
         return scan_result
         
@@ -1174,6 +1340,17 @@ async def scan_document_public(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def is_continuation_page(short_code: str, confidence: float, detected_name) -> bool:
+    """
+    Page without a title of its own → continues the previous document:
+    1. short_code = "UNKNOWN" (AI không nhận diện được)
+    2. confidence < 0.3 (AI không chắc chắn)
+    3. Có chữ "không rõ" hoặc "unknown" trong tên
+    """
+    name = detected_name.lower() if isinstance(detected_name, str) else ""
+    return short_code == "UNKNOWN" or confidence < 0.3 or "không rõ" in name or "unknown" in name
+
+
 def apply_smart_grouping(results: List[ScanResult]) -> List[ScanResult]:
     """
     Smart grouping: STRICT mode - QUY TẮC MỚI
@@ -1204,16 +1381,8 @@ def apply_smart_grouping(results: List[ScanResult]) -> List[ScanResult]:
             continuation_count = 0
             continue
         
-        # QUY TẮC MỚI: Coi là "không có tiêu đề" nếu:
-        # 1. short_code = "UNKNOWN" (AI không nhận diện được)
-        # 2. confidence < 0.3 (AI không chắc chắn)
-        # 3. Có chữ "không rõ" hoặc "unknown" trong tên
-        is_continuation = (
-            result.short_code == "UNKNOWN" or 
-            result.confidence_score < 0.3 or
-            "không rõ" in result.detected_full_name.lower() or
-            "unknown" in result.detected_full_name.lower()
-        )
+        # QUY TẮC MỚI: Coi là "không có tiêu đề" (xem is_continuation_page)
+        is_continuation = is_continuation_page(result.short_code, result.confidence_score, result.detected_full_name)
         
         if is_continuation and last_valid_code:
             # Trang này không có tiêu đề → Vẫn thuộc tài liệu trước
@@ -1260,6 +1429,28 @@ def apply_smart_grouping(results: List[ScanResult]) -> List[ScanResult]:
     return grouped
 
 
+def group_folder_results(results: List[FolderScanFileResult]) -> List[FolderScanFileResult]:
+    """
+    Ordered grouping pass for folder jobs (same rule as apply_smart_grouping)
+    
+    Pages are classified in parallel and checkpointed as-is; this pass runs over the
+    folder in page order so a continuation page always inherits the code of the
+    nearest titled page before it, no matter which request finished first.
+    """
+    grouped = []
+    last_valid_code = None
+    for fr in results:
+        if fr.status != "success":
+            grouped.append(fr)
+            continue
+        if is_continuation_page(fr.short_code, fr.confidence_score, fr.detected_full_name) and last_valid_code:
+            grouped.append(fr.model_copy(update={"short_code": last_valid_code}))
+        else:
+            last_valid_code = fr.short_code
+            grouped.append(fr)
+    return grouped
+
+
 @api_router.post("/batch-scan", response_model=List[ScanResult])
 async def batch_scan(
     files: List[UploadFile] = File(...),
@@ -1293,7 +1484,8 @@ async def batch_scan(
         # Semaphore to limit concurrent API calls (avoid rate limits and timeout)
         # Use lower concurrency in production to avoid infrastructure timeouts
         MAX_CONCURRENT = int(os.getenv("MAX_CONCURRENT_SCANS", "2"))  # Default 2 for deployed env
-        semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+        # Pages in flight; vision requests stay capped by classify_page's slots
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT * VISION_PAGES_PER_SLOT)
         
         async def process_file(file, current_user_dict, session_id, file_index, retry_count=0):
             async with semaphore:  # Control concurrency
@@ -1302,19 +1494,11 @@ async def batch_scan(
                     # Read file content
                     content = await file.read()
                     
-                    # DETECT ASPECT RATIO FROM ORIGINAL IMAGE FIRST
-                    img_original = Image.open(BytesIO(content))
-                    img_width, img_height = img_original.size
-                    aspect_ratio = img_width / img_height
-                    
-                    # 2-page spread or wide format needs more crop (lowered threshold to 1.35)
-                    crop_percent = 0.65 if aspect_ratio > 1.35 else 0.50
+                    # Decode once: title crop + FULL preview, off the event loop
+                    pre = await preprocess_scan_image_async(content, crop_max_size=800, full_max_size=1280)
+                    full_image_base64 = pre["full_image_base64"]
                     
-                    # Create FULL image for preview (AFTER detection)
-                    full_image_base64 = resize_image_for_api(content, max_size=1280, crop_top_only=False)
-                    
-                    cropped_image_base64 = resize_image_for_api(content, max_size=800, crop_top_only=True, crop_percentage=crop_percent)
-                    analysis_result = await analyze_document_with_vision(cropped_image_base64)
+                    analysis_result = await classify_page(pre["cropped_image_base64"])
                     
                     # Create scan result with FULL image for display
                     scan_result = ScanResult(
@@ -1324,7 +1508,7 @@ async def batch_scan(
                         short_code=analysis_result["short_code"],
                         confidence_score=analysis_result["confidence"],
                         image_base64=full_image_base64,  # Store full image
-                        user_id=current_user_dict.get("id") if current_user_dict else None,
+                        user_id=owner_id(current_user_dict),
                         session_id=session_id  # Add session ID
                     )
                     
@@ -1332,10 +1516,9 @@ async def batch_scan(
                 except Exception as e:
                     error_msg = str(e)
                     
-                    # Auto retry for timeout/connection errors
+                    # Auto retry for timeout/connection errors (rate limits are queued by the LLM limiter)
                     is_retryable = ("timeout" in error_msg.lower() or 
-                                   "connection" in error_msg.lower() or
-                                   "rate limit" in error_msg.lower())
+                                   "connection" in error_msg.lower())
                     
                     if is_retryable and retry_count < max_retries:
                         logger.warning(f"Retrying {file.filename} (attempt {retry_count + 1}/{max_retries})")
@@ -1372,7 +1555,7 @@ async def batch_scan(
                         short_code="ERROR",
                         confidence_score=0.0,
                         image_base64="",
-                        user_id=current_user_dict.get("id") if current_user_dict else None,
+                        user_id=owner_id(current_user_dict),
                         session_id=session_id  # Add session ID even for errors
                     ))
         
@@ -1407,13 +1590,8 @@ async def batch_scan(
         
         # Save to database in batch
         if valid_results:
-            docs = []
-            for result in valid_results:
-                doc = result.model_dump()
-                doc['timestamp'] = doc['timestamp'].isoformat()
-                docs.append(doc)
-            
-            await db.scan_results.insert_many(docs)
+            docs = await asyncio.gather(*(scan_result_doc(result) for result in valid_results))
+            await db.scan_results.insert_many(list(docs))
         
         return new_grouped_results
         
@@ -1422,21 +1600,118 @@ async def batch_scan(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def migrate_scan_owners():
+    """Backfill scan_results saved without an owner (user_id was always null before it was keyed on _id)
+
+    Nothing in those documents names their owner: they stay hidden from every user unless
+    LEGACY_SCAN_OWNER names the account (username) they should be given to.
+    """
+    unowned = {"user_id": None}
+    count = await db.scan_results.count_documents(unowned)
+    if not count:
+        return
+    username = os.environ.get('LEGACY_SCAN_OWNER', '').strip().lower()
+    owner = await db.users.find_one({"username": username}, {"_id": 1}) if username else None
+    if owner is None:
+        logger.warning(f"{count} scan results have no owner and are hidden; set LEGACY_SCAN_OWNER to assign them")
+        return
+    result = await db.scan_results.update_many(unowned, {"$set": {"user_id": owner_id(owner)}})
+    logger.info(f"Assigned {result.modified_count} unowned scan results to {username}")
+
+
+SCAN_HISTORY_PAGE_SIZE = 100
+SCAN_HISTORY_MAX_PAGE_SIZE = 500
+
+
+async def ensure_scan_result_indexes():
+    # History pages: newest first per user, id breaks timestamp ties (cursor order)
+    await db.scan_results.create_index([("user_id", 1), ("timestamp", -1), ("id", -1)])
+    await db.scan_results.create_index("id")
+    # /scan-image ownership check
+    await db.scan_results.create_index([("image_id", 1), ("user_id", 1)])
+
+
+async def migrate_scan_timestamps(batch_size: int = 500):
+    """Convert ISO string timestamps of older scan_results to native BSON dates"""
+    converted = 0
+    query = {"timestamp": {"$type": "string"}}
+    while True:
+        docs = await db.scan_results.find(query, {"_id": 1, "timestamp": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        for doc in docs:
+            try:
+                timestamp = datetime.fromisoformat(doc["timestamp"])
+            except ValueError:
+                logger.warning(f"Unparseable scan timestamp {doc['timestamp']!r} on {doc['_id']}")
+                continue
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            await db.scan_results.update_one({"_id": doc["_id"]}, {"$set": {"timestamp": timestamp}})
+            converted += 1
+        query["_id"] = {"$gt": docs[-1]["_id"]}
+    if converted:
+        logger.info(f"Converted {converted} scan timestamps to BSON dates")
+
+
+def parse_history_cursor(after: str) -> tuple:
+    """'<ISO timestamp>,<scan id>' → (aware datetime, id)"""
+    try:
+        timestamp, scan_id = after.rsplit(",", 1)
+        timestamp = datetime.fromisoformat(timestamp)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor, expected after=<timestamp>,<id>")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp, scan_id
+
+
 @api_router.get("/scan-history", response_model=List[ScanResult])
-async def get_scan_history(current_user: dict = Depends(require_approved_user)):
-    """Get scan history for current user"""
+async def get_scan_history(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = SCAN_HISTORY_PAGE_SIZE,
+    thumbnails: bool = True,
+    current_user: dict = Depends(require_approved_user)
+):
+    """
+    Get scan history for current user, newest first, one page at a time
+    The X-Next-Cursor response header is the `after` value for the next page (absent on the last page).
+    Full page images are served by /scan-image/{image_id}; thumbnails=false also drops the thumbnails.
+    """
     try:
         # Filter by user_id to only show current user's scans
-        user_id = current_user.get("id")
-        results = await db.scan_results.find({"user_id": user_id}, {"_id": 0}).sort("timestamp", -1).to_list(1000)
-        
-        # Convert ISO string timestamps back to datetime objects
+        user_id = owner_id(current_user)
+        limit = max(1, min(limit, SCAN_HISTORY_MAX_PAGE_SIZE))
+        query = {"user_id": user_id}
+        if after:
+            timestamp, scan_id = parse_history_cursor(after)
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "id": {"$lt": scan_id}},
+            ]
+        projection = {"_id": 0, "image_base64": 0}
+        if not thumbnails:
+            projection["thumbnail_base64"] = 0
+        
+        results = await db.scan_results.find(query, projection).sort(
+            [("timestamp", -1), ("id", -1)]
+        ).limit(limit).to_list(limit)
+        
+        # BSON dates come back naive (UTC); ISO strings until migrate_scan_timestamps has run
         for result in results:
             if isinstance(result['timestamp'], str):
                 result['timestamp'] = datetime.fromisoformat(result['timestamp'])
+            if result['timestamp'].tzinfo is None:
+                result['timestamp'] = result['timestamp'].replace(tzinfo=timezone.utc)
         
+        if len(results) == limit:
+            last = results[-1]
+            response.headers["X-Next-Cursor"] = f"{last['timestamp'].isoformat()},{last['id']}"
         return results
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting scan history: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1513,11 +1788,8 @@ async def export_single_document(
         pdf_path = os.path.join(temp_dir, f"{short_code}.pdf")
         
         # Create PDF
-        create_pdf_from_image(
-            result['image_base64'],
-            pdf_path,
-            short_code
-        )
+        image_bytes, = await load_scan_images([result])
+        await run_cpu(write_images_pdf, [image_bytes], pdf_path)
         
         return FileResponse(
             pdf_path,
@@ -1556,54 +1828,14 @@ async def export_pdf_single(
                 grouped_results[short_code] = []
             grouped_results[short_code].append(result)
         
-        # Create temp directory for PDFs
+        # Write one PDF per short_code (all pages of the group) straight into the ZIP
         temp_dir = tempfile.mkdtemp()
-        pdf_files = []
-        
-        # Process each group
-        for short_code, group in grouped_results.items():
-            if len(group) == 1:
-                # Single document - create one PDF
-                output_path = os.path.join(temp_dir, f"{short_code}.pdf")
-                create_pdf_from_image(
-                    group[0]['image_base64'],
-                    output_path,
-                    short_code
-                )
-                pdf_files.append(output_path)
-            else:
-                # Multiple documents with same code - merge into one PDF
-                temp_pdfs = []
-                for idx, result in enumerate(group):
-                    temp_path = os.path.join(temp_dir, f"temp_{short_code}_{idx}.pdf")
-                    create_pdf_from_image(
-                        result['image_base64'],
-                        temp_path,
-                        f"{short_code}_{idx}"
-                    )
-                    temp_pdfs.append(temp_path)
-                
-                # Merge PDFs with same short_code
-                merger = PdfMerger()
-                for temp_pdf in temp_pdfs:
-                    merger.append(temp_pdf)
-                
-                merged_path = os.path.join(temp_dir, f"{short_code}.pdf")
-                merger.write(merged_path)
-                merger.close()
-                
-                # Clean up temp files
-                for temp_pdf in temp_pdfs:
-                    os.remove(temp_pdf)
-                
-                pdf_files.append(merged_path)
-        
-        # Create a zip file with all PDFs
         zip_path = os.path.join(temp_dir, "documents_single.zip")
-        import zipfile
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for pdf_file in pdf_files:
-                zipf.write(pdf_file, os.path.basename(pdf_file))
+        entries = [
+            (f"{short_code}.pdf", await load_scan_images(group))
+            for short_code, group in grouped_results.items()
+        ]
+        await run_cpu(build_pdf_zip, entries, zip_path)
         
         return FileResponse(
             zip_path,
@@ -1634,29 +1866,10 @@ async def export_pdf_merged(
         if not results:
             raise HTTPException(status_code=404, detail="No scan results found")
         
-        # Create temp directory
+        # Single-pass merged PDF, one page per scan
         temp_dir = tempfile.mkdtemp()
-        pdf_files = []
-        
-        # Create individual PDFs first
-        for idx, result in enumerate(results):
-            output_path = os.path.join(temp_dir, f"temp_{idx}.pdf")
-            create_pdf_from_image(
-                result['image_base64'],
-                output_path,
-                f"page_{idx}"
-            )
-            pdf_files.append(output_path)
-        
-        # Merge PDFs
-        merger = PdfMerger()
-        for pdf_file in pdf_files:
-            merger.append(pdf_file)
-        
-        # Save merged PDF
         merged_path = os.path.join(temp_dir, "documents_merged.pdf")
-        merger.write(merged_path)
-        merger.close()
+        await run_cpu(write_images_pdf, await load_scan_images(results), merged_path)
         
         return FileResponse(
             merged_path,
@@ -1676,6 +1889,7 @@ async def clear_history(current_user: dict = Depends(require_approved_user)):
     """Clear all scan history"""
     try:
         result = await db.scan_results.delete_many({})
+        await page_images.delete_all()
         return {"message": f"Deleted {result.deleted_count} scan results"}
     except Exception as e:
         logger.error(f"Error clearing history: {e}")
@@ -1716,6 +1930,7 @@ async def create_rule(request: CreateRuleRequest):
         
         # Insert to database
         await db.document_rules.insert_one(new_rule.model_dump())
+        invalidate_rules_cache()
         
         logger.info(f"Created new rule: {request.full_name} -> {request.short_code}")
         return new_rule
@@ -1748,6 +1963,7 @@ async def update_rule(rule_id: str, request: UpdateRuleRequest):
             {"id": rule_id},
             {"$set": update_data}
         )
+        invalidate_rules_cache()
         
         # Get updated rule
         updated_rule = await db.document_rules.find_one({"id": rule_id})
@@ -1772,6 +1988,7 @@ async def delete_rule(rule_id: str):
         
         # Delete from database
         result = await db.document_rules.delete_one({"id": rule_id})
+        invalidate_rules_cache()
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Không thể xóa quy tắc")
@@ -1846,6 +2063,7 @@ async def cleanup_duplicate_rules():
         if ids_to_delete:
             # Delete duplicates in batch
             delete_result = await db.document_rules.delete_many({"id": {"$in": ids_to_delete}})
+            invalidate_rules_cache()
             deleted_count = delete_result.deleted_count
         else:
             deleted_count = 0
@@ -1879,7 +2097,7 @@ async def llm_health():
     client = get_openai_client()
     if client:
         try:
-            resp = client.chat.completions.create(
+            resp = await client.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=[{"role": "user", "content": "ping"}],
                 max_tokens=5,
@@ -1969,6 +2187,22 @@ async def get_usage_stats(current_user: dict = Depends(require_admin)):
     }
 
 
+@api_router.get("/system/cpu-pool")
+async def get_cpu_pool_stats(current_user: dict = Depends(require_admin)):
+    """
+    Queue depth and utilization of the CPU worker pool (Admin only)
+    """
+    return cpu_pool_stats()
+
+
+@api_router.get("/system/llm-limiter")
+async def get_llm_limiter_stats(current_user: dict = Depends(require_admin)):
+    """
+    Learned request rate, queue length and 429 counts per LLM provider+model (Admin only)
+    """
+    return llm_limiter_stats()
+
+
 @api_router.post("/settings/hybrid-mode")
 async def toggle_hybrid_mode(enabled: bool, current_user: dict = Depends(require_admin)):
     """
@@ -2017,11 +2251,12 @@ async def setup_admin_endpoint():
     
     # Delete ALL existing users with username "admin" (including pending ones)
     delete_result = await users_collection.delete_many({"username": "admin"})
+    invalidate_cached_user()
     
     # Create fresh admin account
     from auth_utils import PasswordHasher
     admin_password = "Thommit@19"
-    hashed = PasswordHasher.hash_password(admin_password)
+    hashed = await PasswordHasher.hash_password_async(admin_password)
     
     admin_user = {
         "email": "admin@smartdocscan.com",
@@ -2062,44 +2297,292 @@ async def setup_admin_endpoint():
 SUPPORTED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.heic', '.heif'}
 MAX_FILES_PER_ZIP = 500
 MAX_ZIP_SIZE_MB = 500
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Stream uploads to disk 1MB at a time
+
+# ==================== DURABLE FOLDER JOBS (MongoDB) ====================
+# Job state lives in db.folder_jobs and every processed file is checkpointed in
+# db.folder_job_files, so status polls work from any uvicorn worker and a job
+# interrupted by a restart is picked up again (lease expired) and resumes from
+# the last processed file.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+JOBS_DIR = ROOT_DIR / 'job_data'
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '120'))
+JOB_RESUME_INTERVAL_SECONDS = int(os.environ.get('JOB_RESUME_INTERVAL_SECONDS', '30'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+# Job directories without a job document are left alone this long (upload still streaming)
+JOB_ORPHAN_DIR_SECONDS = 86400
+JOB_DIR_SWEEP_INTERVAL_SECONDS = 3600
+_running_folder_jobs = {}
+
+# Folder scheduling: several folders of a job run at once, while the pages of
+# all folders (of all jobs in this process) share one concurrency budget.
+# Each job used to get 2 pages of its own; the default budget matches that for as many
+# concurrent jobs as folders per job. Jobs beyond that share it (slower each, same LLM load).
+# /batch-scan reads the same variable per request, with its own default of 2.
+MAX_CONCURRENT_FOLDERS = int(os.environ.get('MAX_CONCURRENT_FOLDERS', '4'))
+MAX_CONCURRENT_SCANS = int(os.environ.get('MAX_CONCURRENT_SCANS', str(2 * MAX_CONCURRENT_FOLDERS)))
+_scan_slots = None
+
+
+async def ensure_folder_job_indexes():
+    await db.folder_jobs.create_index("job_id", unique=True)
+    await db.folder_jobs.create_index([("status", 1), ("lease_expires", 1)])
+    await db.folder_jobs.create_index("updated_at", expireAfterSeconds=JOB_RETENTION_DAYS * 86400)
+    await db.folder_job_files.create_index([("job_id", 1), ("relative_path", 1)], unique=True)
+    await db.folder_job_files.create_index("created_at", expireAfterSeconds=JOB_RETENTION_DAYS * 86400)
+
+
+async def create_folder_job(job_id: str, kind: str, folder_groups: dict, work_dir: str, current_user: dict, options: Optional[dict] = None):
+    """Persist a new job (status queued) - folder order and file lists are kept for resume"""
+    now = datetime.now(timezone.utc)
+    await db.folder_jobs.insert_one({
+        "job_id": job_id,
+        "kind": kind,  # "folder_scan" | "folder_direct"
+        "status": "queued",
+        "total_folders": len(folder_groups),
+        "completed_folders": 0,
+        "current_folder": None,
+        "folder_results": [],
+        "error_message": None,
+        "all_zip_url": None,
+        "started_at": now,
+        "updated_at": now,
+        "work_dir": work_dir,
+        "folders": [{"folder_name": name, "files": [list(f) for f in files]} for name, files in folder_groups.items()],
+        "options": options or {},
+        "user": {"_id": owner_id(current_user)} if current_user else None,
+        "lease_owner": None,
+        "lease_expires": None,
+        "attempts": 0,
+    })
+
+
+async def get_folder_job(job_id: str) -> Optional[dict]:
+    return await db.folder_jobs.find_one({"job_id": job_id}, {"_id": 0})
+
+
+async def update_folder_job(job_id: str, **fields):
+    fields["updated_at"] = datetime.now(timezone.utc)
+    await db.folder_jobs.update_one({"job_id": job_id}, {"$set": fields})
+    if "status" in fields:
+        publish_job_event(job_id, "status", {k: v for k, v in fields.items() if k != "updated_at"})
+
+
+async def append_folder_job_result(job_id: str, folder_result: dict):
+    """Record a finished folder (idempotent per folder_name, so a resumed job never double counts)"""
+    await db.folder_jobs.update_one(
+        {"job_id": job_id, "folder_results.folder_name": {"$ne": folder_result["folder_name"]}},
+        {
+            "$push": {"folder_results": folder_result},
+            "$inc": {"completed_folders": 1},
+            "$set": {"current_folder": None, "updated_at": datetime.now(timezone.utc)}
+        }
+    )
+    publish_job_event(job_id, "folder_completed", folder_result)
+
+
+async def checkpoint_file_result(job_id: str, folder_name: str, file_result: FolderScanFileResult):
+    await db.folder_job_files.update_one(
+        {"job_id": job_id, "relative_path": file_result.relative_path},
+        {"$set": {"folder_name": folder_name, "result": file_result.model_dump(), "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    publish_job_event(job_id, "file_classified", {
+        "folder_name": folder_name,
+        "relative_path": file_result.relative_path,
+        "short_code": file_result.short_code,
+        "confidence_score": file_result.confidence_score,
+        "status": file_result.status,
+    })
+
+
+async def load_file_checkpoints(job_id: str, folder_name: str) -> dict:
+    """
+    Return {relative_path: FolderScanFileResult} for files already processed successfully in this folder
+    Failed files are left out so a resumed job retries them.
+    """
+    docs = await db.folder_job_files.find(
+        {"job_id": job_id, "folder_name": folder_name, "result.status": "success"},
+        {"_id": 0, "result": 1}
+    ).to_list(length=None)
+    return {d["result"]["relative_path"]: FolderScanFileResult(**d["result"]) for d in docs}
+
+
+async def claim_folder_job(job_id: Optional[str] = None) -> Optional[str]:
+    """Take the lease on a queued job or one whose owner stopped heartbeating"""
+    now = datetime.now(timezone.utc)
+    query = {
+        "status": {"$in": ["queued", "processing"]},
+        "attempts": {"$lt": JOB_MAX_ATTEMPTS},
+        "$or": [{"lease_owner": None}, {"lease_expires": {"$lt": now}}],
+    }
+    if job_id:
+        query["job_id"] = job_id
+    doc = await db.folder_jobs.find_one_and_update(
+        query,
+        {
+            "$set": {"status": "processing", "lease_owner": WORKER_ID, "lease_expires": now + timedelta(seconds=JOB_LEASE_SECONDS)},
+            "$inc": {"attempts": 1}
+        },
+        projection={"job_id": 1}
+    )
+    return doc["job_id"] if doc else None
+
 
-# Store active job statuses (in-memory, could use Redis for production)
-active_jobs = {}
+async def _folder_job_heartbeat(job_id: str):
+    """Renew the lease; stop the local runner as soon as another worker owns the job"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            result = await db.folder_jobs.update_one(
+                {"job_id": job_id, "lease_owner": WORKER_ID},
+                {"$set": {"lease_expires": datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            # Keep beating: a transient Mongo error must not let the lease lapse
+            logger.warning(f"Lease renewal failed for folder job {job_id}: {e}")
+            continue
+        if result.matched_count == 0:
+            logger.warning(f"Lost the lease on folder job {job_id}, stopping it on {WORKER_ID}")
+            runner = _running_folder_jobs.get(job_id)
+            if runner is not None:
+                runner.cancel()
+            return
 
 
-def extract_zip_and_find_images(zip_file_path: str, extract_to: str) -> dict:
+def get_scan_slots() -> asyncio.Semaphore:
+    """Global budget of in-flight pages shared by every folder job (room to fill vision batches)"""
+    global _scan_slots
+    if _scan_slots is None:
+        _scan_slots = asyncio.Semaphore(MAX_CONCURRENT_SCANS * VISION_PAGES_PER_SLOT)
+    return _scan_slots
+
+
+async def run_folders(job_id: str, folder_groups: dict, done_folders: set, run_folder):
     """
-    Extract ZIP and find all image files recursively
-    Returns: Dict of {folder_name: [(relative_path, absolute_path)]}
-    Groups files by their direct parent folder (or second-level if first is wrapper)
+    Run the job's pending folders concurrently (up to MAX_CONCURRENT_FOLDERS)
+    Folders start in upload order; each one publishes its results as soon as it finishes.
     """
+    folder_slots = asyncio.Semaphore(MAX_CONCURRENT_FOLDERS)
+    active = []
+
+    async def run_one(folder_name: str, image_files: list):
+        async with folder_slots:
+            active.append(folder_name)
+            await update_folder_job(job_id, current_folder=", ".join(active))
+            publish_job_event(job_id, "folder_started", {"folder_name": folder_name, "current_folder": ", ".join(active)})
+            try:
+                await run_folder(folder_name, image_files)
+            finally:
+                active.remove(folder_name)
+
+    results = await asyncio.gather(
+        *[run_one(name, files) for name, files in folder_groups.items() if name not in done_folders],
+        return_exceptions=True
+    )
+    # Let every folder finish (and checkpoint) before failing the job
+    for r in results:
+        if isinstance(r, Exception):
+            raise r
+
+
+async def run_folder_job(job_id: str):
+    """Run (or resume) a claimed job in this process"""
+    if job_id in _running_folder_jobs:
+        return
+    _running_folder_jobs[job_id] = asyncio.current_task()
+    heartbeat = asyncio.create_task(_folder_job_heartbeat(job_id))
     try:
-        # Extract ZIP
-        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        
-        # Find all images recursively and group by parent folder
-        folder_groups = {}
-        
-        for root, dirs, files in os.walk(extract_to):
-            for file in files:
-                file_path = Path(root) / file
-                if file_path.suffix.lower() in SUPPORTED_IMAGE_EXTENSIONS:
-                    # Calculate relative path from extract_to
-                    relative_path = file_path.relative_to(extract_to)
-                    
-                    # Get folder name - use the DIRECT parent folder of the image
-                    parts = relative_path.parts
-                    if len(parts) > 1:
-                        # Use the direct parent folder (last folder before file)
-                        folder_name = parts[-2] if len(parts) > 1 else parts[0]
-                    else:
-                        folder_name = "root"  # Files in root
-                    
-                    if folder_name not in folder_groups:
-                        folder_groups[folder_name] = []
-                    
-                    folder_groups[folder_name].append((str(relative_path), str(file_path)))
+        job = await get_folder_job(job_id)
+        folder_groups = {f["folder_name"]: [tuple(x) for x in f["files"]] for f in job["folders"]}
+        if job["kind"] == "folder_scan":
+            await _process_folder_scan(job_id, folder_groups, job["work_dir"], job["user"])
+        else:
+            await _process_folder_direct(job_id, folder_groups, job["work_dir"], job["options"].get("pack_as_zip", False), job["user"])
+    except Exception as e:
+        logger.error(f"Folder job {job_id} failed: {e}", exc_info=True)
+        await update_folder_job(job_id, status="error", error_message=str(e), current_folder=None)
+        remove_job_dir(job_id)
+    finally:
+        heartbeat.cancel()
+        _running_folder_jobs.pop(job_id, None)
+        await db.folder_jobs.update_one({"job_id": job_id, "lease_owner": WORKER_ID}, {"$set": {"lease_owner": None}})
+
+
+async def start_folder_job(job_id: str):
+    if await claim_folder_job(job_id):
+        asyncio.create_task(run_folder_job(job_id))
+
+
+def remove_job_dir(job_id: str):
+    """Delete a job's uploaded sources (work_dir lives under JOBS_DIR/<job_id>); only once the job is terminal"""
+    shutil.rmtree(JOBS_DIR / job_id, ignore_errors=True)
+
+
+async def sweep_job_dirs():
+    """Remove job directories left behind: terminal jobs, and jobs whose document expired (retention TTL)"""
+    if not JOBS_DIR.is_dir():
+        return
+    job_ids = [d.name for d in JOBS_DIR.iterdir() if d.is_dir()]
+    if not job_ids:
+        return
+    known = {
+        job["job_id"]: job["status"]
+        async for job in db.folder_jobs.find({"job_id": {"$in": job_ids}}, {"_id": 0, "job_id": 1, "status": 1})
+    }
+    now = time.time()
+    for job_id in job_ids:
+        if job_id in known:
+            if known[job_id] in TERMINAL_JOB_STATUSES:
+                remove_job_dir(job_id)
+        else:
+            try:
+                age = now - (JOBS_DIR / job_id).stat().st_mtime
+            except OSError:
+                continue
+            if age > JOB_ORPHAN_DIR_SECONDS:
+                logger.info(f"Removing orphaned job directory {job_id}")
+                remove_job_dir(job_id)
+
+
+async def resume_folder_jobs_loop():
+    """Background loop: pick up jobs left behind by a crashed/restarted worker"""
+    last_sweep = 0.0
+    while True:
+        try:
+            # Jobs that keep dying are failed instead of retried forever
+            exhausted = {"status": "processing", "attempts": {"$gte": JOB_MAX_ATTEMPTS}, "lease_expires": {"$lt": datetime.now(timezone.utc)}}
+            failed = [job["job_id"] async for job in db.folder_jobs.find(exhausted, {"_id": 0, "job_id": 1})]
+            if failed:
+                await db.folder_jobs.update_many(
+                    {**exhausted, "job_id": {"$in": failed}},
+                    {"$set": {"status": "error", "error_message": "Job bị gián đoạn quá nhiều lần", "updated_at": datetime.now(timezone.utc)}}
+                )
+                for job_id in failed:
+                    remove_job_dir(job_id)
+            if time.monotonic() - last_sweep > JOB_DIR_SWEEP_INTERVAL_SECONDS:
+                last_sweep = time.monotonic()
+                await sweep_job_dirs()
+            while True:
+                job_id = await claim_folder_job()
+                if not job_id:
+                    break
+                logger.info(f"Resuming interrupted folder job {job_id} on {WORKER_ID}")
+                asyncio.create_task(run_folder_job(job_id))
+        except Exception as e:
+            logger.warning(f"Folder job resume check failed: {e}")
+        await asyncio.sleep(JOB_RESUME_INTERVAL_SECONDS)
+
+
+async def find_images_in_zip(zip_file_path: str) -> dict:
+    """
+    Find all image files in the ZIP without extracting it (members are read on demand)
+    Returns: Dict of {folder_name: [(relative_path, member_name)]}
+    Groups files by their direct parent folder
+    """
+    try:
+        folder_groups = await run_cpu(list_zip_images, zip_file_path, SUPPORTED_IMAGE_EXTENSIONS)
         
         total_images = sum(len(files) for files in folder_groups.values())
         logger.info(f"Found {total_images} images in {len(folder_groups)} folders")
@@ -2113,12 +2596,12 @@ def extract_zip_and_find_images(zip_file_path: str, extract_to: str) -> dict:
     except zipfile.BadZipFile:
         raise HTTPException(status_code=400, detail="File không phải là ZIP hợp lệ")
     except Exception as e:
-        logger.error(f"Error extracting ZIP: {e}")
-        raise HTTPException(status_code=500, detail=f"Lỗi giải nén ZIP: {str(e)}")
+        logger.error(f"Error reading ZIP: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi đọc ZIP: {str(e)}")
 
 
 
-def create_result_zip_grouped(file_results: List[FolderScanFileResult], source_dir: str, output_zip_path: str):
+async def create_result_zip_grouped(file_results: List[FolderScanFileResult], source: str, output_zip_path: str):
     """
     Create result ZIP with PDFs grouped by short_code per folder.
     Behavior matches 'Quét Tài Liệu': all pages with same short_code are merged into one PDF.
@@ -2132,45 +2615,10 @@ def create_result_zip_grouped(file_results: List[FolderScanFileResult], source_d
             code = fr.short_code or "UNKNOWN"
             groups.setdefault(code, []).append(fr)
 
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_STORED) as zip_out:
-            for short_code, items in groups.items():
-                # Create temp PDFs for each page then merge
-                temp_pdfs = []
-                try:
-                    for idx, fr in enumerate(items):
-                        # Read original image bytes
-                        original_image_path = Path(source_dir) / fr.relative_path
-                        with open(original_image_path, 'rb') as img_file:
-                            image_bytes = img_file.read()
-                        # Use unified PDF resize (no crop), same for single and folder scans
-                        image_base64 = resize_image_for_api(image_bytes, max_size=1400, crop_top_only=False)
-
-                        temp_pdf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                        create_pdf_from_image(image_base64, temp_pdf.name, short_code)
-                        temp_pdfs.append(temp_pdf.name)
-                        temp_pdf.close()
-
-                    # Merge PDFs for this short_code
-                    merger = PdfMerger()
-                    for p in temp_pdfs:
-                        merger.append(p)
-                    merged_pdf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                    merger.write(merged_pdf.name)
-                    merger.close()
-
-                    # Path inside ZIP: short_code.pdf at folder root (caller ensures folder context)
-                    zip_out.write(merged_pdf.name, f"{short_code}.pdf")
-                finally:
-                    # Cleanup temps
-                    for p in temp_pdfs:
-                        try:
-                            os.unlink(p)
-                        except Exception:
-                            pass
-                    try:
-                        os.unlink(merged_pdf.name)
-                    except Exception:
-                        pass
+        # Path inside ZIP: short_code.pdf at folder root (caller ensures folder context)
+        # All pages with this short_code go into one PDF, built in the CPU pool
+        entries = [(f"{short_code}.pdf", [fr.relative_path for fr in items]) for short_code, items in groups.items()]
+        await run_cpu(build_result_zip, entries, source, output_zip_path)
         logger.info(f"Created GROUPED result ZIP with {len(groups)} PDFs (merged by short_code)")
     except Exception as e:
         logger.error(f"Error creating grouped result ZIP: {e}")
@@ -2178,10 +2626,7 @@ def create_result_zip_grouped(file_results: List[FolderScanFileResult], source_d
 
 
 async def update_folder_scan_status(job_id: str, folder_name: str, success_count: int, error_count: int, zip_filename: Optional[str] = None):
-    status = active_jobs.get(job_id)
-    if not status:
-        return
-    # Append or update result for this folder
+    # Append result for this folder
     fr = FolderBatchResult(
         folder_name=folder_name,
         files=[],
@@ -2189,13 +2634,10 @@ async def update_folder_scan_status(job_id: str, folder_name: str, success_count
         error_count=error_count,
         zip_download_url=(f"/api/download-folder-result/{zip_filename}" if zip_filename else None)
     )
-    status.folder_results.append(fr)
-    status.completed_folders += 1
-    status.current_folder = None
-    status.updated_at = datetime.now(timezone.utc)
+    await append_folder_job_result(job_id, fr.model_dump())
 
 
-def create_result_zip(file_results: List[FolderScanFileResult], source_dir: str, output_zip_path: str):
+async def create_result_zip(file_results: List[FolderScanFileResult], source_dir: str, output_zip_path: str):
     """
     Create result ZIP with PDFs maintaining folder structure
     OPTIMIZED: Use ZIP_STORED (no compression) for faster creation and download
@@ -2203,58 +2645,37 @@ def create_result_zip(file_results: List[FolderScanFileResult], source_dir: str,
     try:
         # Track PDF names to avoid duplicates
         pdf_name_counter = {}
+        entries = []
         
-        # Use ZIP_STORED for faster zip creation (no compression)
-        # PDFs are already compressed, so this doesn't increase size much
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_STORED) as zip_out:
-            for file_result in file_results:
-                if file_result.status == "success":
-                    # Create unique PDF filename to avoid duplicates
-                    base_name = file_result.short_code
-                    
-                    # Get folder path from relative_path
-                    relative_dir = str(Path(file_result.relative_path).parent)
-                    if relative_dir == '.':
-                        relative_dir = ''
-                    
-                    # Generate unique filename in this directory
-                    dir_key = relative_dir
-                    if dir_key not in pdf_name_counter:
-                        pdf_name_counter[dir_key] = {}
-                    
-                    if base_name not in pdf_name_counter[dir_key]:
-                        pdf_name_counter[dir_key][base_name] = 1
-                        pdf_filename = f"{base_name}.pdf"
-                    else:
-                        count = pdf_name_counter[dir_key][base_name]
-                        pdf_filename = f"{base_name}_{count}.pdf"
-                        pdf_name_counter[dir_key][base_name] = count + 1
-                    
-                    # PDF path in ZIP (maintain folder structure)
-                    pdf_path_in_zip = str(Path(relative_dir) / pdf_filename) if relative_dir else pdf_filename
-                    
-                    # Create PDF in temp file
-                    temp_pdf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                    
-                    try:
-                        # We need to read the original image to create PDF
-                        original_image_path = Path(source_dir) / file_result.relative_path
-                        
-                        with open(original_image_path, 'rb') as img_file:
-                            image_bytes = img_file.read()
-                        # Unified PDF resize for ZIP flow
-                        image_base64 = resize_image_for_api(image_bytes, max_size=1400, crop_top_only=False)
-                        
-                        create_pdf_from_image(image_base64, temp_pdf.name, file_result.short_code)
-                        
-                        # Add PDF to result ZIP
-                        zip_out.write(temp_pdf.name, pdf_path_in_zip)
-                        
-                    finally:
-                        # Clean up temp PDF
-                        temp_pdf.close()
-                        if os.path.exists(temp_pdf.name):
-                            os.unlink(temp_pdf.name)
+        for file_result in file_results:
+            if file_result.status == "success":
+                # Create unique PDF filename to avoid duplicates
+                base_name = file_result.short_code
+                
+                # Get folder path from relative_path
+                relative_dir = str(Path(file_result.relative_path).parent)
+                if relative_dir == '.':
+                    relative_dir = ''
+                
+                # Generate unique filename in this directory
+                dir_key = relative_dir
+                if dir_key not in pdf_name_counter:
+                    pdf_name_counter[dir_key] = {}
+                
+                if base_name not in pdf_name_counter[dir_key]:
+                    pdf_name_counter[dir_key][base_name] = 1
+                    pdf_filename = f"{base_name}.pdf"
+                else:
+                    count = pdf_name_counter[dir_key][base_name]
+                    pdf_filename = f"{base_name}_{count}.pdf"
+                    pdf_name_counter[dir_key][base_name] = count + 1
+                
+                # PDF path in ZIP (maintain folder structure), one page per PDF
+                pdf_path_in_zip = str(Path(relative_dir) / pdf_filename) if relative_dir else pdf_filename
+                entries.append((pdf_path_in_zip, [file_result.relative_path]))
+        
+        # ZIP_STORED (no compression) is used for faster creation; PDFs are built in the CPU pool
+        await run_cpu(build_result_zip, entries, source_dir, output_zip_path)
         
         logger.info(f"Created result ZIP with {len([f for f in file_results if f.status == 'success'])} PDFs (no compression for faster download)")
         
@@ -2273,37 +2694,37 @@ async def scan_folder(
     - Client polls /api/folder-scan-status/{job_id} for progress
     - Each folder available for download as soon as it completes
     """
+    temp_dir = None
     try:
         # Validate file is ZIP
         if not file.filename.endswith('.zip'):
             raise HTTPException(status_code=400, detail="Chỉ chấp nhận file ZIP")
         
-        # Create temp directory for processing
-        temp_dir = tempfile.mkdtemp(prefix='folder_scan_')
+        # Job working directory (kept on disk until the job completes so it can resume)
+        job_id = str(uuid.uuid4())
+        temp_dir = str(JOBS_DIR / job_id)
         upload_dir = os.path.join(temp_dir, 'upload')
-        extract_dir = os.path.join(temp_dir, 'extracted')
         os.makedirs(upload_dir, exist_ok=True)
-        os.makedirs(extract_dir, exist_ok=True)
-        
-        # Save uploaded ZIP
-        zip_path = os.path.join(upload_dir, file.filename)
-        content = await file.read()
-        
-        # Check file size
-        file_size_mb = len(content) / (1024 * 1024)
-        if file_size_mb > MAX_ZIP_SIZE_MB:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File quá lớn ({file_size_mb:.1f}MB). Giới hạn: {MAX_ZIP_SIZE_MB}MB"
-            )
         
+        # Stream uploaded ZIP to disk in chunks (never holds the whole archive in memory)
+        zip_path = os.path.join(upload_dir, 'upload.zip')
+        size = 0
         with open(zip_path, 'wb') as f:
-            f.write(content)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                # Check file size
+                if size > MAX_ZIP_SIZE_MB * 1024 * 1024:
+                    raise HTTPException(
+                        status_code=400, 
+                        detail=f"File quá lớn (>{MAX_ZIP_SIZE_MB}MB). Giới hạn: {MAX_ZIP_SIZE_MB}MB"
+                    )
+                f.write(chunk)
 
+        file_size_mb = size / (1024 * 1024)
         logger.info(f"Processing ZIP file: {file.filename} ({file_size_mb:.1f}MB)")
         
-        # Extract ZIP and group by folders
-        folder_groups = extract_zip_and_find_images(zip_path, extract_dir)
+        # Index ZIP members and group by folders (images are read lazily from the ZIP)
+        folder_groups = await find_images_in_zip(zip_path)
         
         if len(folder_groups) == 0:
             raise HTTPException(status_code=400, detail="Không tìm thấy thư mục nào chứa ảnh")
@@ -2315,121 +2736,95 @@ async def scan_folder(
                 detail=f"Quá nhiều files ({total_files}). Giới hạn: {MAX_FILES_PER_ZIP} files"
             )
         
-        # Create job
-        job_id = str(uuid.uuid4())
-        job_status = FolderScanJobStatus(
-            job_id=job_id,
-            status="processing",
-            total_folders=len(folder_groups),
-            completed_folders=0,
-            current_folder=None,
-            folder_results=[],
-            started_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
-        )
-        
-        active_jobs[job_id] = job_status
-        
-        
-        async def process_folder_scan_job(job_id_local: str, folder_groups_local: dict, extract_dir_local: str, temp_dir_local: str, current_user_local: dict):
-            try:
-                MAX_CONCURRENT = int(os.getenv("MAX_CONCURRENT_SCANS", "2"))
-                MAX_SIZE = 700 if len(folder_groups_local) > 50 else 800
-                semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-                for folder_name, image_files in folder_groups_local.items():
-                    # Sort
-                    image_files.sort(key=lambda t: t[0])
-                    grouped_short_code = None
-                    grouped_files: List[FolderScanFileResult] = []
-
-                    async def process_and_group(relative_path: str, absolute_path: str, max_size: int, current_user_dict: dict, retry_count=0):
-                        nonlocal grouped_short_code, grouped_files
-                        async with semaphore:
-                            try:
-                                with open(absolute_path, 'rb') as img_file:
-                                    image_bytes = img_file.read()
-                                img_original = Image.open(BytesIO(image_bytes))
-                                img_width, img_height = img_original.size
-                                aspect_ratio = img_width / img_height
-                                crop_percent = 0.65 if aspect_ratio > 1.35 else 0.50
-                                cropped_image_base64 = resize_image_for_api(
-                                    image_bytes, max_size=max_size, crop_top_only=True, crop_percentage=crop_percent
-                                )
-                                analysis_result = await analyze_document_with_vision(cropped_image_base64)
-                                short_code = analysis_result["short_code"]
-                                detected_name = analysis_result["detected_full_name"]
-                                confidence = analysis_result["confidence"]
-                                is_continuation = (
-                                    short_code == "UNKNOWN" or confidence < 0.3 or (isinstance(detected_name, str) and ("không rõ" in detected_name.lower() or "unknown" in detected_name.lower()))
-                                )
-                                if is_continuation and grouped_short_code:
-                                    short_code = grouped_short_code
-                                else:
-                                    grouped_short_code = short_code
-                                fr = FolderScanFileResult(
-                                    relative_path=relative_path,
-                                    original_filename=Path(relative_path).name,
-                                    detected_full_name=detected_name,
-                                    short_code=short_code,
-                                    confidence_score=confidence,
-                                    status="success",
-                                    user_id=current_user_dict.get("id") if current_user_dict else None
-                                )
-                                grouped_files.append(fr)
-                                return fr
-                            except Exception as e:
-                                if ("rate limit" in str(e).lower() or "429" in str(e)) and retry_count < 1:
-                                    await asyncio.sleep(20)
-                                    return await process_and_group(relative_path, absolute_path, max_size, current_user_dict, retry_count + 1)
-                                fr = FolderScanFileResult(
-                                    relative_path=relative_path,
-                                    original_filename=Path(relative_path).name,
-                                    detected_full_name="Lỗi",
-                                    short_code="ERROR",
-                                    confidence_score=0.0,
-                                    status="error",
-                                    error_message=str(e)[:200],
-                                    user_id=current_user_dict.get("id") if current_user_dict else None
-                                )
-                                grouped_files.append(fr)
-                                return fr
-
-                    tasks = [process_and_group(rel_path, abs_path, MAX_SIZE, current_user_local) for rel_path, abs_path in image_files]
-                    await asyncio.gather(*tasks)
-
-                    # Create grouped ZIP for this folder
-                    result_zip_filename = f"{folder_name}.zip"
-                    result_zip_path = os.path.join(temp_dir_local, result_zip_filename)
-                    create_result_zip_grouped(grouped_files, extract_dir_local, result_zip_path)
-
-                    # Save to temp_results to serve download
-                    os.makedirs(os.path.join(ROOT_DIR, 'temp_results'), exist_ok=True)
-                    final_zip_path = os.path.join(ROOT_DIR, 'temp_results', f"{job_id_local}_{folder_name}.zip")
-                    shutil.copy(result_zip_path, final_zip_path)
-
-                    # Update job status
-                    await update_folder_scan_status(job_id_local, folder_name, success_count=len([r for r in grouped_files if r.status=='success']), error_count=len([r for r in grouped_files if r.status=='error']), zip_filename=os.path.basename(final_zip_path))
-
-            except Exception as e:
-                logger.error(f"Error in process_folder_scan_job: {e}", exc_info=True)
-                raise
-
-        # Start background task with the inner function
-        asyncio.create_task(process_folder_scan_job(job_id, folder_groups, extract_dir, temp_dir, current_user))
+        # Create durable job and start it on this worker
+        await create_folder_job(job_id, "folder_scan", folder_groups, zip_path, current_user)
+        await start_folder_job(job_id)
 
         return FolderScanStartResponse(
             job_id=job_id,
             message="Đã bắt đầu quét. Sử dụng status_url để theo dõi tiến trình.",
             total_folders=len(folder_groups),
             total_files=total_files,
-            status_url=f"/api/folder-scan-status/{job_id}"
+            status_url=f"/api/folder-scan-status/{job_id}",
+            events_url=f"/api/folder-job-events/{job_id}"
         )
         
+    except HTTPException:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
     except Exception as e:
         logger.error(f"Error in scan_folder: {e}")
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _process_folder_scan(job_id: str, folder_groups: dict, zip_path: str, current_user: Optional[dict]):
+    """Folder scan worker - reads pages straight from the uploaded ZIP, skips finished folders and checkpointed files when resuming"""
+    job = await get_folder_job(job_id)
+    done_folders = {fr["folder_name"] for fr in job.get("folder_results", [])}
+    MAX_SIZE = 700 if len(folder_groups) > 50 else 800
+    semaphore = get_scan_slots()
+
+    async def run_folder(folder_name: str, image_files: list):
+        # Sort
+        image_files.sort(key=lambda t: t[0])
+        results_by_path = await load_file_checkpoints(job_id, folder_name)
+        if results_by_path:
+            logger.info(f"Resuming folder '{folder_name}': {len(results_by_path)}/{len(image_files)} files already processed")
+
+        # Phase 1: classify every page in parallel (raw results are checkpointed)
+        async def classify_file(relative_path: str, member_name: str, max_size: int, current_user_dict: dict):
+            async with semaphore:
+                try:
+                    # ZIP member is read and preprocessed inside the CPU pool
+                    pre = await run_cpu(preprocess_source_image, zip_path, member_name, max_size, None)
+                    analysis_result = await classify_page(pre["cropped_image_base64"])
+                    fr = FolderScanFileResult(
+                        relative_path=relative_path,
+                        original_filename=Path(relative_path).name,
+                        detected_full_name=analysis_result["detected_full_name"],
+                        short_code=analysis_result["short_code"],
+                        confidence_score=analysis_result["confidence"],
+                        status="success",
+                        user_id=owner_id(current_user_dict)
+                    )
+                except Exception as e:
+                    fr = FolderScanFileResult(
+                        relative_path=relative_path,
+                        original_filename=Path(relative_path).name,
+                        detected_full_name="Lỗi",
+                        short_code="ERROR",
+                        confidence_score=0.0,
+                        status="error",
+                        error_message=str(e)[:200],
+                        user_id=owner_id(current_user_dict)
+                    )
+                results_by_path[relative_path] = fr
+                await checkpoint_file_result(job_id, folder_name, fr)
+                return fr
+
+        tasks = [classify_file(rel_path, member_name, MAX_SIZE, current_user) for rel_path, member_name in image_files if rel_path not in results_by_path]
+        await asyncio.gather(*tasks)
+
+        # Phase 2: ordered grouping pass over the folder's pages
+        grouped_files = group_folder_results([results_by_path[rel_path] for rel_path, _ in image_files if rel_path in results_by_path])
+
+        # Create grouped ZIP for this folder directly in temp_results (served for download)
+        os.makedirs(os.path.join(ROOT_DIR, 'temp_results'), exist_ok=True)
+        final_zip_path = os.path.join(ROOT_DIR, 'temp_results', f"{job_id}_{folder_name}.zip")
+        await create_result_zip_grouped(grouped_files, zip_path, final_zip_path)
+
+        # Update job status
+        await update_folder_scan_status(job_id, folder_name, success_count=len([r for r in grouped_files if r.status=='success']), error_count=len([r for r in grouped_files if r.status=='error']), zip_filename=os.path.basename(final_zip_path))
+
+    await run_folders(job_id, folder_groups, done_folders, run_folder)
+    await update_folder_job(job_id, status="completed", current_folder=None)
+    # Source images are no longer needed once every folder ZIP exists
+    remove_job_dir(job_id)
+
+
 # ==================== FOLDER SCAN (DIRECT) - NO ZIP UPLOAD ====================
 
 class FolderDirectFolderResult(BaseModel):
@@ -2453,7 +2848,6 @@ class FolderDirectJobStatus(BaseModel):
     updated_at: datetime
     all_zip_url: Optional[str] = None
 
-direct_jobs = {}
 
 @api_router.post("/scan-folder-direct")
 async def scan_folder_direct(
@@ -2478,7 +2872,9 @@ async def scan_folder_direct(
         if rel_paths and len(rel_paths) != len(files):
             raise HTTPException(status_code=400, detail="relative_paths không khớp số lượng files")
 
-        temp_dir = tempfile.mkdtemp(prefix='folder_direct_')
+        job_id = str(uuid.uuid4())
+        temp_dir = str(JOBS_DIR / job_id)
+        os.makedirs(temp_dir, exist_ok=True)
         folder_groups = {}
 
         for idx, uf in enumerate(files):
@@ -2506,24 +2902,11 @@ async def scan_folder_direct(
 
             folder_groups.setdefault(folder_name, []).append((rp_norm, abs_path))
 
-        # Create job
-        job_id = str(uuid.uuid4())
-        job_status = FolderDirectJobStatus(
-            job_id=job_id,
-            status="processing",
-            total_folders=len(folder_groups),
-            completed_folders=0,
-            current_folder=None,
-            folder_results=[],
-            started_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
-        )
-        direct_jobs[job_id] = job_status
-
-        # Start processing
-        asyncio.create_task(_process_folder_direct(job_id, folder_groups, temp_dir, pack_as_zip, current_user))
+        # Create durable job and start processing on this worker
+        await create_folder_job(job_id, "folder_direct", folder_groups, temp_dir, current_user, {"pack_as_zip": bool(pack_as_zip)})
+        await start_folder_job(job_id)
 
-        return {"job_id": job_id, "status_url": f"/api/folder-direct-status/{job_id}"}
+        return {"job_id": job_id, "status_url": f"/api/folder-direct-status/{job_id}", "events_url": f"/api/folder-job-events/{job_id}"}
     except HTTPException:
         raise
     except Exception as e:
@@ -2531,191 +2914,120 @@ async def scan_folder_direct(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def _process_folder_direct(job_id: str, folder_groups: dict, base_dir: str, pack_as_zip: bool, current_user: dict):
-    try:
-        job = direct_jobs[job_id]
-        MAX_CONCURRENT = int(os.getenv("MAX_CONCURRENT_SCANS", "2"))
-        semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+async def _process_folder_direct(job_id: str, folder_groups: dict, base_dir: str, pack_as_zip: bool, current_user: Optional[dict]):
+    """Direct folder worker - skips finished folders and already checkpointed files when resuming"""
+    job = await get_folder_job(job_id)
+    done_folders = {fr["folder_name"] for fr in job.get("folder_results", [])}
+    semaphore = get_scan_slots()
 
-        for folder_idx, (folder_name, image_files) in enumerate(folder_groups.items(), 1):
-            job.current_folder = folder_name
-            job.updated_at = datetime.now(timezone.utc)
+    async def run_folder(folder_name: str, image_files: list):
+        # Sort for stable order
+        image_files.sort(key=lambda t: t[0])
 
-            # Sort for stable order
-            image_files.sort(key=lambda t: t[0])
+        results_by_path = await load_file_checkpoints(job_id, folder_name)
+        if results_by_path:
+            logger.info(f"Resuming folder '{folder_name}': {len(results_by_path)}/{len(image_files)} files already processed")
 
-            grouped_short_code = None
-            grouped_results: List[FolderScanFileResult] = []
+        async def record(fr: FolderScanFileResult):
+            results_by_path[fr.relative_path] = fr
+            await checkpoint_file_result(job_id, folder_name, fr)
 
-            async def process_item(rel_path: str, abs_path: str, retry_count=0):
-                nonlocal grouped_short_code, grouped_results
-                async with semaphore:
+        # Phase 1: classify every page in parallel (raw results are checkpointed)
+        async def process_item(rel_path: str, abs_path: str):
+            async with semaphore:
+                try:
+                    with open(abs_path, 'rb') as img_file:
+                        image_bytes = img_file.read()
+                    
+                    # Decode once (off the event loop) - skip if not a valid image
                     try:
-                        with open(abs_path, 'rb') as img_file:
-                            image_bytes = img_file.read()
-                        
-                        # Try to open as image - skip if not a valid image
-                        try:
-                            img = Image.open(BytesIO(image_bytes))
-                            w, h = img.size
-                        except Exception as img_err:
-                            logger.warning(f"Cannot open as image: {rel_path} - {img_err}")
-                            grouped_results.append(FolderScanFileResult(
-                                relative_path=rel_path,
-                                original_filename=Path(rel_path).name,
-                                detected_full_name="Không phải file ảnh hợp lệ",
-                                short_code="INVALID",
-                                confidence_score=0.0,
-                                status="error",
-                                error_message=f"Cannot identify image file: {str(img_err)[:100]}",
-                                user_id=current_user.get("id") if current_user else None
-                            ))
-                            return
-                        
-                        crop = 0.65 if (w / h) > 1.35 else 0.50
-                        cropped_b64 = resize_image_for_api(image_bytes, max_size=800, crop_top_only=True, crop_percentage=crop)
-                        analysis = await analyze_document_hybrid(cropped_b64, use_hybrid=USE_HYBRID_OCR)
-                        code = analysis["short_code"]
-                        name = analysis["detected_full_name"]
-                        conf = analysis["confidence"]
-                        is_cont = (code == "UNKNOWN" or conf < 0.3 or (isinstance(name, str) and ("không rõ" in name.lower() or "unknown" in name.lower())))
-                        if is_cont and grouped_short_code:
-                            code = grouped_short_code
-                        else:
-                            grouped_short_code = code
-                        grouped_results.append(FolderScanFileResult(
+                        pre = await preprocess_scan_image_async(image_bytes, crop_max_size=800, full_max_size=None)
+                    except Exception as img_err:
+                        logger.warning(f"Cannot open as image: {rel_path} - {img_err}")
+                        await record(FolderScanFileResult(
                             relative_path=rel_path,
                             original_filename=Path(rel_path).name,
-                            detected_full_name=name,
-                            short_code=code,
-                            confidence_score=conf,
-                            status="success",
-                            user_id=current_user.get("id") if current_user else None
-                        ))
-                    except Exception as e:
-                        if ("rate limit" in str(e).lower() or "429" in str(e)) and retry_count < 1:
-                            await asyncio.sleep(20)  # backoff 20s as requested
-                            return await process_item(rel_path, abs_path, retry_count + 1)
-                        grouped_results.append(FolderScanFileResult(
-                            relative_path=rel_path,
-                            original_filename=Path(rel_path).name,
-                            detected_full_name="Lỗi",
-                            short_code="ERROR",
+                            detected_full_name="Không phải file ảnh hợp lệ",
+                            short_code="INVALID",
                             confidence_score=0.0,
                             status="error",
-                            error_message=str(e)[:200],
-                            user_id=current_user.get("id") if current_user else None
+                            error_message=f"Cannot identify image file: {str(img_err)[:100]}",
+                            user_id=owner_id(current_user)
                         ))
-
-            await asyncio.gather(*[process_item(rp, ap) for rp, ap in image_files])
-
-            # After processing a folder: write PDFs merged by short_code into a temp folder
-            out_folder = os.path.join(base_dir, f"out_{folder_name}")
-            os.makedirs(out_folder, exist_ok=True)
-
-            # Build PDFs merged by short_code
-            merged_count = 0
-            from collections import defaultdict
-            by_code = defaultdict(list)
-            for fr in grouped_results:
-                if fr.status == "success":
-                    by_code[fr.short_code].append(fr)
-            for code, items in by_code.items():
-                # Create merged PDF for this short_code
-                temp_pdfs = []
-                merger = PdfMerger()
-                try:
-                    for fr in items:
-                        img_path = Path(base_dir) / fr.relative_path
-                        with open(img_path, 'rb') as f:
-                            bts = f.read()
-                        # Unified PDF resize for folder direct
-                        b64 = resize_image_for_api(bts, max_size=1400, crop_top_only=False)
-                        tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                        create_pdf_from_image(b64, tmp.name, code)
-                        temp_pdfs.append(tmp.name)
-                        merger.append(tmp.name)
+                        return
                     
-                    # Write the merged PDF
-                    out_pdf = os.path.join(out_folder, f"{code}.pdf")
-                    with open(out_pdf, 'wb') as f_out:
-                        merger.write(f_out)
-                    merged_count += 1
-                finally:
-                    try:
-                        merger.close()
-                    except Exception:
-                        pass
-                    for p in temp_pdfs:
-                        try:
-                            os.unlink(p)
-                        except Exception:
-                            pass
-
-            # Build URLs for each PDF (serve via a download endpoint)
-            pdf_files = [str(Path(out_folder) / f) for f in os.listdir(out_folder) if f.lower().endswith('.pdf')]
-            urls = []
-            for p in pdf_files:
-                # save into a permanent temp_results area
-                final_name = f"{job_id}_{folder_name}_{Path(p).name}"
-                dest = os.path.join(ROOT_DIR, 'temp_results', final_name)
-                os.makedirs(os.path.dirname(dest), exist_ok=True)
-                shutil.copy(p, dest)
-                urls.append(f"/api/download-folder-result/{os.path.basename(dest)}")
-            
-            # Pre-generate folder ZIP (optional) for faster downloads per folder
-            if pack_as_zip:
-                per_folder_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-                per_folder_zip.close()
-                try:
-                    with zipfile.ZipFile(per_folder_zip.name, 'w', zipfile.ZIP_STORED) as zf:
-                        for p in pdf_files:
-                            zf.write(p, Path(p).name)
-                    # Persist in temp_results
-                    final_name = f"{job_id}_{folder_name}_all.zip"
-                    dest_zip = os.path.join(ROOT_DIR, 'temp_results', final_name)
-                    shutil.copy(per_folder_zip.name, dest_zip)
-                    urls.append(f"/api/download-folder-result/{os.path.basename(dest_zip)}")
-                finally:
-                    try:
-                        os.unlink(per_folder_zip.name)
-                    except Exception:
-                        pass
-
-            # Capture errors per folder
-            errs = [f"{r.relative_path}: {r.error_message}" for r in grouped_results if r.status=='error' and r.error_message]
-
-            job.folder_results.append(FolderDirectFolderResult(
-                folder_name=folder_name,
-                files=[rp for rp, _ in image_files],
-                pdf_urls=urls,
-                success_count=len([r for r in grouped_results if r.status == 'success']),
-                error_count=len([r for r in grouped_results if r.status == 'error']),
-                errors=errs if errs else None
-            ))
-            job.completed_folders += 1
-            job.updated_at = datetime.now(timezone.utc)
-
-        # Build ALL ZIP if requested later via endpoint; here only mark completed
-        job.status = "completed"
-        job.current_folder = None
-        job.updated_at = datetime.now(timezone.utc)
-        job.all_zip_url = f"/api/download-all-direct/{job_id}"
-    except Exception as e:
-        logger.error(f"Error in direct folder processing: {e}", exc_info=True)
-        job = direct_jobs.get(job_id)
-        if job:
-            job.status = "error"
-            job.error_message = str(e)
-            job.updated_at = datetime.now(timezone.utc)
+                    analysis = await analyze_document_hybrid(pre["cropped_image_base64"], use_hybrid=USE_HYBRID_OCR)
+                    await record(FolderScanFileResult(
+                        relative_path=rel_path,
+                        original_filename=Path(rel_path).name,
+                        detected_full_name=analysis["detected_full_name"],
+                        short_code=analysis["short_code"],
+                        confidence_score=analysis["confidence"],
+                        status="success",
+                        user_id=owner_id(current_user)
+                    ))
+                except Exception as e:
+                    await record(FolderScanFileResult(
+                        relative_path=rel_path,
+                        original_filename=Path(rel_path).name,
+                        detected_full_name="Lỗi",
+                        short_code="ERROR",
+                        confidence_score=0.0,
+                        status="error",
+                        error_message=str(e)[:200],
+                        user_id=owner_id(current_user)
+                    ))
+
+        await asyncio.gather(*[process_item(rp, ap) for rp, ap in image_files if rp not in results_by_path])
+        # Phase 2: ordered grouping pass over the folder's pages
+        grouped_results = group_folder_results([results_by_path[rp] for rp, _ in image_files if rp in results_by_path])
+
+        # After processing a folder: write PDFs merged by short_code straight into temp_results
+        results_dir = os.path.join(ROOT_DIR, 'temp_results')
+        os.makedirs(results_dir, exist_ok=True)
+
+        from collections import defaultdict
+        by_code = defaultdict(list)
+        for fr in grouped_results:
+            if fr.status == "success":
+                by_code[fr.short_code].append(fr)
+
+        # Pre-generate folder ZIP for faster downloads per folder (filled alongside the PDFs)
+        zip_name = f"{job_id}_{folder_name}_all.zip" if pack_as_zip else None
+        written = await run_cpu(
+            write_folder_pdfs,
+            [(code, [fr.relative_path for fr in items]) for code, items in by_code.items()],
+            base_dir, results_dir, f"{job_id}_{folder_name}_", zip_name
+        )
+        urls = [f"/api/download-folder-result/{name}" for name in written]
+        if zip_name:
+            urls.append(f"/api/download-folder-result/{zip_name}")
+
+        # Capture errors per folder
+        errs = [f"{r.relative_path}: {r.error_message}" for r in grouped_results if r.status=='error' and r.error_message]
+
+        await append_folder_job_result(job_id, FolderDirectFolderResult(
+            folder_name=folder_name,
+            files=[rp for rp, _ in image_files],
+            pdf_urls=urls,
+            success_count=len([r for r in grouped_results if r.status == 'success']),
+            error_count=len([r for r in grouped_results if r.status == 'error']),
+            errors=errs if errs else None
+        ).model_dump())
+
+    await run_folders(job_id, folder_groups, done_folders, run_folder)
+    # Build ALL ZIP if requested later via endpoint; here only mark completed
+    await update_folder_job(job_id, status="completed", current_folder=None, all_zip_url=f"/api/download-all-direct/{job_id}")
+    # Uploaded images are no longer needed once every PDF exists
+    remove_job_dir(job_id)
 
 
 @api_router.get("/folder-direct-status/{job_id}", response_model=FolderDirectJobStatus)
 async def folder_direct_status(job_id: str):
-    job = direct_jobs.get(job_id)
-    if not job:
+    job = await get_folder_job(job_id)
+    if not job or job.get("kind") != "folder_direct":
         raise HTTPException(status_code=404, detail="Job không tồn tại")
-    return job
+    return FolderDirectJobStatus(**job)
 
 
 # ===== Health check endpoint for Kubernetes/deployment =====
@@ -2745,13 +3057,104 @@ except Exception as _e:
         return "<!doctype html><html><body><h1>SmartScan Online</h1></body></html>"
 
 
+JOB_EVENTS_POLL_SECONDS = 1.0
+JOB_EVENTS_KEEPALIVE_SECONDS = 15.0
+TERMINAL_JOB_STATUSES = ("completed", "error")
+
+
+def folder_job_snapshot(job: dict) -> dict:
+    """Public status of a job (same body as the status endpoints)"""
+    model = FolderScanJobStatus if job.get("kind") == "folder_scan" else FolderDirectJobStatus
+    return model(**job).model_dump(mode="json")
+
+
+async def folder_job_event_stream(job_id: str, request: Request):
+    """
+    SSE stream: a snapshot, then incremental events until the job ends
+    Events come straight from the job runner when it runs in this process; otherwise
+    (another worker, or this stream fell behind) the job document is diffed every second.
+    """
+    queue = subscribe_job_events(job_id)
+    try:
+        job = await get_folder_job(job_id)
+        if not job:
+            yield format_sse("error", {"detail": "Job không tồn tại"})
+            return
+        yield format_sse("snapshot", folder_job_snapshot(job))
+        seen_folders = {fr["folder_name"] for fr in job["folder_results"]}
+        progress = {k: job.get(k) for k in ("status", "completed_folders", "current_folder")}
+        last_sent = time.monotonic()
+
+        while progress["status"] not in TERMINAL_JOB_STATUSES:
+            if await request.is_disconnected():
+                return
+            try:
+                event, data = await asyncio.wait_for(queue.get(), JOB_EVENTS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                event, data = None, None
+
+            if event is not None and event != "resync":
+                if event == "folder_completed":
+                    if data["folder_name"] in seen_folders:
+                        continue
+                    seen_folders.add(data["folder_name"])
+                progress.update({k: v for k, v in data.items() if k in progress})
+                yield format_sse(event, data)
+                last_sent = time.monotonic()
+                continue
+
+            if event is None and job_id in _running_folder_jobs:
+                # Runner is local and quiet
+                if time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+                continue
+
+            job = await get_folder_job(job_id)
+            if not job:
+                return
+            for fr in job["folder_results"]:
+                if fr["folder_name"] not in seen_folders:
+                    seen_folders.add(fr["folder_name"])
+                    yield format_sse("folder_completed", fr)
+                    last_sent = time.monotonic()
+            current = {k: job.get(k) for k in progress}
+            if current != progress:
+                progress = current
+                yield format_sse("status" if current["status"] in TERMINAL_JOB_STATUSES else "progress", {
+                    **current,
+                    "error_message": job.get("error_message"),
+                    "all_zip_url": job.get("all_zip_url"),
+                })
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+    finally:
+        unsubscribe_job_events(job_id, queue)
+
+
+@api_router.get("/folder-job-events/{job_id}")
+async def folder_job_events(job_id: str, request: Request):
+    """
+    Server-sent events for a folder job (scan or direct) - replaces status polling
+    Events: snapshot, folder_started, file_classified, folder_completed (ZIP/PDF urls), progress, status
+    """
+    return StreamingResponse(
+        folder_job_event_stream(job_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @api_router.get("/folder-scan-status/{job_id}", response_model=FolderScanJobStatus)
 async def get_folder_scan_status(job_id: str):
-    """Get status of folder scan job (poll this endpoint)"""
-    if job_id not in active_jobs:
+    """Get status of folder scan job (poll this endpoint) - served from MongoDB, works on any worker"""
+    job = await get_folder_job(job_id)
+    if not job or job.get("kind") != "folder_scan":
         raise HTTPException(status_code=404, detail="Job không tồn tại")
     
-    return active_jobs[job_id]
+    return FolderScanJobStatus(**job)
 
 
 @api_router.get("/download-folder-result/{filename}")
@@ -2789,13 +3192,47 @@ app.include_router(api_router)
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
 from auth_models import UserRegisterRequest, UserLoginRequest, TokenResponse
-from auth_utils import PasswordHasher, TokenManager
+from auth_utils import PasswordHasher, TokenManager, AuthBusyError, auth_attempts, auth_ip_slots, AUTH_IP_WAIT_SECONDS
 
 auth_router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 
+# Reverse proxies in front of the app (Railway: 1). Each appends the address it
+# saw to X-Forwarded-For, so only the last TRUSTED_PROXY_COUNT hops are trustworthy
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '0'))
+
+
+def client_ip(request: Request) -> str:
+    """Client address for per-IP limits (never the client-controlled left part of X-Forwarded-For)"""
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_COUNT > 0 and forwarded:
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXY_COUNT, len(hops))]
+    return request.client.host if request.client else "unknown"
+
+
+@asynccontextmanager
+async def auth_slot(request: Request, username: str):
+    """Cap concurrent password checks per username (429) and queue them per client IP; 503 when bcrypt is saturated"""
+    user_key, ip_key = f"user:{username}", f"ip:{client_ip(request)}"
+    if not auth_attempts.try_acquire(user_key):
+        raise HTTPException(status_code=429, detail="Too many attempts in progress, please retry shortly", headers={"Retry-After": "1"})
+    try:
+        if not await auth_ip_slots.acquire(ip_key, AUTH_IP_WAIT_SECONDS):
+            raise HTTPException(status_code=429, detail="Too many attempts in progress, please retry shortly", headers={"Retry-After": "2"})
+        try:
+            yield
+        except AuthBusyError:
+            raise HTTPException(status_code=503, detail="Authentication is busy, please retry shortly", headers={"Retry-After": "1"})
+        finally:
+            auth_ip_slots.release(ip_key)
+    finally:
+        auth_attempts.release(user_key)
+
+
 @auth_router.post("/login", response_model=TokenResponse)
-async def login(user_data: UserLoginRequest):
+async def login(user_data: UserLoginRequest, request: Request):
     """Login user and return access token"""
     users_collection = db["users"]
     
@@ -2804,8 +3241,10 @@ async def login(user_data: UserLoginRequest):
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    # Verify password
-    if not PasswordHasher.verify_password(user_data.password, user["hashed_password"]):
+    # Verify password (bcrypt thread pool)
+    async with auth_slot(request, user["username"]):
+        password_ok = await PasswordHasher.verify_password_async(user_data.password, user["hashed_password"])
+    if not password_ok:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
     # Check if user is active and approved
@@ -2832,7 +3271,7 @@ async def login(user_data: UserLoginRequest):
 
 
 @auth_router.post("/register", status_code=201)
-async def register(user_data: UserRegisterRequest):
+async def register(user_data: UserRegisterRequest, request: Request):
     """Register a new user (pending approval)"""
     users_collection = db["users"]
     
@@ -2847,7 +3286,8 @@ async def register(user_data: UserRegisterRequest):
         raise HTTPException(status_code=409, detail="Username already taken")
     
     # Hash password and create user
-    hashed_password = PasswordHasher.hash_password(user_data.password)
+    async with auth_slot(request, user_data.username.lower()):
+        hashed_password = await PasswordHasher.hash_password_async(user_data.password)
     new_user = {
         "email": user_data.email.lower(),
         "username": user_data.username.lower(),
@@ -2874,9 +3314,10 @@ async def register(user_data: UserRegisterRequest):
 
 @api_router.get("/download-all-direct/{job_id}")
 async def download_all_direct(job_id: str):
-    job = direct_jobs.get(job_id)
-    if not job:
+    job_doc = await get_folder_job(job_id)
+    if not job_doc or job_doc.get("kind") != "folder_direct":
         raise HTTPException(status_code=404, detail="Job không tồn tại")
+    job = FolderDirectJobStatus(**job_doc)
     if job.status != "completed":
         raise HTTPException(status_code=409, detail="Job chưa hoàn tất")
 
@@ -3004,6 +3445,7 @@ async def approve_user(user_id: str, admin: dict = Depends(require_admin)):
     
     if not result:
         raise HTTPException(status_code=404, detail="User not found or not in pending status")
+    invalidate_cached_user(user_id)
     
     return {
         "message": "User approved successfully",
@@ -3031,6 +3473,7 @@ async def disable_user(user_id: str, admin: dict = Depends(require_admin)):
     
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_cached_user(user_id)
     
     return {"message": "User disabled successfully"}
 
@@ -3054,6 +3497,7 @@ async def enable_user(user_id: str, admin: dict = Depends(require_admin)):
     
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_cached_user(user_id)
     
     return {"message": "User enabled successfully"}
 
@@ -3074,6 +3518,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
 
 # Configure logging
@@ -3083,6 +3528,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_folder_job_runner():
+    try:
+        await ensure_folder_job_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create folder job indexes: {e}")
+    asyncio.create_task(resume_folder_jobs_loop())
+
+@app.on_event("startup")
+async def start_scan_results_maintenance():
+    try:
+        await ensure_scan_result_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create scan_results indexes: {e}")
+
+    async def migrate():
+        try:
+            await migrate_scan_owners()
+            await migrate_scan_timestamps()
+            await migrate_scan_images()
+        except Exception as e:
+            logger.warning(f"Scan results migration failed: {e}")
+    asyncio.create_task(migrate())
+
+@app.on_event("startup")
+async def start_ocr_workers():
+    # Load PaddleOCR in the worker processes before the first hybrid scan
+    if USE_HYBRID_OCR:
+        asyncio.create_task(warm_ocr_executor())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    shutdown_cpu_pool()
+    shutdown_ocr_executor()
+    if _openai_client is not None:
+        await _openai_client.close()
\ No newline at end of file
@@ -195,6 +195,128 @@ function buildPythonEnv(extra = {}, pythonInfo = null, scriptDir = '') {
   return env;
 }
 
+// ========== PERSISTENT PYTHON WORKER ==========
+// One long-lived `process_document.py --worker` process handles all per-file
+// requests over JSON lines (stdin/stdout), so imports, rule tables and OCR
+// engines are loaded once instead of once per image.
+class PythonWorker {
+  constructor(scriptName) {
+    this.scriptName = scriptName;
+    this.child = null;
+    this.stdoutBuffer = '';
+    this.queue = [];
+    this.current = null;
+    this.nextId = 1;
+  }
+
+  start() {
+    const pyInfo = discoverPython();
+    if (!pyInfo.ok) throw new Error('Python 3.10–3.12 not found. Please install Python.');
+
+    const scriptPath = isDev ? path.join(__dirname, '../python', this.scriptName) : getPythonScriptPath(this.scriptName);
+    const scriptDir = path.dirname(scriptPath);
+    console.log(`🟢 Starting Python worker: ${pyInfo.executable} ${scriptPath} --worker`);
+
+    const child = spawn(pyInfo.executable, [scriptPath, '--worker'], {
+      cwd: scriptDir,
+      env: buildPythonEnv({}, pyInfo, scriptDir)
+    });
+    child.stdout.setEncoding('utf8');
+    child.stderr.setEncoding('utf8');
+    child.stdout.on('data', (d) => { if (this.child === child) this.onStdout(d); });
+    child.stderr.on('data', (d) => { console.log('[Python worker]:', d); if (this.child === child && this.current) this.current.errorLogs += d; });
+    child.on('error', (err) => this.onExit(child, err));
+    child.on('close', (code) => this.onExit(child, new Error(`Python worker exited with code ${code}`)));
+
+    this.child = child;
+    this.stdoutBuffer = '';
+  }
+
+  stop() {
+    if (!this.child) return;
+    const child = this.child;
+    this.child = null;
+    try { child.stdin.write(JSON.stringify({ op: 'shutdown' }) + '\n'); child.stdin.end(); } catch {}
+    setTimeout(() => { try { child.kill(); } catch {} }, 2000);
+  }
+
+  request(payload, timeoutMs = 60000) {
+    return new Promise((resolve, reject) => {
+      this.queue.push({ payload, timeoutMs, resolve, reject, errorLogs: '' });
+      this.pump();
+    });
+  }
+
+  // Requests are sent one at a time so each timeout only covers its own work
+  pump() {
+    if (this.current || this.queue.length === 0) return;
+    const job = this.queue.shift();
+    try {
+      if (!this.child) this.start();
+    } catch (err) {
+      job.reject(err);
+      this.pump();
+      return;
+    }
+
+    job.id = this.nextId++;
+    job.timer = setTimeout(() => {
+      console.error(`⏱️ Python worker request ${job.id} timed out, restarting worker`);
+      // Detach the hung child first: finish() pumps the next job, which must start a fresh worker
+      const child = this.child;
+      this.child = null;
+      try { child.kill(); } catch {}
+      this.finish(job, new Error(`OCR processing timeout (${Math.round(job.timeoutMs / 1000)}s)`));
+    }, job.timeoutMs);
+    this.current = job;
+    this.child.stdin.write(JSON.stringify({ id: job.id, ...job.payload }) + '\n');
+  }
+
+  finish(job, err, result) {
+    if (this.current !== job) return;
+    clearTimeout(job.timer);
+    this.current = null;
+    if (err) job.reject(err); else job.resolve(result);
+    this.pump();
+  }
+
+  onStdout(data) {
+    this.stdoutBuffer += data;
+    let idx;
+    while ((idx = this.stdoutBuffer.indexOf('\n')) >= 0) {
+      const line = this.stdoutBuffer.slice(0, idx).trim();
+      this.stdoutBuffer = this.stdoutBuffer.slice(idx + 1);
+      if (!line.startsWith('{')) continue;
+      try {
+        const msg = JSON.parse(line);
+        if (this.current && msg.id === this.current.id) this.finish(this.current, null, msg.result);
+      } catch (e) {
+        console.error('Python worker JSON parse error:', e, line.substring(0, 200));
+      }
+    }
+  }
+
+  onExit(child, err) {
+    // A killed or stopped child exiting later must not fail the job of its replacement
+    if (this.child !== child) return;
+    this.child = null;
+    if (this.current) {
+      console.error('Python worker died:', err.message);
+      this.finish(this.current, new Error(this.current.errorLogs || err.message));
+    }
+  }
+}
+
+// Single-folder scans used to spawn one process per image with no timeout; a page
+// that needs a cold model load plus cloud retries still finishes well within this
+const FOLDER_PAGE_TIMEOUT_MS = 180000;
+
+const documentWorker = new PythonWorker('process_document.py');
+// Colour pre-filter gets its own worker so it never waits behind queued OCR jobs
+const colorWorker = new PythonWorker('process_document.py');
+
+app.on('before-quit', () => { documentWorker.stop(); colorWorker.stop(); });
+
 // ========== SCAN HISTORY CLEANUP ==========
 function cleanupOldScans() {
   try {
@@ -425,57 +547,27 @@ ipcMain.handle('scan-single-folder', async (event, folderPath, ocrEngineType) =>
         return;
       }
 
-      const pyInfo = discoverPython();
-      if (!pyInfo.ok) {
-        reject(new Error('Python 3.10–3.12 not found'));
-        return;
-      }
-
-      const scriptPath = isDev ? path.join(__dirname, '../python/process_document.py') : getPythonScriptPath('process_document.py');
-      const pythonScriptDir = path.dirname(scriptPath);
-      
-      // Process each image
+      // Process each image through the persistent worker
       const results = [];
       for (const imagePath of imageFiles) {
-        const args = [scriptPath, imagePath, ocrEngineType];
-        if (cloudApiKey) args.push(cloudApiKey);
-
-        const child = spawn(pyInfo.executable, args, {
-          cwd: pythonScriptDir,
-          env: buildPythonEnv({ 
-            GOOGLE_API_KEY: cloudApiKey || process.env.GOOGLE_API_KEY || ''
-          }, pyInfo, pythonScriptDir)
-        });
-
-        let result = '';
-        let errorLogs = '';
-        child.stdout.setEncoding('utf8');
-        child.stderr.setEncoding('utf8');
-        child.stdout.on('data', (d) => { result += d; });
-        child.stderr.on('data', (d) => { errorLogs += d; });
-
-        await new Promise((res) => {
-          child.on('close', (code) => {
-            if (code === 0) {
-              try {
-                const lines = result.trim().split('\n');
-                const jsonLine = lines[lines.length - 1];
-                const jsonResult = JSON.parse(jsonLine);
-                results.push({
-                  original_path: imagePath,
-                  short_code: jsonResult.short_code || 'UNKNOWN',
-                  doc_type: jsonResult.doc_type || 'Unknown',
-                  confidence: jsonResult.confidence || 0,
-                  folder: folderPath,
-                  success: jsonResult.success || false
-                });
-              } catch (e) {
-                console.error('Parse error:', e);
-              }
-            }
-            res();
+        try {
+          const jsonResult = await documentWorker.request({
+            file_path: imagePath,
+            ocr_engine_type: ocrEngineType,
+            cloud_api_key: cloudApiKey,
+            env: { GOOGLE_API_KEY: cloudApiKey || process.env.GOOGLE_API_KEY || '' }
+          }, FOLDER_PAGE_TIMEOUT_MS);
+          results.push({
+            original_path: imagePath,
+            short_code: jsonResult.short_code || 'UNKNOWN',
+            doc_type: jsonResult.doc_type || 'Unknown',
+            confidence: jsonResult.confidence || 0,
+            folder: folderPath,
+            success: jsonResult.success || false
           });
-        });
+        } catch (e) {
+          console.error('Worker error:', e);
+        }
       }
 
       resolve({
@@ -703,23 +795,6 @@ ipcMain.handle('process-document-offline', async (event, filePath) => {
       }
     }
 
-    const pyInfo = discoverPython();
-    if (!pyInfo.ok) {
-      reject(new Error('Python 3.10–3.12 not found. Please install Python.'));
-      return;
-    }
-
-    const scriptPath = isDev ? path.join(__dirname, '../python/process_document.py') : getPythonScriptPath('process_document.py');
-    const args = [scriptPath, filePath, ocrEngineType];
-    if (cloudApiKey) {
-      args.push(cloudApiKey);
-      if (cloudEndpoint) args.push(cloudEndpoint);
-    }
-
-    console.log(`Spawning: ${pyInfo.executable} ${args.map(a => (a === cloudApiKey ? '[API_KEY]' : a)).join(' ')}`);
-
-    const pythonScriptDir = path.dirname(scriptPath);
-    
     // Get resize settings from store
     const enableResize = store.get('enableResize', true);
     const maxWidth = store.get('maxWidth', 2000);
@@ -728,49 +803,38 @@ ipcMain.handle('process-document-offline', async (event, filePath) => {
     // Get batch mode settings
     const batchMode = store.get('batchMode', 'sequential');
     const batchSize = store.get('smartMaxBatchSize', 8); // Use smartMaxBatchSize for batch size
-    
-    const child = spawn(pyInfo.executable, args, {
-      cwd: pythonScriptDir,
-      env: buildPythonEnv({ 
-        GOOGLE_API_KEY: cloudApiKey || process.env.GOOGLE_API_KEY || '',
-        ENABLE_RESIZE: enableResize ? 'true' : 'false',
-        MAX_WIDTH: String(maxWidth),
-        MAX_HEIGHT: String(maxHeight),
-        BATCH_MODE: batchMode,
-        BATCH_SIZE: String(batchSize)
-      }, pyInfo, pythonScriptDir)
-    });
-
-    let result = '';
-    let errorLogs = '';
-    child.stdout.setEncoding('utf8');
-    child.stderr.setEncoding('utf8');
 
-    child.stdout.on('data', (d) => { result += d; });
-    child.stderr.on('data', (d) => { console.log('[Python stderr]:', d); errorLogs += d; });
+    console.log(`Worker request: ${filePath} (${ocrEngineType})`);
 
-    child.on('close', (code) => {
-      if (code === 0) {
-        try {
-          const lines = result.trim().split('\n');
-          let jsonLine = lines[lines.length - 1];
-          if (!jsonLine || !jsonLine.trim().startsWith('{')) jsonLine = lines.find(l => l.trim().startsWith('{'));
-          if (!jsonLine) throw new Error('No JSON found in output');
-          const jsonResult = JSON.parse(jsonLine);
-          console.log('📝 Original text extracted:', (jsonResult.original_text || '').substring(0, 100));
-          resolve(jsonResult);
-        } catch (e) {
-          console.error('JSON parse error:', e); console.error('Raw output:', result); console.error('Stderr logs:', errorLogs);
-          reject(new Error(`Failed to parse OCR result: ${e.message}`));
+    try {
+      // Increased timeout for PDF batch processing (large PDFs may take longer)
+      const jsonResult = await documentWorker.request({
+        file_path: filePath,
+        ocr_engine_type: ocrEngineType,
+        cloud_api_key: cloudApiKey,
+        cloud_endpoint: cloudEndpoint,
+        env: {
+          GOOGLE_API_KEY: cloudApiKey || process.env.GOOGLE_API_KEY || '',
+          ENABLE_RESIZE: enableResize ? 'true' : 'false',
+          MAX_WIDTH: String(maxWidth),
+          MAX_HEIGHT: String(maxHeight),
+          BATCH_MODE: batchMode,
+          BATCH_SIZE: String(batchSize),
+          BATCH_CONCURRENCY: String(store.get('batchConcurrency', 1)),
+          BATCH_TOKENS_PER_MINUTE: String(store.get('batchTokensPerMinute', 0))
         }
-      } else {
-        console.error('Process exited with code:', code); console.error('Stderr:', errorLogs);
-        reject(new Error(errorLogs || `OCR processing failed with code ${code}`));
+      }, 300000);
+      if (!jsonResult) {
+        reject(new Error('OCR processing failed'));
+        return;
       }
-    });
-
-    // Increased timeout for PDF batch processing (large PDFs may take longer)
-    setTimeout(() => { try { child.kill(); } catch {} reject(new Error('OCR processing timeout (5 minutes)')); }, 300000);
+      // Failed results ({success: false, error}) are resolved too: the renderer shows the error
+      console.log('📝 Original text extracted:', (jsonResult.original_text || '').substring(0, 100));
+      resolve(jsonResult);
+    } catch (e) {
+      console.error('Python worker error:', e.message);
+      reject(e);
+    }
   });
 });
 
@@ -1046,7 +1110,11 @@ ipcMain.handle('batch-process-documents', async (event, { mode, imagePaths, ocrE
       // Spawn Python process
       const pythonProcess = spawn(pyInfo.executable, args, {
         cwd: pythonDir,
-        env: buildPythonEnv({ SMART_MAX_BATCH_SIZE: smartMaxBatchSize.toString() }, pyInfo, pythonDir)
+        env: buildPythonEnv({
+          SMART_MAX_BATCH_SIZE: smartMaxBatchSize.toString(),
+          BATCH_CONCURRENCY: String(store.get('batchConcurrency', 1)),
+          BATCH_TOKENS_PER_MINUTE: String(store.get('batchTokensPerMinute', 0))
+        }, pyInfo, pythonDir)
       });
       
       let stdoutData = '';
@@ -1426,44 +1494,18 @@ ipcMain.handle('get-images-in-folder', async (event, folderPath) => {
 // Pre-filter GCN files by color (fast, local, free)
 ipcMain.handle('pre-filter-gcn-files', async (event, files) => {
   try {
-    const pyInfo = discoverPython();
-    if (!pyInfo.ok) {
-      throw new Error('Python 3.10–3.12 not found');
-    }
-
-    const scriptPath = isDev 
-      ? path.join(__dirname, '../python/color_detector.py')
-      : getPythonScriptPath('color_detector.py');
-
     console.log(`🎨 Pre-filtering ${files.length} files...`);
 
     const passed = [];
     const skipped = [];
 
     for (const filePath of files) {
-      const args = [scriptPath, filePath];
-      
       try {
-        const result = await new Promise((resolve, reject) => {
-          const child = spawn(pyInfo.executable, args, {
-            cwd: path.dirname(scriptPath),
-            env: buildPythonEnv({})
-          });
-
-          let stdout = '';
-          let stderr = '';
-
-          child.stdout.on('data', (data) => { stdout += data.toString(); });
-          child.stderr.on('data', (data) => { stderr += data.toString(); });
-
-          child.on('close', (code) => {
-            if (code === 0) {
-              resolve(stdout.trim());
-            } else {
-              reject(new Error(`Color detection failed: ${stderr}`));
-            }
-          });
-        });
+        const response = await colorWorker.request({ op: 'detect_color', file_path: filePath });
+        if (!response || !response.success) {
+          throw new Error(`Color detection failed: ${(response && response.error) || 'unknown error'}`);
+        }
+        const result = response.result;
 
         // Check result: 'pass' (A3), 'red', 'pink', or 'unknown'
         if (result === 'pass' || result === 'red' || result === 'pink') {
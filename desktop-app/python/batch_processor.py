@@ -12,7 +12,11 @@ import os
 import json
 import base64
 import re
+import time
+import threading
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import io
 from pdf_splitter import split_pdf_to_pages, cleanup_split_pages
@@ -554,7 +558,471 @@ def batch_classify_tesseract_text(image_paths, api_key, last_known_type=None):
 
 
 
-def batch_classify_fixed(image_paths, api_key, engine_type='gemini-flash', batch_size=8, last_known_type=None, skip_pdf_conversion=False):
+# Rough token costs used to pace concurrent batch requests against a
+# tokens-per-minute budget (Gemini bills ~258 tokens per 768px tile, a
+# 1500x2100 page is ~6 tiles; each returned document is ~400 output tokens)
+GEMINI_TOKENS_PER_IMAGE = 1548
+GEMINI_OUTPUT_TOKENS_PER_IMAGE = 400
+
+
+class TokenBudget:
+    """
+    Sliding 60-second token budget shared by in-flight batch requests.
+
+    acquire() blocks until the estimated tokens of a new request fit into the
+    budget; settle() replaces the estimate with the real usage once known.
+    A budget of 0 disables the limit.
+    """
+
+    def __init__(self, tokens_per_minute=0):
+        self.tokens_per_minute = int(tokens_per_minute or 0)
+        self.window = deque()  # [timestamp, tokens]
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        entry = [time.time(), tokens]
+        if self.tokens_per_minute <= 0:
+            return entry
+        while True:
+            with self.lock:
+                now = time.time()
+                while self.window and now - self.window[0][0] >= 60:
+                    self.window.popleft()
+                used = sum(t for _, t in self.window)
+                # Always admit a request into an empty window, even if it is
+                # larger than the whole budget, so oversized batches can't hang
+                if not self.window or used + tokens <= self.tokens_per_minute:
+                    entry[0] = now
+                    self.window.append(entry)
+                    return entry
+                wait_time = 60 - (now - self.window[0][0])
+            print(f"⏸️ Token budget {used}/{self.tokens_per_minute} TPM used, waiting {wait_time:.1f}s...", file=sys.stderr)
+            time.sleep(max(wait_time, 0.1))
+
+    def settle(self, entry, actual_tokens):
+        if actual_tokens:
+            with self.lock:
+                entry[1] = int(actual_tokens)
+
+
+def estimate_batch_tokens(prompt_text, num_images):
+    """Estimate input + output tokens for one multi-image Gemini request"""
+    return len(prompt_text) // 3 + num_images * (GEMINI_TOKENS_PER_IMAGE + GEMINI_OUTPUT_TOKENS_PER_IMAGE)
+
+
+def encode_batch_images(batch_paths):
+    """Encode all files of a batch to base64 (failed files are skipped)"""
+    print(f"🖼️ Encoding {len(batch_paths)} images...", file=sys.stderr)
+    encoded_images = []
+    for path in batch_paths:
+        encoded, resize_info = encode_image_base64(path)
+        if encoded:
+            encoded_images.append(encoded)
+            print(f"   ✅ {os.path.basename(path)}: {resize_info.get('original_size', 'N/A')} → {resize_info.get('new_size', 'N/A')}", file=sys.stderr)
+        else:
+            print(f"   ❌ Failed to encode {os.path.basename(path)}", file=sys.stderr)
+    return encoded_images
+
+
+class EncodeAheadPool:
+    """
+    Encode batches in background threads ahead of the request loop.
+
+    get(i) returns the encoded images of batch i and makes sure batches
+    i+1 .. i+ahead are already being encoded, so the CPU-bound JPEG work of
+    the next batches overlaps with the network wait of the current one.
+    PIL releases the GIL while decoding, resizing and encoding, so threads
+    are enough here.
+    """
+
+    def __init__(self, batches, ahead=2, max_workers=None):
+        self.batches = batches
+        self.ahead = max(0, ahead)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(4, os.cpu_count() or 1),
+            thread_name_prefix='encode'
+        )
+        self.futures = {}
+        self.scheduled = set()
+        self.lock = threading.Lock()
+
+    def _schedule(self, index):
+        if 0 <= index < len(self.batches) and index not in self.scheduled:
+            self.scheduled.add(index)
+            self.futures[index] = self.executor.submit(encode_batch_images, self.batches[index])
+
+    def get(self, index):
+        with self.lock:
+            for i in range(index, index + self.ahead + 1):
+                self._schedule(i)
+            future = self.futures.pop(index)
+        return future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def build_batch_payload(batch_paths, encoded_images, prompt_getter):
+    """Build the multi-image Gemini payload for an encoded batch"""
+    if not encoded_images:
+        return None
+
+    # Build multi-file payload (images + PDFs)
+    parts = [{"text": prompt_getter(len(batch_paths))}]
+    for idx, (path, img_data) in enumerate(zip(batch_paths, encoded_images)):
+        # Determine mime type based on file extension
+        is_pdf = path.lower().endswith('.pdf')
+        mime_type = "application/pdf" if is_pdf else "image/jpeg"
+
+        parts.append({
+            "inline_data": {
+                "mime_type": mime_type,
+                "data": img_data
+            }
+        })
+
+    return {
+        "contents": [{"parts": parts}],
+        "generationConfig": {
+            "temperature": 0.1,
+            "topP": 0.8,
+            "topK": 10,
+            "maxOutputTokens": 8000,  # Large enough for 20 documents × 400 tokens each
+            "responseMimeType": "application/json"  # Force JSON output
+        },
+        "safetySettings": [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}
+        ]
+    }
+
+
+def post_batch_request(api_url, payload, batch_num, batch_size):
+    """Send one batch request to Gemini with retry logic, return (response, result_data)"""
+    max_retries = 3
+    retry_delay = 10  # seconds
+
+    for attempt in range(max_retries):
+        try:
+            response = requests.post(api_url, json=payload, timeout=120)
+            response.raise_for_status()
+            result_data = response.json()
+
+            # Reset all error counters on success
+            if ERROR_HANDLER_AVAILABLE:
+                handle_success()
+
+            break  # Success, exit retry loop
+
+        except requests.exceptions.HTTPError as e:
+            status_code = e.response.status_code
+            error_type = get_error_type_from_status(status_code) if ERROR_HANDLER_AVAILABLE else str(status_code)
+
+            if ERROR_HANDLER_AVAILABLE:
+                # Use centralized error handler
+                context = {
+                    "batch_num": batch_num,
+                    "batch_size": batch_size,
+                    "attempt": attempt + 1,
+                    "max_retries": max_retries
+                }
+                error_info = handle_error(error_type, e, context)
+
+                # Check if should stop
+                if error_info["should_stop"]:
+                    print(f"❌ Stopping due to critical error: {status_code}", file=sys.stderr)
+                    if error_info["error_response"]:
+                        print_error_response(error_info["error_response"])
+                    sys.exit(1)
+
+                # Check if should retry
+                if error_info["should_retry"] and attempt < max_retries - 1:
+                    wait_time = error_info["wait_time"]
+                    print(f"   Retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                    if batch_size > 5 and status_code in [500, 503]:
+                        print(f"   💡 Tip: Try reducing Smart batch size to 5-8 in Settings", file=sys.stderr)
+                    import time
+                    time.sleep(wait_time)
+                    continue
+                else:
+                    # Max retries reached or should not retry
+                    if error_info["is_critical"] and error_info["error_response"]:
+                        print_error_response(error_info["error_response"])
+                        sys.exit(1)
+                    raise
+            else:
+                # Legacy error handling (fallback)
+                if status_code in [500, 503]:
+                    if attempt < max_retries - 1:
+                        wait_time = retry_delay * (2 ** attempt)
+                        print(f"⚠️ {status_code} Server Error, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                        import time
+                        time.sleep(wait_time)
+                        continue
+                    else:
+                        raise
+                elif status_code == 429:
+                    if attempt < max_retries - 1:
+                        wait_time = 60 * (2 ** attempt)
+                        print(f"⚠️ 429 Rate Limit, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                        import time
+                        time.sleep(wait_time)
+                        continue
+                    else:
+                        raise
+                else:
+                    print(f"❌ HTTP {status_code} Error: {e}", file=sys.stderr)
+                    raise
+        except requests.exceptions.Timeout as e:
+            # Timeout error
+            if ERROR_HANDLER_AVAILABLE:
+                context = {"batch_num": batch_num, "batch_size": batch_size, "attempt": attempt + 1}
+                error_info = handle_error("timeout", e, context)
+
+                if error_info["should_retry"] and attempt < max_retries - 1:
+                    wait_time = error_info["wait_time"]
+                    print(f"   Retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                    import time
+                    time.sleep(wait_time)
+                    continue
+                else:
+                    if error_info["error_response"]:
+                        print_error_response(error_info["error_response"])
+                    raise
+            else:
+                if attempt < max_retries - 1:
+                    wait_time = retry_delay * (2 ** attempt)
+                    print(f"⚠️ Timeout error, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                    import time
+                    time.sleep(wait_time)
+                    continue
+                else:
+                    raise
+        except requests.exceptions.RequestException as e:
+            # Network errors
+            if ERROR_HANDLER_AVAILABLE:
+                context = {"batch_num": batch_num, "batch_size": batch_size, "attempt": attempt + 1}
+                error_info = handle_error("network", e, context)
+
+                if error_info["should_retry"] and attempt < max_retries - 1:
+                    wait_time = error_info["wait_time"]
+                    print(f"   Retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                    import time
+                    time.sleep(wait_time)
+                    continue
+                else:
+                    if error_info["error_response"]:
+                        print_error_response(error_info["error_response"])
+                    raise
+            else:
+                if attempt < max_retries - 1:
+                    wait_time = retry_delay * (2 ** attempt)
+                    print(f"⚠️ Network error, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
+                    import time
+                    time.sleep(wait_time)
+                    continue
+                else:
+                    raise
+
+    return response, result_data
+
+
+def parse_batch_documents(response, result_data, batch_num, batch_paths):
+    """
+    Extract the 'documents' array from a Gemini batch response
+
+    Returns None if the response holds no parseable JSON; raises ValueError
+    if the JSON has an unrecognized shape.
+    """
+    print(f"📊 Response status: {response.status_code}", file=sys.stderr)
+
+    # Debug: Check finish reason and safety
+    if 'candidates' in result_data and len(result_data['candidates']) > 0:
+        candidate = result_data['candidates'][0]
+        finish_reason = candidate.get('finishReason', 'UNKNOWN')
+        print(f"🔍 Finish reason: {finish_reason}", file=sys.stderr)
+
+        if finish_reason == 'MAX_TOKENS':
+            print("⚠️ WARNING: Response truncated due to MAX_TOKENS!", file=sys.stderr)
+            print("   Some pages may be missing from response", file=sys.stderr)
+
+    # Parse response
+    candidates = result_data.get('candidates') or []
+    if not candidates:
+        return None
+    candidate = candidates[0]
+    parts = candidate.get('content', {}).get('parts', [])
+    if not parts or 'text' not in parts[0]:
+        return None
+    response_text = parts[0]['text']
+
+    print(f"📄 Raw response preview: {response_text[:200]}...", file=sys.stderr)
+
+    # DEBUG: Log full response to understand parsing issues
+    print(f"\n🔍 DEBUG - Full response length: {len(response_text)} chars", file=sys.stderr)
+    if len(response_text) < 500:
+        print(f"📄 Full response (short):", file=sys.stderr)
+        print(response_text, file=sys.stderr)
+
+    # Check for common issues
+    has_documents = '"documents"' in response_text
+    has_json_markers = '```json' in response_text
+    starts_with_brace = response_text.strip().startswith('{')
+
+    print(f"   Has 'documents' key: {has_documents}", file=sys.stderr)
+    print(f"   Has ```json markers: {has_json_markers}", file=sys.stderr)
+    print(f"   Starts with brace: {starts_with_brace}", file=sys.stderr)
+
+    # Extract JSON from response - try multiple patterns
+    json_match = re.search(r'\{[\s\S]*"documents"[\s\S]*\}', response_text)
+    if not json_match:
+        # Try finding JSON with triple backticks
+        json_match = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', response_text)
+        if json_match:
+            response_text = json_match.group(1)
+        else:
+            # Try finding any JSON object
+            json_match = re.search(r'(\{[\s\S]*\})', response_text)
+            if json_match:
+                response_text = json_match.group(1)
+    else:
+        response_text = json_match.group(0)
+
+    if not response_text:
+        print(f"⚠️ No valid JSON in response for batch {batch_num}", file=sys.stderr)
+        return None
+
+    try:
+        batch_result = json.loads(response_text)
+    except json.JSONDecodeError as je:
+        print(f"⚠️ JSON decode error in batch {batch_num}: {je}", file=sys.stderr)
+        print(f"   Response text: {response_text[:500]}...", file=sys.stderr)
+        return None
+
+    # Check if documents key exists
+    if 'documents' not in batch_result or not isinstance(batch_result.get('documents'), list):
+        print(f"⚠️ Batch {batch_num} WARNING: No 'documents' array in response!", file=sys.stderr)
+        print(f"   Response keys: {list(batch_result.keys())}", file=sys.stderr)
+
+        # FALLBACK: Check if response is a single document (LLM returned wrong format)
+        if 'type' in batch_result and 'pages' in batch_result:
+            print(f"   🔄 Auto-fixing: LLM returned single document format instead of array", file=sys.stderr)
+            print(f"   Wrapping into documents array...", file=sys.stderr)
+            batch_result = {
+                'documents': [batch_result]
+            }
+        else:
+            print(f"   ❌ Cannot auto-fix: Response format unrecognized", file=sys.stderr)
+            print(f"   This batch will fallback to individual processing", file=sys.stderr)
+            raise ValueError("Missing 'documents' array in response")
+
+    print(f"✅ Batch {batch_num} complete:", file=sys.stderr)
+
+    # Validate: Check if all pages are covered
+    total_pages_in_batch = len(batch_paths)
+    pages_returned = set()
+
+    for doc in batch_result.get('documents', []):
+        doc_type = doc.get('type', 'UNKNOWN')
+        pages = doc.get('pages', [])
+        confidence = doc.get('confidence', 0)
+        print(f"   📄 {doc_type}: {len(pages)} pages, confidence {confidence:.0%}", file=sys.stderr)
+
+        # Collect all page indices
+        for p in pages:
+            pages_returned.add(p)
+
+    # Check for missing pages
+    expected_pages = set(range(total_pages_in_batch))
+    missing_pages = expected_pages - pages_returned
+
+    if missing_pages:
+        print(f"   ⚠️ WARNING: AI didn't return {len(missing_pages)} pages: {sorted(missing_pages)}", file=sys.stderr)
+        print("      These files will be processed by fallback", file=sys.stderr)
+    else:
+        print(f"   ✅ All {total_pages_in_batch} pages accounted for", file=sys.stderr)
+
+    return batch_result['documents']
+
+
+def apply_sequential_naming(documents, batch_paths, batch_num, current_last_known):
+    """
+    Map batch documents back to file paths, carrying lastKnown across pages
+
+    Must be called in batch order: UNKNOWN / low-confidence pages inherit the
+    type of the last titled page seen so far.
+
+    Returns (results, updated_last_known)
+    """
+    batch_results_with_sequential = []
+
+    for doc in documents:
+        doc_type = doc.get('type', 'UNKNOWN')
+        doc_confidence = doc.get('confidence', 0.5)
+        doc_reasoning = doc.get('reasoning', '')
+        doc_metadata = doc.get('metadata', {})
+
+        # DEBUG: Log metadata for GCN
+        if doc_type == 'GCN':
+            print(f"\n🔍 DEBUG - GCN Metadata:", file=sys.stderr)
+            print(f"   Type: {doc_type}", file=sys.stderr)
+            print(f"   Metadata: {doc_metadata}", file=sys.stderr)
+            print(f"   Has color: {'color' in doc_metadata}", file=sys.stderr)
+            print(f"   Has issue_date: {'issue_date' in doc_metadata}", file=sys.stderr)
+            if doc_metadata:
+                print(f"   color value: {doc_metadata.get('color', 'MISSING')}", file=sys.stderr)
+                print(f"   issue_date value: {doc_metadata.get('issue_date', 'MISSING')}", file=sys.stderr)
+            print(f"\n", file=sys.stderr)
+
+        for page_idx in doc.get('pages', []):
+            if page_idx < len(batch_paths):
+                file_path = batch_paths[page_idx]
+                file_name = os.path.basename(file_path)
+
+                # Determine if this file has title (high confidence, not UNKNOWN)
+                has_title = (doc_confidence >= 0.8 and doc_type != 'UNKNOWN')
+
+                # Apply sequential naming logic
+                final_type = doc_type
+                final_confidence = doc_confidence
+                applied_sequential = False
+
+                # If file is UNKNOWN or low confidence AND we have lastKnown
+                if (doc_type == 'UNKNOWN' or doc_confidence < 0.5) and current_last_known:
+                    final_type = current_last_known['short_code']
+                    final_confidence = current_last_known['confidence']
+                    applied_sequential = True
+                    print(f"   🔄 Sequential: {file_name} ({doc_type} {doc_confidence:.0%}) → {final_type}", file=sys.stderr)
+
+                # Update lastKnown if this file has good classification
+                if doc_type != 'UNKNOWN' and doc_confidence >= 0.7 and has_title:
+                    current_last_known = {
+                        'short_code': doc_type,
+                        'confidence': doc_confidence,
+                        'has_title': True
+                    }
+                    print(f"   📌 Updated lastKnown: {doc_type} ({doc_confidence:.0%})", file=sys.stderr)
+
+                batch_results_with_sequential.append({
+                    'file_path': file_path,
+                    'file_name': file_name,
+                    'short_code': final_type,
+                    'confidence': final_confidence,
+                    'reasoning': doc_reasoning,
+                    'metadata': doc_metadata,
+                    'method': 'batch_fixed',
+                    'batch_num': batch_num,
+                    'applied_sequential': applied_sequential,
+                    'original_classification': doc_type if applied_sequential else None
+                })
+
+    return batch_results_with_sequential, current_last_known
+
+
+def batch_classify_fixed(image_paths, api_key, engine_type='gemini-flash', batch_size=8, last_known_type=None, skip_pdf_conversion=False,
+                         concurrency=None, tokens_per_minute=None, encode_ahead=None):
     """
     Phương án 1: Fixed Batch Size với SEQUENTIAL METADATA
     
@@ -565,6 +1033,11 @@ def batch_classify_fixed(image_paths, api_key, engine_type='gemini-flash', batch
         batch_size: Files per batch
         last_known_type: Metadata từ file cuối batch trước {short_code, confidence, has_title}
         skip_pdf_conversion: If True, skip PDF conversion (already done by caller)
+        concurrency: Max batches in flight (default: BATCH_CONCURRENCY env, 1 = sequential)
+        tokens_per_minute: Token budget shared by in-flight batches
+            (default: BATCH_TOKENS_PER_MINUTE env, 0 = unlimited)
+        encode_ahead: Batches encoded ahead of the one being sent
+            (default: BATCH_ENCODE_AHEAD env, 2)
     
     Strategy:
         - Batch 1: Process files 0-4, return lastKnown từ file 4
@@ -572,7 +1045,16 @@ def batch_classify_fixed(image_paths, api_key, engine_type='gemini-flash', batch
           * File 5 có title → Bỏ qua lastKnown, dùng title mới
           * File 5 không có title → Áp dụng sequential từ lastKnown
         - No overlap needed → 0% overhead!
+        - concurrency > 1: batches are sent in parallel, but responses are
+          resolved in batch order so the lastKnown chain is unchanged
     """
+    if concurrency is None:
+        concurrency = int(os.environ.get('BATCH_CONCURRENCY', '1') or 1)
+    if tokens_per_minute is None:
+        tokens_per_minute = int(os.environ.get('BATCH_TOKENS_PER_MINUTE', '0') or 0)
+    if encode_ahead is None:
+        encode_ahead = int(os.environ.get('BATCH_ENCODE_AHEAD', '2') or 0)
+    concurrency = max(1, concurrency)
     
     # Determine model and prompt based on engine type
     if engine_type == 'gemini-flash-lite':
@@ -656,389 +1138,102 @@ def batch_classify_fixed(image_paths, api_key, engine_type='gemini-flash', batch
     
     all_results = []
     processed_files = set()
-    batch_num = 0
-    current_idx = 0
     current_last_known = last_known_type  # Start with provided lastKnown
-    
-    while current_idx < len(image_paths):
-        batch_num += 1
-        
-        # Calculate batch range WITHOUT overlap
-        batch_start = current_idx
-        batch_end = min(len(image_paths), current_idx + batch_size)
+
+    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
+    batch_ranges = [
+        (start, min(len(image_paths), start + batch_size))
+        for start in range(0, len(image_paths), batch_size)
+    ]
+    total_batches = len(batch_ranges)
+    token_budget = TokenBudget(tokens_per_minute)
+    encode_pool = EncodeAheadPool(
+        [image_paths[batch_start:batch_end] for batch_start, batch_end in batch_ranges],
+        ahead=encode_ahead
+    )
+
+    if concurrency > 1:
+        print(f"\n🚀 Pipelined dispatch: up to {concurrency} batches in flight"
+              f" (token budget: {tokens_per_minute or 'unlimited'} TPM)", file=sys.stderr)
+
+    def send_batch(batch_num, batch_start, batch_end):
         batch_paths = image_paths[batch_start:batch_end]
-        
+
         print(f"\n📦 Batch {batch_num}: Files {batch_start}-{batch_end-1} ({len(batch_paths)} images)", file=sys.stderr)
-        
+
         for i, path in enumerate(batch_paths):
             print(f"   [{i}] {os.path.basename(path)}", file=sys.stderr)
-        
-        # Encode all images in batch
-        print(f"🖼️ Encoding {len(batch_paths)} images...", file=sys.stderr)
-        encoded_images = []
-        for path in batch_paths:
-            encoded, resize_info = encode_image_base64(path)
-            if encoded:
-                encoded_images.append(encoded)
-                print(f"   ✅ {os.path.basename(path)}: {resize_info.get('original_size', 'N/A')} → {resize_info.get('new_size', 'N/A')}", file=sys.stderr)
-            else:
-                print(f"   ❌ Failed to encode {os.path.basename(path)}", file=sys.stderr)
-        
-        if not encoded_images:
+
+        encoded_images = encode_pool.get(batch_num - 1)
+        payload = build_batch_payload(batch_paths, encoded_images, prompt_getter)
+        if payload is None:
             print(f"❌ No valid images in batch {batch_num}", file=sys.stderr)
-            continue
-        
-        # Build multi-file payload (images + PDFs)
-        parts = [{"text": prompt_getter(len(batch_paths))}]
-        for idx, (path, img_data) in enumerate(zip(batch_paths, encoded_images)):
-            # Determine mime type based on file extension
-            is_pdf = path.lower().endswith('.pdf')
-            mime_type = "application/pdf" if is_pdf else "image/jpeg"
-            
-            parts.append({
-                "inline_data": {
-                    "mime_type": mime_type,
-                    "data": img_data
-                }
-            })
-        
-        payload = {
-            "contents": [{"parts": parts}],
-            "generationConfig": {
-                "temperature": 0.1,
-                "topP": 0.8,
-                "topK": 10,
-                "maxOutputTokens": 8000,  # Large enough for 20 documents × 400 tokens each
-                "responseMimeType": "application/json"  # Force JSON output
-            },
-            "safetySettings": [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}
-            ]
-        }
-        
+            return None
+
+        budget_entry = token_budget.acquire(estimate_batch_tokens(payload['contents'][0]['parts'][0]['text'], len(batch_paths)))
+
         # Call Gemini API with retry logic
         print(f"📡 Sending batch request to {model_name}...", file=sys.stderr)
         print(f"   Batch size: {len(batch_paths)} files", file=sys.stderr)
         # Calculate approximate request size
-        import json
         payload_size_mb = len(json.dumps(payload)) / (1024 * 1024)
         print(f"   Request size: ~{payload_size_mb:.2f} MB", file=sys.stderr)
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
-        
-        max_retries = 3
-        retry_delay = 10  # seconds
-        
-        for attempt in range(max_retries):
+
+        response, result_data = post_batch_request(api_url, payload, batch_num, batch_size)
+        token_budget.settle(budget_entry, result_data.get('usageMetadata', {}).get('totalTokenCount'))
+        return response, result_data
+
+    def iter_batch_responses():
+        """Yield (batch_num, batch_paths, sent) strictly in batch order"""
+        if concurrency > 1:
+            # Keep up to `concurrency` requests in flight; results are consumed
+            # in submission order so the lastKnown chain stays sequential
+            executor = ThreadPoolExecutor(max_workers=concurrency)
             try:
-                response = requests.post(api_url, json=payload, timeout=120)
-                response.raise_for_status()
-                result_data = response.json()
-                
-                # Reset all error counters on success
-                if ERROR_HANDLER_AVAILABLE:
-                    handle_success()
-                
-                break  # Success, exit retry loop
-                
-            except requests.exceptions.HTTPError as e:
-                status_code = e.response.status_code
-                error_type = get_error_type_from_status(status_code) if ERROR_HANDLER_AVAILABLE else str(status_code)
-                
-                if ERROR_HANDLER_AVAILABLE:
-                    # Use centralized error handler
-                    context = {
-                        "batch_num": batch_num,
-                        "batch_size": batch_size,
-                        "attempt": attempt + 1,
-                        "max_retries": max_retries
-                    }
-                    error_info = handle_error(error_type, e, context)
-                    
-                    # Check if should stop
-                    if error_info["should_stop"]:
-                        print(f"❌ Stopping due to critical error: {status_code}", file=sys.stderr)
-                        if error_info["error_response"]:
-                            print_error_response(error_info["error_response"])
-                        sys.exit(1)
-                    
-                    # Check if should retry
-                    if error_info["should_retry"] and attempt < max_retries - 1:
-                        wait_time = error_info["wait_time"]
-                        print(f"   Retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                        if batch_size > 5 and status_code in [500, 503]:
-                            print(f"   💡 Tip: Try reducing Smart batch size to 5-8 in Settings", file=sys.stderr)
-                        import time
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        # Max retries reached or should not retry
-                        if error_info["is_critical"] and error_info["error_response"]:
-                            print_error_response(error_info["error_response"])
-                            sys.exit(1)
-                        raise
-                else:
-                    # Legacy error handling (fallback)
-                    if status_code in [500, 503]:
-                        if attempt < max_retries - 1:
-                            wait_time = retry_delay * (2 ** attempt)
-                            print(f"⚠️ {status_code} Server Error, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                            import time
-                            time.sleep(wait_time)
-                            continue
-                        else:
-                            raise
-                    elif status_code == 429:
-                        if attempt < max_retries - 1:
-                            wait_time = 60 * (2 ** attempt)
-                            print(f"⚠️ 429 Rate Limit, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                            import time
-                            time.sleep(wait_time)
-                            continue
-                        else:
-                            raise
-                    else:
-                        print(f"❌ HTTP {status_code} Error: {e}", file=sys.stderr)
-                        raise
-            except requests.exceptions.Timeout as e:
-                # Timeout error
-                if ERROR_HANDLER_AVAILABLE:
-                    context = {"batch_num": batch_num, "batch_size": batch_size, "attempt": attempt + 1}
-                    error_info = handle_error("timeout", e, context)
-                    
-                    if error_info["should_retry"] and attempt < max_retries - 1:
-                        wait_time = error_info["wait_time"]
-                        print(f"   Retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                        import time
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        if error_info["error_response"]:
-                            print_error_response(error_info["error_response"])
-                        raise
-                else:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        print(f"⚠️ Timeout error, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                        import time
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise
-            except requests.exceptions.RequestException as e:
-                # Network errors
-                if ERROR_HANDLER_AVAILABLE:
-                    context = {"batch_num": batch_num, "batch_size": batch_size, "attempt": attempt + 1}
-                    error_info = handle_error("network", e, context)
-                    
-                    if error_info["should_retry"] and attempt < max_retries - 1:
-                        wait_time = error_info["wait_time"]
-                        print(f"   Retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                        import time
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        if error_info["error_response"]:
-                            print_error_response(error_info["error_response"])
-                        raise
-                else:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        print(f"⚠️ Network error, retry {attempt + 1}/{max_retries} in {wait_time}s...", file=sys.stderr)
-                        import time
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        raise
-        
-        # Add delay between batches to avoid rate limiting
-        if batch_num < ((len(image_paths) + batch_size - 1) // batch_size):
-            import time
-            inter_batch_delay = 5  # 5 seconds between batches
-            print(f"⏸️ Waiting {inter_batch_delay}s before next batch...", file=sys.stderr)
-            time.sleep(inter_batch_delay)
-        
-        try:
-            
-            print(f"📊 Response status: {response.status_code}", file=sys.stderr)
-            
-            # Debug: Check finish reason and safety
-            if 'candidates' in result_data and len(result_data['candidates']) > 0:
-                candidate = result_data['candidates'][0]
-                finish_reason = candidate.get('finishReason', 'UNKNOWN')
-                print(f"🔍 Finish reason: {finish_reason}", file=sys.stderr)
-                
-                if finish_reason == 'MAX_TOKENS':
-                    print("⚠️ WARNING: Response truncated due to MAX_TOKENS!", file=sys.stderr)
-                    print("   Some pages may be missing from response", file=sys.stderr)
-            
-            # Parse response
-            if 'candidates' in result_data and len(result_data['candidates']) > 0:
-                candidate = result_data['candidates'][0]
-                if 'content' in candidate and 'parts' in candidate['content']:
-                    parts = candidate['content']['parts']
-                    if len(parts) > 0 and 'text' in parts[0]:
-                        response_text = parts[0]['text']
-                        
-                        print(f"📄 Raw response preview: {response_text[:200]}...", file=sys.stderr)
-                        
-                        # DEBUG: Log full response to understand parsing issues
-                        print(f"\n🔍 DEBUG - Full response length: {len(response_text)} chars", file=sys.stderr)
-                        if len(response_text) < 500:
-                            print(f"📄 Full response (short):", file=sys.stderr)
-                            print(response_text, file=sys.stderr)
-                        
-                        # Check for common issues
-                        has_documents = '"documents"' in response_text
-                        has_json_markers = '```json' in response_text
-                        starts_with_brace = response_text.strip().startswith('{')
-                        
-                        print(f"   Has 'documents' key: {has_documents}", file=sys.stderr)
-                        print(f"   Has ```json markers: {has_json_markers}", file=sys.stderr)
-                        print(f"   Starts with brace: {starts_with_brace}", file=sys.stderr)
-                        
-                        # Extract JSON from response - try multiple patterns
-                        json_match = re.search(r'\{[\s\S]*"documents"[\s\S]*\}', response_text)
-                        if not json_match:
-                            # Try finding JSON with triple backticks
-                            json_match = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', response_text)
-                            if json_match:
-                                response_text = json_match.group(1)
-                            else:
-                                # Try finding any JSON object
-                                json_match = re.search(r'(\{[\s\S]*\})', response_text)
-                                if json_match:
-                                    response_text = json_match.group(1)
-                        else:
-                            response_text = json_match.group(0)
-                        
-                        if response_text:
-                            try:
-                                batch_result = json.loads(response_text)
-                                
-                                # Check if documents key exists
-                                if 'documents' not in batch_result or not isinstance(batch_result.get('documents'), list):
-                                    print(f"⚠️ Batch {batch_num} WARNING: No 'documents' array in response!", file=sys.stderr)
-                                    print(f"   Response keys: {list(batch_result.keys())}", file=sys.stderr)
-                                    
-                                    # FALLBACK: Check if response is a single document (LLM returned wrong format)
-                                    if 'type' in batch_result and 'pages' in batch_result:
-                                        print(f"   🔄 Auto-fixing: LLM returned single document format instead of array", file=sys.stderr)
-                                        print(f"   Wrapping into documents array...", file=sys.stderr)
-                                        batch_result = {
-                                            'documents': [batch_result]
-                                        }
-                                    else:
-                                        print(f"   ❌ Cannot auto-fix: Response format unrecognized", file=sys.stderr)
-                                        print(f"   This batch will fallback to individual processing", file=sys.stderr)
-                                        raise ValueError("Missing 'documents' array in response")
-                            
-                                print(f"✅ Batch {batch_num} complete:", file=sys.stderr)
-                                
-                                # Validate: Check if all pages are covered
-                                total_pages_in_batch = len(batch_paths)
-                                pages_returned = set()
-                                
-                                for doc in batch_result.get('documents', []):
-                                    doc_type = doc.get('type', 'UNKNOWN')
-                                    pages = doc.get('pages', [])
-                                    confidence = doc.get('confidence', 0)
-                                    print(f"   📄 {doc_type}: {len(pages)} pages, confidence {confidence:.0%}", file=sys.stderr)
-                                    
-                                    # Collect all page indices
-                                    for p in pages:
-                                        pages_returned.add(p)
-                                
-                                # Check for missing pages
-                                expected_pages = set(range(total_pages_in_batch))
-                                missing_pages = expected_pages - pages_returned
-                                
-                                if missing_pages:
-                                    print(f"   ⚠️ WARNING: AI didn't return {len(missing_pages)} pages: {sorted(missing_pages)}", file=sys.stderr)
-                                    print("      These files will be processed by fallback", file=sys.stderr)
-                                else:
-                                    print(f"   ✅ All {total_pages_in_batch} pages accounted for", file=sys.stderr)
-                                
-                                # Map results back to original file paths WITH sequential naming
-                                batch_results_with_sequential = []
-                                
-                                for doc in batch_result.get('documents', []):
-                                    doc_type = doc.get('type', 'UNKNOWN')
-                                    doc_confidence = doc.get('confidence', 0.5)
-                                    doc_reasoning = doc.get('reasoning', '')
-                                    doc_metadata = doc.get('metadata', {})
-                                    
-                                    # DEBUG: Log metadata for GCN
-                                    if doc_type == 'GCN':
-                                        print(f"\n🔍 DEBUG - GCN Metadata:", file=sys.stderr)
-                                        print(f"   Type: {doc_type}", file=sys.stderr)
-                                        print(f"   Metadata: {doc_metadata}", file=sys.stderr)
-                                        print(f"   Has color: {'color' in doc_metadata}", file=sys.stderr)
-                                        print(f"   Has issue_date: {'issue_date' in doc_metadata}", file=sys.stderr)
-                                        if doc_metadata:
-                                            print(f"   color value: {doc_metadata.get('color', 'MISSING')}", file=sys.stderr)
-                                            print(f"   issue_date value: {doc_metadata.get('issue_date', 'MISSING')}", file=sys.stderr)
-                                        print(f"\n", file=sys.stderr)
-                                    
-                                    for page_idx in doc.get('pages', []):
-                                        if page_idx < len(batch_paths):
-                                            file_path = batch_paths[page_idx]
-                                            file_name = os.path.basename(file_path)
-                                            
-                                            # Determine if this file has title (high confidence, not UNKNOWN)
-                                            has_title = (doc_confidence >= 0.8 and doc_type != 'UNKNOWN')
-                                            
-                                            # Apply sequential naming logic
-                                            final_type = doc_type
-                                            final_confidence = doc_confidence
-                                            applied_sequential = False
-                                            
-                                            # If file is UNKNOWN or low confidence AND we have lastKnown
-                                            if (doc_type == 'UNKNOWN' or doc_confidence < 0.5) and current_last_known:
-                                                final_type = current_last_known['short_code']
-                                                final_confidence = current_last_known['confidence']
-                                                applied_sequential = True
-                                                print(f"   🔄 Sequential: {file_name} ({doc_type} {doc_confidence:.0%}) → {final_type}", file=sys.stderr)
-                                            
-                                            # Update lastKnown if this file has good classification
-                                            if doc_type != 'UNKNOWN' and doc_confidence >= 0.7 and has_title:
-                                                current_last_known = {
-                                                    'short_code': doc_type,
-                                                    'confidence': doc_confidence,
-                                                    'has_title': True
-                                                }
-                                                print(f"   📌 Updated lastKnown: {doc_type} ({doc_confidence:.0%})", file=sys.stderr)
-                                            
-                                            processed_files.add(file_path)
-                                            batch_results_with_sequential.append({
-                                                'file_path': file_path,
-                                                'file_name': file_name,
-                                                'short_code': final_type,
-                                                'confidence': final_confidence,
-                                                'reasoning': doc_reasoning,
-                                                'metadata': doc_metadata,
-                                                'method': 'batch_fixed',
-                                                'batch_num': batch_num,
-                                                'applied_sequential': applied_sequential,
-                                                'original_classification': doc_type if applied_sequential else None
-                                            })
-                                
-                                all_results.extend(batch_results_with_sequential)
-                            except json.JSONDecodeError as je:
-                                print(f"⚠️ JSON decode error in batch {batch_num}: {je}", file=sys.stderr)
-                                print(f"   Response text: {response_text[:500]}...", file=sys.stderr)
-                        else:
-                            print(f"⚠️ No valid JSON in response for batch {batch_num}", file=sys.stderr)
-            
-        except Exception as e:
-            print(f"❌ Batch {batch_num} error: {e}", file=sys.stderr)
-            import traceback
-            traceback.print_exc(file=sys.stderr)
-        
-        # Move to next batch (increment by batch_size, not batch_end)
-        current_idx += batch_size
+                futures = [
+                    executor.submit(send_batch, batch_num, batch_start, batch_end)
+                    for batch_num, (batch_start, batch_end) in enumerate(batch_ranges, 1)
+                ]
+                for batch_num, ((batch_start, batch_end), future) in enumerate(zip(batch_ranges, futures), 1):
+                    yield batch_num, image_paths[batch_start:batch_end], future.result()
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for batch_num, (batch_start, batch_end) in enumerate(batch_ranges, 1):
+                sent = send_batch(batch_num, batch_start, batch_end)
+
+                # Add delay between batches to avoid rate limiting
+                if sent is not None and batch_num < total_batches:
+                    inter_batch_delay = 5  # 5 seconds between batches
+                    print(f"⏸️ Waiting {inter_batch_delay}s before next batch...", file=sys.stderr)
+                    time.sleep(inter_batch_delay)
+
+                yield batch_num, image_paths[batch_start:batch_end], sent
+
+    try:
+        for batch_num, batch_paths, sent in iter_batch_responses():
+            if sent is None:
+                continue
+
+            try:
+                response, result_data = sent
+                documents = parse_batch_documents(response, result_data, batch_num, batch_paths)
+                if documents is None:
+                    continue
+
+                # Map results back to original file paths WITH sequential naming
+                batch_results_with_sequential, current_last_known = apply_sequential_naming(
+                    documents, batch_paths, batch_num, current_last_known
+                )
+                processed_files.update(r['file_path'] for r in batch_results_with_sequential)
+                all_results.extend(batch_results_with_sequential)
+
+            except Exception as e:
+                print(f"❌ Batch {batch_num} error: {e}", file=sys.stderr)
+                import traceback
+                traceback.print_exc(file=sys.stderr)
+    finally:
+        encode_pool.shutdown()
     
     print(f"\n{'='*80}", file=sys.stderr)
     print(f"✅ BATCH MODE 1 COMPLETE: {len(all_results)} files processed", file=sys.stderr)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed classification cache
+
+Stores AI classification results in a local SQLite file keyed by
+sha256(preprocessed image bytes) + model + prompt hash, so re-scanning the
+same pages (after a crash, a rules tweak or a re-run) skips the network.
+The cache is size-bounded with least-recently-used eviction.
+
+Settings (environment):
+    CLASSIFICATION_CACHE         'true' / 'false' (default: true)
+    CLASSIFICATION_CACHE_MAX_MB  Max cache size in MB (default: 200)
+    USER_DATA_PATH               Folder for the cache file (same as rules overrides)
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+_conn = None
+_lock = threading.Lock()
+_puts_since_evict = 0
+
+# Check total size every N writes instead of on every write
+EVICT_CHECK_INTERVAL = 50
+
+
+def is_cache_enabled() -> bool:
+    return os.environ.get('CLASSIFICATION_CACHE', 'true').lower() == 'true'
+
+
+def get_cache_path() -> Path:
+    user_data_path = os.environ.get('USER_DATA_PATH', str(Path.home() / '.90daychonhanh'))
+    return Path(user_data_path) / 'classification_cache.sqlite'
+
+
+def _get_connection():
+    global _conn
+    if _conn is None:
+        cache_path = get_cache_path()
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(cache_path), check_same_thread=False, timeout=10)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            " key TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON classifications(last_access)")
+        _conn.commit()
+    return _conn
+
+
+def make_cache_key(image_bytes: bytes, model: str, prompt_text: str) -> str:
+    """Build a cache key from the exact bytes sent to the model, the model and the prompt"""
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    prompt_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()[:16]
+    return f"{image_hash}:{model}:{prompt_hash}"
+
+
+def get_cached_result(key: str):
+    """
+    Return a cached classification result, or None on miss
+
+    Hits are marked with cache_hit=True and zero token usage.
+    """
+    if not is_cache_enabled():
+        return None
+    try:
+        with _lock:
+            conn = _get_connection()
+            row = conn.execute("SELECT result FROM classifications WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE classifications SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        result = json.loads(row[0])
+        result['cache_hit'] = True
+        result['usage'] = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        return result
+    except Exception as e:
+        print(f"⚠️ Classification cache read failed: {e}", file=sys.stderr)
+        return None
+
+
+def store_result(key: str, result: dict):
+    """Store a successful classification result (ERROR results are never cached)"""
+    global _puts_since_evict
+    if not is_cache_enabled() or not result or result.get('short_code') == 'ERROR':
+        return
+    try:
+        payload = json.dumps({k: v for k, v in result.items() if k != 'cache_hit'}, ensure_ascii=False)
+        with _lock:
+            conn = _get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO classifications (key, result, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time())
+            )
+            conn.commit()
+            _puts_since_evict += 1
+            if _puts_since_evict >= EVICT_CHECK_INTERVAL:
+                _puts_since_evict = 0
+                _evict(conn)
+    except Exception as e:
+        print(f"⚠️ Classification cache write failed: {e}", file=sys.stderr)
+
+
+def _evict(conn):
+    """Drop least-recently-used entries until the cache is below 90% of its max size"""
+    max_bytes = float(os.environ.get('CLASSIFICATION_CACHE_MAX_MB', '200')) * 1024 * 1024
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM classifications").fetchone()[0]
+    if total <= max_bytes:
+        return
+
+    target = max_bytes * 0.9
+    removed = 0
+    for key, size in conn.execute("SELECT key, size FROM classifications ORDER BY last_access ASC").fetchall():
+        if total <= target:
+            break
+        conn.execute("DELETE FROM classifications WHERE key = ?", (key,))
+        total -= size
+        removed += 1
+    conn.commit()
+    print(f"🧹 Classification cache: evicted {removed} entries", file=sys.stderr)
+
+
+def get_stats() -> dict:
+    with _lock:
+        conn = _get_connection()
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM classifications").fetchone()
+    return {"entries": count, "size_mb": round(total / (1024 * 1024), 2), "path": str(get_cache_path())}
+
+
+def clear_cache() -> dict:
+    with _lock:
+        conn = _get_connection()
+        conn.execute("DELETE FROM classifications")
+        conn.commit()
+    return {"success": True}
+
+
+if __name__ == '__main__':
+    # CLI: python classification_cache.py stats|clear
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'clear':
+        print(json.dumps(clear_cache()))
+    else:
+        print(json.dumps(get_stats()))
@@ -9,6 +9,7 @@ import sys
 import base64
 from PIL import Image
 import io
+from classification_cache import make_cache_key, get_cached_result, store_result
 
 # Valid document codes - MUST match rule_classifier.py
 # Total: 98 valid codes (95 from classifier + GCNC + GCNM + GCN)
@@ -165,6 +166,14 @@ def classify_document_gemini_flash(image_path, api_key, crop_top_percent=1.0, mo
         # Use simplified prompt for Flash Lite
         prompt_text = get_classification_prompt_lite() if model_type == 'gemini-flash-lite' else get_classification_prompt()
         
+        # Content-addressed cache: same bytes + model + prompt = same answer
+        cache_key = make_cache_key(pdf_content if is_pdf else image_content, model_name, prompt_text)
+        cached = get_cached_result(cache_key)
+        if cached:
+            print(f"⚡ Cache hit ({model_name}): {cached.get('short_code')} - skipping API call", file=sys.stderr)
+            cached['resize_info'] = resize_info
+            return cached
+        
         payload = {
             "contents": [{
                 "parts": [
@@ -342,6 +351,7 @@ def classify_document_gemini_flash(image_path, api_key, crop_top_percent=1.0, mo
                     # Add usage and resize info
                     classification['usage'] = usage_info
                     classification['resize_info'] = resize_info
+                    store_result(cache_key, classification)
                     return classification
                 else:
                     print(f"⚠️ No text in response parts. Candidate: {candidate}", file=sys.stderr)
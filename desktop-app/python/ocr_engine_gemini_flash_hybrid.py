@@ -228,6 +228,7 @@ def classify_document_gemini_flash_hybrid(
             tier1_result['tier2_error_reason'] = 'Parse failed or UNKNOWN with lower confidence'
             tier1_result['escalation_reason'] = escalation_reason
             tier1_result['cost_estimate'] = 'medium'  # Both tiers used but Tier 1 kept
+            tier1_result['cache_hit'] = bool(tier1_result.get('cache_hit') and tier2_result.get('cache_hit'))
             
             print(f"\n💰 COST SUMMARY:", file=sys.stderr)
             print(f"   ├─ Tier 1 (Flash Lite): ~$0.08/1K", file=sys.stderr)
@@ -261,6 +262,7 @@ def classify_document_gemini_flash_hybrid(
         tier2_result['escalation_reason'] = escalation_reason
         tier2_result['cost_estimate'] = 'medium'  # Both tiers used
         tier2_result['confidence_improvement'] = tier2_confidence - tier1_confidence
+        tier2_result['cache_hit'] = bool(tier1_result.get('cache_hit') and tier2_result.get('cache_hit'))
         
         print(f"\n💰 COST SUMMARY:", file=sys.stderr)
         print(f"   ├─ Tier 1 (Flash Lite): ~$0.08/1K", file=sys.stderr)
@@ -10,6 +10,7 @@ import base64
 import os
 from PIL import Image
 import io
+from classification_cache import make_cache_key, get_cached_result, store_result
 
 # Valid document codes - MUST match with Gemini engine
 VALID_DOCUMENT_CODES = {
@@ -142,6 +143,14 @@ def classify_document_openai_vision(image_path, api_key, enable_resize=True, max
         # Get classification prompt
         prompt_text = get_classification_prompt()
         
+        # Content-addressed cache: same bytes + model + prompt = same answer
+        cache_key = make_cache_key(image_content, "gpt-4o-mini", prompt_text)
+        cached = get_cached_result(cache_key)
+        if cached:
+            print(f"⚡ Cache hit (gpt-4o-mini): {cached.get('short_code')} - skipping API call", file=sys.stderr)
+            cached['resize_info'] = resize_info
+            return cached
+        
         # Create request payload
         payload = {
             "model": "gpt-4o-mini",
@@ -284,6 +293,7 @@ def classify_document_openai_vision(image_path, api_key, enable_resize=True, max
                 classification['usage'] = usage_info
                 classification['resize_info'] = resize_info
                 classification['method'] = "openai_gpt4o_mini_vision"
+                store_result(cache_key, classification)
                 return classification
             else:
                 print(f"⚠️ No content in message. Choice: {choice}", file=sys.stderr)
@@ -280,6 +280,8 @@ def process_document(file_path: str, ocr_engine_type: str = 'tesseract', cloud_a
             print(f"⏱️ Result: {result.get('short_code')} (confidence: {result.get('confidence'):.2f}, tier: {tier_used}, time: {scan_time:.1f}s)", file=sys.stderr)
             
             method_used = "gemini_hybrid_two_tier"
+            if result.get('cache_hit'):
+                method_used += "_cache_hit"
             
             # Check for errors
             if result.get("short_code") == "ERROR":
@@ -404,6 +406,8 @@ def process_document(file_path: str, ocr_engine_type: str = 'tesseract', cloud_a
                 }
 
             method_used = "openai_gpt4o_mini_vision"
+            if result.get('cache_hit'):
+                method_used += "_cache_hit"
             short_code = result.get("short_code", "UNKNOWN")
 
             # Code alias mapping (same as Gemini)
@@ -548,6 +552,8 @@ def process_document(file_path: str, ocr_engine_type: str = 'tesseract', cloud_a
                     result["reasoning"] = f"Text pattern found at {title_position}, not a main title"
 
                 method_used = "gemini_position_aware"
+                if result.get('cache_hit'):
+                    method_used += "_cache_hit"
 
                 # Map Gemini result to rule_classifier format
                 short_code = result.get("short_code", "UNKNOWN")
@@ -875,10 +881,94 @@ def process_document(file_path: str, ocr_engine_type: str = 'tesseract', cloud_a
         }
 
 
+def handle_worker_request(request: dict) -> dict:
+    """
+    Handle one worker-mode request and return its result dict
+    """
+    op = request.get('op', 'process')
+
+    if op == 'ping':
+        return {"success": True, "pid": os.getpid()}
+
+    if op == 'detect_color':
+        from color_detector import detect_gcn_border_color
+        return {"success": True, "result": detect_gcn_border_color(request.get('file_path', ''))}
+
+    if op != 'process':
+        return {"success": False, "error": f"Unknown worker op: {op}", "method": "worker_error"}
+
+    file_path = request.get('file_path')
+    if not file_path or not os.path.exists(file_path):
+        return {"success": False, "error": "File not found or invalid path"}
+
+    # Per-request settings (ENABLE_RESIZE, MAX_WIDTH, BATCH_MODE, ...) are read
+    # from os.environ by the engines: apply them for this request only, so the
+    # next request starts from the worker's own environment again
+    request_env = {str(key): str(value) for key, value in (request.get('env') or {}).items()}
+    saved_env = {key: os.environ.get(key) for key in request_env}
+    os.environ.update(request_env)
+    try:
+        return process_document(
+            file_path,
+            request.get('ocr_engine_type') or 'tesseract',
+            request.get('cloud_api_key'),
+            request.get('cloud_endpoint')
+        )
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def serve_worker():
+    """
+    Long-lived worker mode (python process_document.py --worker)
+
+    Reads one JSON request per line from stdin and writes one JSON response
+    per line to stdout: {"id": ..., "result": {...}}. Imports, rule tables
+    and OCR engines stay loaded between requests, so per-file overhead is
+    only the actual OCR/classification work.
+    """
+    protocol_out = sys.stdout
+    # Anything printed while processing must not corrupt the protocol stream
+    sys.stdout = sys.stderr
+
+    print(f"🟢 Python worker ready (pid {os.getpid()})", file=sys.stderr)
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            if request.get('op') == 'shutdown':
+                break
+            result = handle_worker_request(request)
+        except Exception as e:
+            import traceback
+            print(f"❌ Worker error: {traceback.format_exc()}", file=sys.stderr)
+            result = {"success": False, "error": str(e), "method": "worker_error"}
+
+        protocol_out.write(json.dumps({"id": request_id, "result": result}, ensure_ascii=True))
+        protocol_out.write('\n')
+        protocol_out.flush()
+
+    print("🔴 Python worker stopped", file=sys.stderr)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        serve_worker()
+        sys.exit(0)
+
     if len(sys.argv) < 2:
         print(json.dumps({
-            "error": "Usage: python process_document.py <file_path> [ocr_engine_type] [cloud_api_key] [cloud_endpoint]",
+            "error": "Usage: python process_document.py <file_path> [ocr_engine_type] [cloud_api_key] [cloud_endpoint] | --worker",
             "success": False
         }, ensure_ascii=True))
         sys.exit(1)
@@ -13,6 +13,7 @@ function CloudSettings() {
   const [batchMode, setBatchMode] = useState('sequential');
   const [fixedBatchSize, setFixedBatchSize] = useState(8);
   const [smartMaxBatchSize, setSmartMaxBatchSize] = useState(10);
+  const [batchConcurrency, setBatchConcurrency] = useState(1);
 
   useEffect(() => {
     loadSettings();
@@ -41,6 +42,7 @@ function CloudSettings() {
       const batchModeConfig = await window.electronAPI.getConfig('batchMode');
       const fixedBatchSizeConfig = await window.electronAPI.getConfig('batchSize');
       const smartMaxBatchSizeConfig = await window.electronAPI.getConfig('smartMaxBatchSize');
+      const batchConcurrencyConfig = await window.electronAPI.getConfig('batchConcurrency');
       
       setOcrEngine(uiEngine);
       setGeminiKey(gemini);
@@ -50,6 +52,7 @@ function CloudSettings() {
       setBatchMode(batchModeConfig || 'sequential');
       setFixedBatchSize(fixedBatchSizeConfig || 8);
       setSmartMaxBatchSize(smartMaxBatchSizeConfig || 10);
+      setBatchConcurrency(batchConcurrencyConfig || 1);
     } catch (error) {
       console.error('Error loading settings:', error);
     }
@@ -92,6 +95,7 @@ function CloudSettings() {
       await window.electronAPI.setConfig('batchMode', batchMode);
       await window.electronAPI.setConfig('batchSize', fixedBatchSize);
       await window.electronAPI.setConfig('smartMaxBatchSize', smartMaxBatchSize);
+      await window.electronAPI.setConfig('batchConcurrency', batchConcurrency);
 
       alert('✅ Đã lưu cài đặt thành công!');
     } catch (error) {
@@ -954,6 +958,24 @@ function CloudSettings() {
                       <li>• <strong>15-20:</strong> Tối đa tốc độ (có thể bị lỗi với docs phức tạp)</li>
                     </ul>
                   </div>
+
+                  <label className="block text-sm font-medium text-gray-900 mt-4 mb-3">
+                    🚀 Số batch gửi song song: <span className="text-green-700 font-bold">{batchConcurrency}</span>
+                  </label>
+                  <input
+                    type="range"
+                    min="1"
+                    max="4"
+                    step="1"
+                    value={batchConcurrency}
+                    onChange={(e) => setBatchConcurrency(parseInt(e.target.value))}
+                    className="w-full h-2 bg-green-200 rounded-lg appearance-none cursor-pointer"
+                  />
+                  <div className="flex justify-between text-xs text-gray-600 mt-1">
+                    <span>1 (Tuần tự)</span>
+                    <span>2-3 (Đề xuất)</span>
+                    <span>4 (Nhanh nhất, dễ bị 429)</span>
+                  </div>
                 </div>
               )}
             </div>
@@ -3,6 +3,22 @@ import axios from 'axios';
 
 const AuthContext = createContext(null);
 
+// Busy login/register (429/503): wait as long as Retry-After asks, then try again
+const AUTH_MAX_RETRIES = 3;
+
+const postWithRetry = async (url, body) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.post(url, body);
+    } catch (error) {
+      const status = error.response?.status;
+      if ((status !== 429 && status !== 503) || attempt >= AUTH_MAX_RETRIES) throw error;
+      const retryAfter = Number(error.response.headers?.['retry-after']) || 1;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+    }
+  }
+};
+
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem('token'));
@@ -47,7 +63,7 @@ export const AuthProvider = ({ children }) => {
 
   const login = async (username, password) => {
     try {
-      const response = await axios.post(`${API_URL}/api/auth/login`, {
+      const response = await postWithRetry(`${API_URL}/api/auth/login`, {
         username,
         password
       });
@@ -67,7 +83,7 @@ export const AuthProvider = ({ children }) => {
 
   const register = async (email, username, password, fullName) => {
     try {
-      const response = await axios.post(`${API_URL}/api/auth/register`, {
+      const response = await postWithRetry(`${API_URL}/api/auth/register`, {
         email,
         username,
         password,
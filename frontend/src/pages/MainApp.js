@@ -24,6 +24,8 @@ const DocumentScanner = () => {
   const [uploadedFiles, setUploadedFiles] = useState([]);
   const [scanResults, setScanResults] = useState([]);
   const [scanHistory, setScanHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null); // X-Next-Cursor of the last loaded page
+  const [historyLoadingMore, setHistoryLoadingMore] = useState(false);
   const [loading, setLoading] = useState(false);
   const [editingId, setEditingId] = useState(null);
   const [editValue, setEditValue] = useState('');
@@ -47,6 +49,7 @@ const DocumentScanner = () => {
   const [uploadProgress, setUploadProgress] = useState(0);
   const [scanJobId, setScanJobId] = useState(null);
   const [pollingInterval, setPollingInterval] = useState(null);
+  const [folderEventSource, setFolderEventSource] = useState(null);
   
   // History lazy loading
   const [historyLoaded, setHistoryLoaded] = useState(false);
@@ -62,17 +65,37 @@ const DocumentScanner = () => {
   //   fetchScanHistory();
   // }, []);
 
+  // History is paged: the first page on load, older pages on "Tải thêm"
   const fetchScanHistory = async () => {
     try {
       const response = await axios.get(`${API}/scan-history`, {
         headers: getAuthHeaders()
       });
       setScanHistory(response.data);
+      setHistoryCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching scan history:', error);
     }
   };
 
+  const loadMoreHistory = async () => {
+    if (!historyCursor) return;
+    setHistoryLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/scan-history`, {
+        headers: getAuthHeaders(),
+        params: { after: historyCursor }
+      });
+      setScanHistory(prev => prev.concat(response.data));
+      setHistoryCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error loading more scan history:', error);
+      toast.error('Không thể tải thêm lịch sử');
+    } finally {
+      setHistoryLoadingMore(false);
+    }
+  };
+
   // NEW FEATURE 1: RETRY FAILED FILES
   const handleRetry = async (scanId) => {
     setRetryingIds(prev => new Set([...prev, scanId]));
@@ -648,8 +671,12 @@ const DocumentScanner = () => {
       
       toast.success(`✅ Đã bắt đầu quét ${response.data.total_folders} thư mục!`, { duration: 4000 });
       
-      // Start polling for results
-      pollFolderScanStatus(jobId);
+      // Follow progress via server-sent events (falls back to polling)
+      if (response.data.events_url && window.EventSource) {
+        streamFolderScanStatus(jobId, response.data.events_url);
+      } else {
+        pollFolderScanStatus(jobId);
+      }
 
     } catch (error) {
       console.error('Error scanning folder:', error);
@@ -665,6 +692,58 @@ const DocumentScanner = () => {
     }
   };
 
+  const streamFolderScanStatus = (jobId, eventsUrl) => {
+    const source = new EventSource(`${BACKEND_URL}${eventsUrl}`);
+    let status = null;
+    let finished = false;
+
+    const finish = () => {
+      finished = true;
+      source.close();
+      setFolderEventSource(null);
+      setFolderScanLoading(false);
+      setScanJobId(null);
+    };
+    const update = (changes) => {
+      status = { ...status, ...changes };
+      setFolderScanResult(status);
+    };
+
+    source.addEventListener('snapshot', (e) => update(JSON.parse(e.data)));
+    source.addEventListener('folder_started', (e) => {
+      update({ current_folder: JSON.parse(e.data).current_folder });
+    });
+    source.addEventListener('folder_completed', (e) => {
+      const folder = JSON.parse(e.data);
+      update({
+        folder_results: [...(status?.folder_results || []), folder],
+        completed_folders: (status?.completed_folders || 0) + 1
+      });
+      toast.success(`✅ ${folder.folder_name}: ${folder.success_count} files`, { duration: 3000 });
+    });
+    source.addEventListener('progress', (e) => update(JSON.parse(e.data)));
+    source.addEventListener('status', (e) => {
+      update(JSON.parse(e.data));
+      if (status.status === 'completed') {
+        finish();
+        const totalSuccess = status.folder_results.reduce((sum, f) => sum + f.success_count, 0);
+        toast.success(`🎉 Hoàn thành! ${totalSuccess} files quét thành công!`, { duration: 5000 });
+      } else if (status.status === 'error') {
+        finish();
+        toast.error(`❌ Lỗi: ${status.error_message}`, { duration: 8000 });
+      }
+    });
+    source.onerror = () => {
+      // Stream dropped (proxy, network): continue with polling
+      if (finished) return;
+      source.close();
+      setFolderEventSource(null);
+      pollFolderScanStatus(jobId);
+    };
+
+    setFolderEventSource(source);
+  };
+
   const pollFolderScanStatus = (jobId) => {
     const interval = setInterval(async () => {
       try {
@@ -724,6 +803,14 @@ const DocumentScanner = () => {
     };
   }, [pollingInterval]);
 
+  useEffect(() => {
+    return () => {
+      if (folderEventSource) {
+        folderEventSource.close();
+      }
+    };
+  }, [folderEventSource]);
+
   const handleDownloadResult = async () => {
     if (!folderScanResult || !folderScanResult.download_url) {
       toast.error('Không có kết quả để tải');
@@ -762,6 +849,26 @@ const DocumentScanner = () => {
     setUploadProgress(0);
   };
 
+  // Full page image from the blob store (needs the auth header, so fetch it as a blob URL)
+  const openFullImage = async (imageId) => {
+    const previewWindow = window.open('', '_blank'); // Opened synchronously so it is not popup-blocked
+    try {
+      const response = await axios.get(`${API}/scan-image/${imageId}`, {
+        headers: getAuthHeaders(),
+        responseType: 'blob'
+      });
+      const url = URL.createObjectURL(response.data);
+      if (previewWindow) {
+        previewWindow.location.href = url;
+      }
+      setTimeout(() => URL.revokeObjectURL(url), 60000);
+    } catch (error) {
+      if (previewWindow) previewWindow.close();
+      console.error('Error loading full image:', error);
+      toast.error('Không thể tải ảnh gốc');
+    }
+  };
+
   const ResultCard = ({ result, showActions = true, showCheckbox = false }) => {
     const isError = result.short_code === 'ERROR';
     const isRetrying = retryingIds.has(result.id);
@@ -787,11 +894,13 @@ const DocumentScanner = () => {
       )}
       
       <div className="relative aspect-[3/4] bg-muted">
-        {result.image_base64 ? (
+        {result.image_base64 || result.thumbnail_base64 ? (
           <img 
-            src={`data:image/jpeg;base64,${result.image_base64}`} 
+            src={`data:image/jpeg;base64,${result.image_base64 || result.thumbnail_base64}`} 
             alt={result.detected_type}
-            className="w-full h-full object-cover"
+            className={`w-full h-full object-cover ${result.image_id ? 'cursor-zoom-in' : ''}`}
+            onClick={result.image_id ? () => openFullImage(result.image_id) : undefined}
+            title={result.image_id ? 'Xem ảnh gốc' : undefined}
           />
         ) : (
           <div className="w-full h-full flex items-center justify-center bg-red-50">
@@ -1642,6 +1751,14 @@ const DocumentScanner = () => {
                     ))}
                   </div>
                 )}
+                {historyCursor && (
+                  <div className="flex justify-center mt-6">
+                    <Button variant="outline" onClick={loadMoreHistory} disabled={historyLoadingMore}>
+                      {historyLoadingMore && <Loader2 className="h-4 w-4 mr-2 animate-spin" />}
+                      Tải thêm
+                    </Button>
+                  </div>
+                )}
               </CardContent>
             </Card>
           </TabsContent>